@@ -0,0 +1,209 @@
+"""End-to-end exporter benchmark against a simulated device fleet.
+
+Every fleet size runs in a fresh interpreter that imports the real
+`kasa_exporter.main` stack (DeviceRegistry, DeviceExporter, the FastAPI app),
+discovers a SimulatedFleet and measures:
+
+- cycle time: wall time of DeviceExporter.poll_devices (first cycle, which
+  pays the handshakes, reported separately)
+- /metrics render latency: snapshot render (SnapshotCollector.publish) and
+  GET /metrics through the ASGI app
+- CPU per device: process CPU time of the steady-state cycles per device poll
+- RSS per device: resident memory growth from discovery to the last cycle
+
+With --replay the fleet replays traffic captured from real devices
+(KASA_CAPTURE_DIR) instead, multiplied across as many virtual hosts as the
+fleet size asks for and sped up by --speed.
+
+Results are written as JSON (one object per fleet size) so runs can be
+diffed across commits.
+
+    python -m benchmarks.bench_e2e [--devices 10 100 1000] [--cycles 5] [--output bench_e2e.json]
+    python -m benchmarks.bench_e2e --replay captures/ --speed 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from unittest.mock import patch
+
+# Command line options recorded with the results and forwarded to the per-size runs
+PARAMETERS = (
+    "cycles", "renders", "concurrency", "latency", "jitter",
+    "error_rate", "handshake_latency", "handshake_rounds", "replay", "speed",
+)
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def summary(values) -> dict:
+    values = sorted(values)
+    return {
+        "min": values[0],
+        "p50": statistics.median(values),
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "max": values[-1],
+    }
+
+
+async def run_size(size, cycles, renders, plug_options, replay=None, speed=1.0) -> dict:
+    import httpx
+    from benchmarks.bench_workers import quiet_logging
+    from kasa_exporter import main
+    from kasa_exporter.devices.replay import ReplayFleet
+    from kasa_exporter.devices.simulator import SimulatedFleet
+
+    quiet_logging()
+    exporter, registry = main.device_exporter, main.device_registry
+    if replay:
+        fleet = ReplayFleet(replay, size, speed)
+    else:
+        fleet = SimulatedFleet(size, **plug_options)
+    rss_start = rss_bytes()
+    with patch("kasa_exporter.routines.device_registry.Discover.discover", fleet.discover):
+        await registry.discover_devices(exporter.credentials, {})
+
+    first_cycle = await exporter.poll_devices()
+    cycle_times = []
+    cpu_start = time.process_time()
+    for _ in range(cycles):
+        cycle_times.append(await exporter.poll_devices())
+    cpu = time.process_time() - cpu_start
+    rss_end = rss_bytes()
+
+    render_times = []
+    for _ in range(renders):
+        start = time.perf_counter()
+        exporter.snapshot.publish()
+        render_times.append(time.perf_counter() - start)
+
+    request_times = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(renders):
+            start = time.perf_counter()
+            response = await client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+            request_times.append(time.perf_counter() - start)
+            response.raise_for_status()
+        body = await client.get("/metrics")
+
+    await exporter.connection_pool.close_all()
+    return {
+        "devices": size,
+        "cycles": cycles,
+        "first_cycle_seconds": first_cycle,
+        "cycle_seconds": summary(cycle_times),
+        "render_seconds": summary(render_times),
+        "metrics_request_seconds": summary(request_times),
+        "metrics_bytes": len(body.content),
+        "cpu_seconds_per_device_poll": cpu / (cycles * size),
+        "rss_bytes": rss_end,
+        "rss_bytes_per_device": (rss_end - rss_start) / size,
+        "fleet": fleet.stats(),
+    }
+
+
+def child(args):
+    # Set before the exporter modules read their configuration at import
+    os.environ.update(
+        {
+            "KASA_DISCOVERY_CACHE": "",
+            "KASA_SAMPLE_RING": "",
+            "PUSH_GATEWAY_DISABLED": "true",
+            "KASA_POLL_CONCURRENCY": str(args.concurrency),
+        }
+    )
+    plug_options = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "handshake_latency": args.handshake_latency,
+        "handshake_rounds": args.handshake_rounds,
+    }
+    result = asyncio.run(
+        run_size(args.child, args.cycles, args.renders, plug_options, args.replay, args.speed)
+    )
+    print(json.dumps(result))
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--cycles", type=int, default=5, help="steady-state cycles per size")
+    parser.add_argument("--renders", type=int, default=20, help="renders and requests per size")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--handshake-latency", type=float, default=0.05)
+    parser.add_argument("--handshake-rounds", type=int, default=1000)
+    parser.add_argument("--replay", help="directory of device traffic captures to replay")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up, inf: no delays")
+    parser.add_argument("--output", default="bench_e2e.json")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args)
+        return
+
+    forwarded = [
+        f"--{name.replace('_', '-')}={getattr(args, name)}"
+        for name in PARAMETERS
+        if getattr(args, name) is not None
+    ]
+    results = []
+    for size in args.devices:
+        # A fresh process per size keeps RSS and registry state independent
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_e2e", f"--child={size}", *forwarded],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        # structlog prints to stdout as well, the result is the last line
+        result = json.loads(out.strip().splitlines()[-1])
+        results.append(result)
+        print(
+            f"{size:5d} devices  cycle p50 {result['cycle_seconds']['p50'] * 1000:8.1f} ms"
+            f"  render p50 {result['render_seconds']['p50'] * 1000:7.2f} ms"
+            f"  /metrics p50 {result['metrics_request_seconds']['p50'] * 1000:7.2f} ms"
+            f"  cpu/poll {result['cpu_seconds_per_device_poll'] * 1e6:7.1f} us"
+            f"  rss/device {result['rss_bytes_per_device'] / 1024:6.1f} KiB"
+        )
+
+    report = {
+        "benchmark": "e2e",
+        "timestamp": time.time(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parameters": {
+            name: getattr(args, name)
+            for name in PARAMETERS
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Startup cost of the exporter entry points.
+
+Every measurement runs in fresh interpreters, for kasa_exporter.slim and
+kasa_exporter.main:
+
+- import time: wall time of importing the entry point module
+- first /metrics: from spawning the process to the first 200 on /metrics
+- ready: from spawning the process to the device stack being loaded
+  (/readyz for slim, the first /metrics for main which loads it up front)
+- idle RSS: resident memory once ready, with no device known
+
+Discovery, the discovery cache and the sample ring are pointed at nothing so
+only the exporter itself is measured. BUDGETS are the limits the slim entry
+point is held to by kasa_exporter/tests/test_slim.py: about twice the times
+and a third more than the memory it measures on a small x86 VM, so CI noise
+does not trip them.
+
+    python -m benchmarks.bench_startup [--runs 5] [--output bench_startup.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BUDGETS = {
+    "kasa_exporter.slim": {
+        "import_seconds": 0.25,
+        "first_metrics_seconds": 0.5,
+        "idle_rss_bytes": 80 * 1024 * 1024,
+    },
+}
+
+READY_PATHS = {"kasa_exporter.slim": "/readyz", "kasa_exporter.main": "/metrics"}
+
+ENV = {
+    "KASA_DISCOVERY_CACHE": "",
+    "KASA_SAMPLE_RING": "",
+    # One discovery right away is part of a normal start, not repeated while measuring
+    "KASA_DISCOVERY_INTERVAL": "3600",
+    "KASA_LOG_LEVEL": "WARNING",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_status(port, path) -> int:
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+    try:
+        connection.request("GET", path)
+        return connection.getresponse().status
+    except OSError:
+        return 0
+    finally:
+        connection.close()
+
+
+def wait_for(port, path, process, deadline) -> float:
+    while time.monotonic() < deadline:
+        if get_status(port, path) == 200:
+            return time.monotonic()
+        if process.poll() is not None:
+            raise RuntimeError(f"Exporter exited with {process.returncode}")
+        time.sleep(0.002)
+    raise TimeoutError(f"No 200 on {path}")
+
+
+def rss_bytes(pid) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def import_seconds(module) -> float:
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    env = {**os.environ, **ENV}
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def serve_once(module, timeout=30.0) -> dict:
+    port = free_port()
+    env = {**os.environ, **ENV, "METRICS_PORT": str(port)}
+    spawned = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, "-m", module], env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = spawned + timeout
+        first_metrics = wait_for(port, "/metrics", process, deadline)
+        ready = wait_for(port, READY_PATHS[module], process, deadline)
+        # Let the first discovery and snapshot settle before reading memory
+        time.sleep(1.0)
+        return {
+            "first_metrics_seconds": first_metrics - spawned,
+            "ready_seconds": ready - spawned,
+            "idle_rss_bytes": rss_bytes(process.pid),
+        }
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def measure(module, runs=3) -> dict:
+    """Median of each measurement over runs fresh interpreters."""
+    samples = [dict(serve_once(module), import_seconds=import_seconds(module)) for _ in range(runs)]
+    return {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+
+
+def over_budget(module, result) -> dict:
+    budget = BUDGETS.get(module, {})
+    return {key: (result[key], limit) for key, limit in budget.items() if result[key] > limit}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modules", nargs="+", default=list(READY_PATHS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        result = results[module] = measure(module, args.runs)
+        print(
+            f"{module:20s} import {result['import_seconds'] * 1000:7.1f} ms"
+            f"  first /metrics {result['first_metrics_seconds'] * 1000:7.1f} ms"
+            f"  ready {result['ready_seconds'] * 1000:7.1f} ms"
+            f"  idle RSS {result['idle_rss_bytes'] / 2**20:6.1f} MiB"
+        )
+        for key, (value, limit) in over_budget(module, result).items():
+            print(f"  over budget: {key} {value:.3f} > {limit}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
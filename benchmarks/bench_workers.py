@@ -0,0 +1,165 @@
+"""Polling throughput (devices per second) against the number of worker processes.
+
+Devices are simulated with an update() that burns CPU the way a real poll
+does (KLAP key derivation and JSON encoding/decoding of the device state)
+without network I/O, so the numbers show how polling scales across cores.
+
+    python -m benchmarks.bench_workers [--devices 200] [--workers 1 2 4] [--duration 5]
+"""
+import argparse
+import asyncio
+from datetime import datetime, timezone
+import hashlib
+import json
+import os
+import time
+
+from kasa_exporter.utils.log_config import configure_logging
+
+
+def quiet_logging():
+    # The exporter entry points configure INFO logging, the per-poll log line
+    # would dominate the measurement
+    configure_logging("WARNING")
+
+SYSINFO = {
+    "device_id": "0" * 40,
+    "fw_ver": "1.1.3 Build 240523 Rel.175054",
+    "hw_ver": "1.0",
+    "model": "KP125M(US)",
+    "nickname": "cGx1Zw==",
+    "rssi": -50,
+    "signal_level": 3,
+    "ssid": "aG9tZQ==",
+    "device_on": True,
+    "on_time": 1234,
+    "energy_usage": {"current_power": 12500, "today_energy": 200, "month_energy": 4000},
+}
+
+
+class FakeFeature:
+    def __init__(self, value):
+        self.value = value
+
+
+class CpuBoundPlug:
+    """KP125M stand-in whose update() costs CPU like a KLAP round-trip."""
+
+    model = "KP125M"
+
+    def __init__(self, host, rounds):
+        self.host = self.alias = self.device_id = host
+        self.rounds = rounds
+        self.features = {}
+        self.state_information = {}
+
+    async def update(self):
+        # Session crypto and response parsing
+        hashlib.pbkdf2_hmac("sha256", self.host.encode(), b"kasa", self.rounds)
+        info = json.loads(json.dumps({"result": SYSINFO}))["result"]
+        watts = info["energy_usage"]["current_power"] / 1000
+        values = {
+            "signal_level": info["signal_level"],
+            "state": info["device_on"],
+            "rssi": info["rssi"],
+            "ssid": "home",
+            "on_since": datetime.now(timezone.utc),
+            "auto_off_enabled": False,
+            "auto_off_minutes": 0,
+            "auto_off_at": None,
+            "cloud_connection": True,
+            "current_consumption": watts,
+            "consumption_today": info["energy_usage"]["today_energy"] / 1000,
+            "consumption_this_month": info["energy_usage"]["month_energy"] / 1000,
+            "auto_update_enabled": True,
+            "update_available": False,
+            "current_firmware_version": info["fw_ver"],
+            "available_firmware_version": info["fw_ver"],
+            "led": True,
+        }
+        self.features = {key: FakeFeature(value) for key, value in values.items()}
+        self.state_information = {"Current consumption": watts}
+
+    async def disconnect(self):
+        pass
+
+
+def make_device(entry, credentials=None):
+    quiet_logging()
+    return CpuBoundPlug(entry["host"], int(os.getenv("BENCH_PBKDF2_ROUNDS", 2000)))
+
+
+class Entry:
+    """Registry placeholder the WorkerPool serializes into a cache entry."""
+
+    def __init__(self, host):
+        self.host = host
+
+
+async def measure(devices, workers, duration):
+    from prometheus_client import CollectorRegistry
+
+    from kasa_exporter.routines import workers as workers_module
+    from kasa_exporter.routines.device_registry import DeviceRegistry
+    from kasa_exporter.routines.exporter import DeviceExporter
+    from kasa_exporter.routines.workers import WorkerPool
+
+    quiet_logging()
+    collector_registry = CollectorRegistry()
+    registry = DeviceRegistry(collector_registry)
+    registry.discovery_cache.path = None
+    registry.devices = {f"10.0.{i // 250}.{i % 250}": Entry(f"10.0.{i // 250}.{i % 250}") for i in range(devices)}
+    exporter = DeviceExporter(registry, collector_registry)
+    pool = WorkerPool(registry, exporter, workers=workers)
+    pool.report_interval = 1.0
+
+    serialize = workers_module.DiscoveryCache.serialize_device
+    workers_module.DiscoveryCache.serialize_device = staticmethod(lambda device: {"host": device.host})
+    pool.start()
+    task = asyncio.create_task(pool.run())
+    polls = lambda: sum(
+        collector_registry.get_sample_value("device_worker_polls_total", {"worker": str(w)}) or 0
+        for w in range(workers)
+    )
+    try:
+        # Wait until every worker is up and polling before timing
+        while len(pool.families) < workers:
+            await asyncio.sleep(0.1)
+        start_polls, start = polls(), time.monotonic()
+        await asyncio.sleep(duration)
+        return (polls() - start_polls) / (time.monotonic() - start)
+    finally:
+        task.cancel()
+        pool.stop()
+        workers_module.DiscoveryCache.serialize_device = serialize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    os.environ.update(
+        {
+            "KASA_WORKER_DEVICE_FACTORY": "benchmarks.bench_workers:make_device",
+            # Poll as fast as the workers can go, one cycle covers the whole slice
+            "KASA_POLL_INTERVAL": "0.05",
+            "KASA_POLL_MIN_INTERVAL": "0.01",
+            "KASA_POLL_JITTER": "0",
+            "KASA_POLL_BATCH_WINDOW": "0.05",
+            "KASA_SAMPLE_RING": "",
+            "KASA_DISCOVERY_CACHE": "",
+        }
+    )
+    print(f"{args.devices} simulated devices, {os.cpu_count()} cores")
+    baseline = None
+    for workers in args.workers:
+        rate = asyncio.run(measure(args.devices, workers, args.duration))
+        baseline = baseline or rate
+        print(f"{workers:3d} workers: {rate:9.0f} devices/s  ({rate / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
-from datetime import date, datetime
+from datetime import datetime
+import os
 
 import structlog
 
 from ..utils.time_of_use_calc import TIME_OF_USE_CONFIG, TimeOfUseCalc
 from .prom_device_extractor import (DimensionsType,
                                     PrometheusDeviceExtractor, PromMetricType)
+from .refresh_tiers import parse_tiers
 
 logger = structlog.get_logger()
 
@@ -16,114 +18,125 @@ dimensions: DimensionsType = {
 
 calculator = TimeOfUseCalc(TIME_OF_USE_CONFIG)
 
+
+def hours_since(value: datetime) -> float:
+    return (datetime.now() - value.replace(tzinfo=None)).total_seconds() / 3600
+
+
+# Seconds between refreshes per tier: power follows the poll interval, energy
+# totals and link quality once a minute, configuration and firmware hourly
+DEFAULT_TIERS = {"power": 0, "energy": 60, "inventory": 3600}
+# Shared by the built-in extractors, a configuration reload updates it in place
+tiers = parse_tiers(os.getenv("KASA_REFRESH_TIERS", ""), DEFAULT_TIERS)
+
 metrics = {
     "signal_level": {
+        "tier": "energy",
         "type": PromMetricType.GAUGE,
-        "getter": lambda d: d.features["signal_level"].value,
+        "feature": "signal_level",
     },
     "state": {
+        "tier": "power",
         "type": PromMetricType.ENUM,
-        "getter": lambda d: "on" if d.features["state"].value else "off",
+        "feature": "state",
         "states": ["on", "off"],
     },
     "rssi": {
+        "tier": "energy",
         "type": PromMetricType.GAUGE,
-        "getter": lambda d: d.features["rssi"].value,
+        "feature": "rssi",
     },
     "ssid": {
+        "tier": "inventory",
         "type": PromMetricType.INFO,
-        "getter": lambda d: {"ssid": d.features["ssid"].value},
+        "feature": "ssid",
     },
     "on_since": {
+        "tier": "energy",
         "type": PromMetricType.GAUGE,
-        "getter": lambda d: (
-            datetime.now() - d.features["on_since"].value.replace(tzinfo=None)
-        ).total_seconds()
-        / 3600,
+        "feature": "on_since",
+        "transform": hours_since,
     },
     "auto_off_enabled": {
+        "tier": "inventory",
         "type": PromMetricType.ENUM,
-        "getter": lambda d: (
-            "enabled" if d.features["auto_off_enabled"].value else "disabled"
-        ),
+        "feature": "auto_off_enabled",
         "states": ["enabled", "disabled"],
     },
     "auto_off_minutes": {
+        "tier": "inventory",
         "type": PromMetricType.GAUGE,
-        "getter": lambda d: d.features["auto_off_minutes"].value,
+        "feature": "auto_off_minutes",
     },
     "auto_off_at": {
+        "tier": "inventory",
         "type": PromMetricType.INFO,
-        "getter": lambda d: {"auto_off_at": str(d.features["auto_off_at"].value)},
+        "feature": "auto_off_at",
     },
     "cloud_connection": {
+        "tier": "inventory",
         "type": PromMetricType.ENUM,
-        "getter": lambda d: (
-            "connected" if d.features["cloud_connection"].value else "disconnected"
-        ),
+        "feature": "cloud_connection",
         "states": ["connected", "disconnected"],
     },
     "current_consumption": {
+        "tier": "power",
         "type": PromMetricType.GAUGE,
-        "getter": lambda d: d.features["current_consumption"].value,
+        "feature": "current_consumption",
     },
     "consumption_today": {
+        "tier": "energy",
         "type": PromMetricType.GAUGE,
-        "getter": lambda d: d.features["consumption_today"].value,
+        "feature": "consumption_today",
     },  # Histogram for distribution over the day
     "consumption_this_month": {
+        "tier": "energy",
         "type": PromMetricType.HISTOGRAM,
-        "getter": lambda d: d.features["consumption_this_month"].value,
+        "feature": "consumption_this_month",
     },  # Summary for distribution over the month
     "auto_update_enabled": {
+        "tier": "inventory",
         "type": PromMetricType.ENUM,
-        "getter": lambda d: (
-            "enabled" if d.features["auto_update_enabled"].value else "disabled"
-        ),
+        "feature": "auto_update_enabled",
         "states": ["enabled", "disabled"],
     },
     "update_available": {
+        "tier": "inventory",
         "type": PromMetricType.ENUM,
-        "getter": lambda d: (
-            "available" if d.features["update_available"].value else "not_available"
-        ),
+        "feature": "update_available",
         "states": ["available", "not_available"],
     },
     "current_firmware_version": {
+        "tier": "inventory",
         "type": PromMetricType.INFO,
-        "getter": lambda d: {
-            "current_firmware_version": d.features["current_firmware_version"].value
-        },
+        "feature": "current_firmware_version",
     },
     "available_firmware_version": {
+        "tier": "inventory",
         "type": PromMetricType.INFO,
-        "getter": lambda d: {
-            "available_firmware_version": d.features["available_firmware_version"].value
-        },
+        "feature": "available_firmware_version",
     },
     "led": {
+        "tier": "inventory",
         "type": PromMetricType.ENUM,
-        "getter": lambda d: "on" if d.features["led"].value else "off",
+        "feature": "led",
         "states": ["on", "off"],
     },
     "update_attempts": {
+        "tier": "inventory",
         "type": PromMetricType.COUNTER,
         "getter": lambda d: int(d.features.get("update_attempts", 0)),
     },  # Counter for update attempts
     "consumption_cost": {  # this can be moved to a derived label on the current consumption metric
+        "tier": "power",
         "type": PromMetricType.GAUGE,
-        "getter": lambda device: calculator.calc_rate(
-            device.state_information["Current consumption"]
-        ),
+        "feature": "current_consumption",
+        "transform": calculator.calc_rate,
         "derive_labels": {
             # not the best way to do this but works well enough.  (we still need to know these upfront in register)
-            "season": lambda _d: calculator.get_current_season(),
-            # "rate": lambda _d: calculator.get_rate_for_time(
-            #     date.today(), calculator.get_current_season()
-            # ),
-            "rate_class": lambda _d: calculator.get_rate_name(
-                date.today(), calculator.get_current_season()
-            ),
+            # current_tariff() is memoized per minute, every device shares one table lookup
+            "season": lambda _d: calculator.current_tariff().season,
+            "rate_class": lambda _d: calculator.current_tariff().period,
         },
     },
 }
@@ -131,5 +144,5 @@ metrics = {
 Extractor = PrometheusDeviceExtractor(
     metrics=metrics, 
     dimensions=dimensions,
-    # is_device: lambda device: device.model == "KP125M"
+    tiers=tiers,
 )
@@ -0,0 +1,155 @@
+"""Which extractor handles a device.
+
+Extractors are registered for models (the name before the region suffix,
+KP125M(US) -> KP125M) and device families (python-kasa's DeviceType values:
+plug, strip, bulb, ...). A model match wins over the family, devices
+matching neither get the generic extractor built from their features.
+
+More extractors are declared in TOML files, KASA_EXTRACTOR_SPECS lists the
+files (or directories of *.toml files), comma separated:
+
+    name = "HS110"
+    models = ["HS110", "KP115"]
+
+    [metrics.current_consumption]
+    type = "gauge"
+    feature = "current_consumption"
+    tier = "power"
+
+    [metrics.state]
+    type = "enum"
+    feature = "state"
+    states = ["on", "off"]
+
+dimensions (a list of device attributes, or a table of label = attribute
+path such as parent_id = "parent.device_id"), tiers and a children table
+with the same layout for outlets are optional. Specs loaded from files
+replace built-in extractors of the same name or model.
+"""
+import glob
+import operator
+import os
+import tomllib
+from typing import Any, Dict, Iterable
+
+from kasa import DeviceType
+import structlog
+
+from . import KP125M, generic, strip
+from .prom_device_extractor import (DimensionsType,
+                                    PrometheusDeviceExtractor, PromMetricType)
+
+logger = structlog.get_logger()
+
+SPEC_METRIC_KEYS = {"type", "feature", "features", "tier", "states", "help"}
+DEFAULT_DIMENSIONS = ["device_id", "alias", "model"]
+
+
+def model_key(model: Any) -> str:
+    return str(model or "").split("(")[0].strip().upper()
+
+
+class ExtractorRegistry:
+    def __init__(self, fallback: str = "generic"):
+        self.extractors: Dict[str, PrometheusDeviceExtractor] = {}
+        self.models: Dict[str, str] = {}  # model key -> extractor name
+        self.families: Dict[DeviceType, str] = {}  # device type -> extractor name
+        self.fallback = fallback
+
+    def register(
+        self,
+        name: str,
+        extractor: PrometheusDeviceExtractor,
+        models: Iterable[str] = (),
+        families: Iterable[Any] = (),
+    ) -> None:
+        self.extractors[name] = extractor
+        for model in models:
+            self.models[model_key(model)] = name
+        for family in families:
+            self.families[DeviceType(family)] = name
+
+    def select(self, device: Any) -> str:
+        """Name of the extractor for a device, by model, then family, then the fallback."""
+        name = self.models.get(model_key(getattr(device, "model", None)))
+        if name is None:
+            name = self.families.get(getattr(device, "device_type", None), self.fallback)
+        return name
+
+    def load_specs(self, paths: str) -> int:
+        """Register the extractors declared in the TOML files listed in paths."""
+        loaded = 0
+        for path in spec_files(paths):
+            spec = load_spec(path)
+            self.register(
+                spec["name"],
+                build_extractor(spec, path),
+                models=spec.get("models", []),
+                families=spec.get("families", []),
+            )
+            logger.info(f"Loaded extractor spec {spec['name']}", path=path)
+            loaded += 1
+        return loaded
+
+
+def spec_files(paths: str) -> list:
+    files = []
+    for path in filter(None, (part.strip() for part in paths.split(","))):
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "*.toml"))))
+        else:
+            files.append(path)
+    return files
+
+
+def load_spec(path: str) -> dict:
+    with open(path, "rb") as f:
+        spec = tomllib.load(f)
+    if "name" not in spec:
+        raise ValueError(f"Extractor spec {path} has no name")
+    return spec
+
+
+def build_extractor(spec: dict, path: str = "<spec>") -> PrometheusDeviceExtractor:
+    """Extractor for a declarative spec, every metric reads a device feature."""
+    dimensions = spec.get("dimensions", DEFAULT_DIMENSIONS)
+    if isinstance(dimensions, dict):
+        dimensions: DimensionsType = {
+            label: None if attribute == label else operator.attrgetter(attribute)
+            for label, attribute in dimensions.items()
+        }
+    else:
+        dimensions = {label: None for label in dimensions}
+
+    metrics = {}
+    for metric_key, metric_info in spec.get("metrics", {}).items():
+        unknown = set(metric_info) - SPEC_METRIC_KEYS
+        if unknown:
+            raise ValueError(f"Unknown keys {sorted(unknown)} for metric {metric_key} in {path}")
+        try:
+            metric_type = PromMetricType(metric_info.get("type", "gauge"))
+        except ValueError:
+            raise ValueError(f"Unknown type '{metric_info['type']}' for metric {metric_key} in {path}")
+        metrics[metric_key] = {
+            "feature": metric_key,
+            **metric_info,
+            "type": metric_type,
+        }
+
+    children = spec.get("children")
+    return PrometheusDeviceExtractor(
+        metrics=metrics,
+        dimensions=dimensions,
+        tiers={**KP125M.tiers, **spec.get("tiers", {})},
+        children=build_extractor(children, path) if children is not None else None,
+    )
+
+
+def default_registry() -> ExtractorRegistry:
+    """The built-in extractors, then the specs from KASA_EXTRACTOR_SPECS."""
+    registry = ExtractorRegistry()
+    registry.register("KP125M", KP125M.Extractor, models=["KP125M"])
+    registry.register("strip", strip.Extractor, families=[DeviceType.Strip])
+    registry.register("generic", generic.Extractor)
+    registry.load_specs(os.getenv("KASA_EXTRACTOR_SPECS", ""))
+    return registry
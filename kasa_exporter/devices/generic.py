@@ -0,0 +1,104 @@
+"""Extractor generated from python-kasa's feature metadata.
+
+Devices no spec is registered for still get their readings exported: every
+feature with a numeric or boolean value becomes a kasa_<feature id> gauge.
+Feature categories pick the refresh tier, primary features (state, power)
+follow the poll interval, informative ones the energy tier and
+configuration/debug features the inventory tier.
+"""
+from typing import Any, Optional
+
+from kasa import Feature
+import structlog
+
+from .KP125M import tiers
+from .prom_device_extractor import (DimensionsType,
+                                    PrometheusDeviceExtractor, PromMetricType)
+
+logger = structlog.get_logger()
+
+dimensions: DimensionsType = {
+    "device_id": None,
+    "alias": None,
+    "model": None,
+}
+
+VALUE_TYPES = (
+    Feature.Type.Sensor,
+    Feature.Type.BinarySensor,
+    Feature.Type.Switch,
+    Feature.Type.Number,
+)
+
+CATEGORY_TIERS = {
+    Feature.Category.Primary: "power",
+    Feature.Category.Info: "energy",
+    Feature.Category.Config: "inventory",
+    Feature.Category.Debug: "inventory",
+}
+
+
+def feature_metric(feature: Any) -> Optional[dict]:
+    """Metric spec exporting a feature, None when it has no numeric value."""
+    if getattr(feature, "type", None) not in VALUE_TYPES:
+        return None
+    try:
+        value = feature.value
+    except Exception:
+        return None
+    if not isinstance(value, (int, float)):  # bool is an int, set() records 0/1
+        return None
+    unit = getattr(feature, "unit", None)
+    return {
+        "type": PromMetricType.GAUGE,
+        "feature": feature.id,
+        "tier": CATEGORY_TIERS.get(getattr(feature, "category", None)),
+        "help": f"{feature.name} ({unit})" if unit else feature.name,
+    }
+
+
+class FeatureExtractor(PrometheusDeviceExtractor):
+    """Learns its metrics from the features of the devices it is given."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # (model, number of features) already looked at, a device is only
+        # inspected when it brings a feature set not seen before
+        self._learned = set()
+
+    def initialize_metrics(self, registry=None) -> None:
+        self._learned = set()
+        super().initialize_metrics(registry)
+
+    def learn(self, device: Any) -> int:
+        """Register a metric for every new feature of the device, returns how many."""
+        added = 0
+        features = getattr(device, "features", None) or {}
+        for feature_id, feature in features.items():
+            metric_key = f"kasa_{feature_id}"
+            if metric_key in self.metrics:
+                continue
+            spec = feature_metric(feature)
+            if spec is None:
+                continue
+            self.metrics[metric_key] = spec
+            self.register_metric(metric_key, spec)
+            added += 1
+        if added:
+            logger.info(
+                "Generated metrics from device features",
+                model=getattr(device, "model", None),
+                metrics=added,
+            )
+        return added
+
+    def update_metrics(self, device: Any) -> None:
+        features = getattr(device, "features", None) or {}
+        key = (getattr(device, "model", None), len(features))
+        if key not in self._learned:
+            self._learned.add(key)
+            self.learn(device)
+        super().update_metrics(device)
+
+
+Extractor = FeatureExtractor(dimensions=dimensions, tiers=tiers)
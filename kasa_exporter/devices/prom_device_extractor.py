@@ -1,4 +1,11 @@
 from enum import Enum
+import functools
+import operator
+import os
+import time
+from types import MappingProxyType
+import weakref
+from kasa import Feature
 from prometheus_client import (
     Gauge,
     Counter,
@@ -9,21 +16,13 @@ from prometheus_client import (
     Enum as PromEnum,
 )
 import re
-from pydantic import BaseModel, InstanceOf
 import structlog
 from typing import Callable, Dict, Any, Optional, Union
 
 logger = structlog.get_logger()
 
 # Define the PromMetricType
-PromMetricTypeType = Union[
-    InstanceOf[Counter],
-    InstanceOf[Gauge],
-    InstanceOf[Histogram],
-    InstanceOf[Summary],
-    InstanceOf[PromEnum],
-    InstanceOf[Info],
-]
+PromMetricTypeType = Union[Counter, Gauge, Histogram, Summary, PromEnum, Info]
 
 # Define the type for metrics
 MetricsType = Optional[
@@ -59,8 +58,125 @@ PROM_METRIC_TYPES = {
     PromMetricType.ENUM: PromEnum,
 }
 
+# Series lifecycle metrics are shared by every extractor writing to a registry
+_LIFECYCLE_METRICS = weakref.WeakKeyDictionary()
+
+
+def lifecycle_metrics(registry: CollectorRegistry) -> Dict[str, Any]:
+    metrics = _LIFECYCLE_METRICS.get(registry)
+    if metrics is None:
+        metrics = _LIFECYCLE_METRICS[registry] = {
+            "series": Gauge(
+                "device_extractor_series",
+                "Labeled series currently exported per device metric",
+                ["metric"],
+                registry=registry,
+            ),
+            "evicted": Counter(
+                "device_extractor_series_evicted_total",
+                "Labeled series removed per device metric",
+                ["metric", "reason"],
+                registry=registry,
+            ),
+            "rejected": Counter(
+                "device_extractor_series_rejected_total",
+                "New labeled series dropped because the metric reached its series budget",
+                ["metric"],
+                registry=registry,
+            ),
+        }
+    return metrics
+
+
+# Metrics by name per registry, extractors exporting the same metric share it
+_SHARED_METRICS = weakref.WeakKeyDictionary()
+
+
+def shared_metric(registry, metric_class, name: str, documentation: str, labelnames, **kwargs):
+    """The registry's metric called name, created on first use.
+
+    Two specs may export the same metric (e.g. current_consumption) as long
+    as type and labels agree, otherwise registration fails.
+    """
+    if registry is None:
+        return metric_class(name, documentation, labelnames=labelnames, registry=None, **kwargs)
+    metrics = _SHARED_METRICS.setdefault(registry, {})
+    metric = metrics.get(name)
+    if metric is None:
+        metric = metrics[name] = metric_class(
+            name, documentation, labelnames=labelnames, registry=registry, **kwargs
+        )
+    elif type(metric) is not metric_class or list(metric._labelnames) != list(labelnames):
+        raise ValueError(
+            f"Metric '{name}' is already exported as a {type(metric).__name__} "
+            f"with labels {list(metric._labelnames)}"
+        )
+    return metric
+
+
+def release_unused_metrics(registry, extractors) -> list:
+    """Unregister the shared metrics none of the extractors exports, returns their names."""
+    metrics = _SHARED_METRICS.get(registry, {})
+    in_use = {
+        id(entry["metric"])
+        for extractor in extractors
+        for part in extractor.tree()
+        for entry in part.metric_objects.values()
+    }
+    released = [name for name, metric in metrics.items() if id(metric) not in in_use]
+    for name in released:
+        registry.unregister(metrics.pop(name))
+    return released
+
+
+def _info_value(key: str, value: Any) -> Dict[str, str]:
+    return {key: str(value)}
+
+
+# Reads the value of feature objects that are not python-kasa Features
+_FEATURE_VALUE = operator.attrgetter("value")
+_NO_FEATURES = MappingProxyType({})
+
+
+def feature_accessor(feature: Any) -> tuple:
+    """(getter, target) reading the feature's value with getter(target).
+
+    Skips Feature.value and its checks: the attribute the feature reads is
+    looked up once, an action or a feature without getter gives (None, None).
+    """
+    if not isinstance(feature, Feature):
+        return _FEATURE_VALUE, feature
+    if feature.type == Feature.Type.Action or feature.attribute_getter is None:
+        return None, None
+    container = feature.container if feature.container is not None else feature.device
+    attribute = feature.attribute_getter
+    return (attribute if callable(attribute) else operator.attrgetter(attribute)), container
+
+
+class DevicePlan:
+    """A compiled plan bound to one device's features."""
+
+    __slots__ = ("device", "features", "size", "entries")
+
+    def __init__(self, entries: list):
+        self.device = None
+        self.features = None
+        self.size = 0
+        self.entries = entries
+
+
+# Method used to record a value on a bound child, resolved once at compile time
+PROM_METRIC_SETTERS = {
+    Gauge: Gauge.set,
+    Counter: Counter.inc,
+    Summary: Summary.observe,
+    Histogram: Histogram.observe,
+    Info: Info.info,
+    PromEnum: PromEnum.state,
+}
+
 class PrometheusDeviceExtractor:
-    registry: InstanceOf[CollectorRegistry]
+    registry: CollectorRegistry
     metrics: MetricsType = None
     dimensions: DimensionsType = None
 
@@ -69,16 +185,123 @@ class PrometheusDeviceExtractor:
         """Sanitize the metric name to be Prometheus compatible."""
         return re.sub(r"[^a-zA-Z0-9_]", "", name.lower().replace(" ", "_"))
 
-    def __init__(self, registry=None, metrics=None, dimensions=None) -> None:
+    def __init__(
+        self, registry=None, metrics=None, dimensions=None, tiers=None, children=None
+    ) -> None:
         self.registry = registry
         self.metrics = metrics or {}
         self.dimensions = dimensions or {}
+        # Extractor for the child devices (outlets of a strip), fed from the
+        # parent's update so children are never polled on their own
+        self.children = children
+        # Refresh tier name -> seconds between updates of the metrics in that tier,
+        # metrics without a tier are updated on every poll
+        self.tiers = tiers or {}
         self.metric_objects = {}
+        # Compiled update plan, see compile()
+        self._plan = None
+        self._device_plans = {}
+        self._derived_children = {}
+
+        # Series lifecycle: a series not updated for series_ttl seconds is removed,
+        # a metric never holds more than series_budget series (0 disables either)
+        self.series_ttl = float(os.getenv("KASA_SERIES_TTL", 600))
+        self.series_budget = int(os.getenv("KASA_SERIES_BUDGET", 5000))
+        self._lifecycle = None
+        self._reset_series()
+
+    def _reset_series(self) -> None:
+        self._series = {}  # (metric, label values) -> device label values
+        self._device_series = {}  # device label values -> {(metric, label values)}
+        self._series_count = {}  # metric -> number of series
+        self._device_seen = {}  # device label values -> last update
+        self._derived_seen = {}  # (metric, *label values) -> last update
 
     def initialize_metrics(self, registry=None) -> None:
         self.registry = registry
+        self._reset_series()
         for metric_key, metric_info in self.metrics.items():
             self.register_metric(metric_key, metric_info)
+        self._lifecycle = lifecycle_metrics(registry) if registry is not None else None
+        self.compile()
+        if self.children is not None:
+            self.children.initialize_metrics(registry)
+
+    def copy(self) -> "PrometheusDeviceExtractor":
+        """An extractor with the same spec, not bound to any registry."""
+        return type(self)(
+            metrics=dict(self.metrics),
+            dimensions=self.dimensions,
+            tiers=self.tiers,
+            children=self.children.copy() if self.children is not None else None,
+        )
+
+    def tree(self) -> list:
+        """This extractor followed by the extractors of its child devices."""
+        return [self] + (self.children.tree() if self.children is not None else [])
+
+    def compile(self) -> None:
+        """Resolve the metric spec into a flat dispatch plan.
+
+        Per metric this precomputes the getter, the feature it reads, the value
+        conversion, the derive label functions, the metric, the setter for its
+        type and the refresh interval of its tier. Bound children are cached per
+        device label tuple (see _device_plan), so updating a device does not go
+        through labels() and its lock for metrics without derived labels.
+        """
+        plan = []
+        for metric_key, metric_info in self.metric_objects.items():
+            metric = metric_info["metric"]
+            feature = metric_info["feature"]
+            getter = metric_info["getter"]
+            if getter is None and feature is None:
+                getter = self._state_information_getter(metric_key)
+            convert = metric_info["transform"]
+            if convert is None and feature is not None and getter is None:
+                convert = self._feature_converter(metric_key, metric, metric_info["states"])
+            derive = tuple(metric_info["derive_labels"].values())
+            interval = self.tier_interval(metric_info["tier"])
+            setter = PROM_METRIC_SETTERS[type(metric)]
+            plan.append((getter, feature, convert, derive, setter, metric, interval))
+        self._plan = plan
+        self._device_plans = {}
+        self._derived_children = {}
+
+    def tier_interval(self, tier: Optional[str]) -> float:
+        if tier is None:
+            return 0.0
+        if tier not in self.tiers:
+            raise ValueError(f"Unknown refresh tier '{tier}'")
+        return float(self.tiers[tier])
+
+    def feature_intervals(self) -> Dict[str, float]:
+        """Shortest refresh interval any metric needs, per device feature it reads.
+
+        Metrics read the feature named like the metric unless the spec lists
+        "features" explicitly. Used to tell the device which queries can wait.
+        """
+        intervals = {}
+        for metric_key, metric_info in self.metric_objects.items():
+            interval = self.tier_interval(metric_info["tier"])
+            for feature in metric_info["features"]:
+                intervals[feature] = min(interval, intervals.get(feature, interval))
+        return intervals
+
+    @staticmethod
+    def _feature_converter(metric_key: str, metric, states) -> Optional[Callable[[Any], Any]]:
+        """Turn a raw feature value into what the metric type records."""
+        if isinstance(metric, PromEnum):
+            # Boolean features map onto the first (True) and second state
+            mapping = {True: states[0], False: states[1]} if len(states) == 2 else {}
+            mapping.update((state, state) for state in states)
+            return mapping.get
+        if isinstance(metric, Info):
+            return functools.partial(_info_value, metric_key)
+        return None
+
+    @staticmethod
+    def _state_information_getter(metric_key: str) -> Callable[[Any], Any]:
+        return lambda device: device.state_information.get(metric_key)
 
     def get_device_labels(self, device: Any) -> Dict[str, Any]:
         labels = {}
@@ -93,13 +316,60 @@ class PrometheusDeviceExtractor:
                     labels[dimension_key] = None
         return labels
 
+    def get_device_label_values(self, device: Any) -> tuple:
+        """Device dimension values in labelnames order."""
+        return tuple(self.get_device_labels(device).values())
+
+    def _device_plan(self, label_values: tuple, device: Any) -> list:
+        plan = self._device_plans.get(label_values)
+        if plan is None:
+            # The bound child is filled on the first non-None value so metrics a
+            # device never reports don't show up as empty series, the last slot
+            # holds when the metric was last updated for its refresh tier
+            plan = DevicePlan([
+                [getter, None, convert, derive, setter, metric, None, interval, float("-inf"),
+                 getter, feature]
+                for getter, feature, convert, derive, setter, metric, interval in self._plan
+            ])
+            self._device_plans[label_values] = plan
+        features = getattr(device, "features", None) or _NO_FEATURES
+        if plan.device is not device or plan.features is not features or plan.size != len(features):
+            self._bind(plan, device, features)
+        return plan.entries
+
+    @staticmethod
+    def _bind(plan: DevicePlan, device: Any, features) -> None:
+        """Resolve the accessors of a plan against the device's features.
+
+        Runs when the device (or its feature set) changes, so the per-update
+        path neither looks features up nor handles models lacking one: a
+        metric whose feature the device does not have is skipped.
+        """
+        for entry in plan.entries:
+            spec_getter, feature_id = entry[9], entry[10]
+            if feature_id is None:
+                entry[0], entry[1] = spec_getter, device
+            elif feature_id in features:
+                entry[0], entry[1] = feature_accessor(features[feature_id])
+            else:
+                entry[0], entry[1] = None, None
+        plan.device = device
+        plan.features = features
+        plan.size = len(features)
+
     def register_metric(
         self, metric_key: str, metric_info: Union[PromMetricTypeType, Dict[str, Any]]
     ) -> None:
         if isinstance(metric_info, dict):
             metric_type = metric_info.get("type")
             getter = metric_info.get("getter")
+            # Read a device feature through a compiled accessor instead of a getter
+            feature = metric_info.get("feature")
+            transform = metric_info.get("transform")
+            documentation = metric_info.get("help", metric_key)
             derive_labels = metric_info.get("derive_labels", {})
+            tier = metric_info.get("tier")
+            features = metric_info.get("features", [feature or metric_key])
             states = (
                 metric_info.get("states")
                 if metric_type == PromMetricType.ENUM
@@ -108,38 +378,39 @@ class PrometheusDeviceExtractor:
         else:
             metric_type = metric_info
             getter = None
+            feature = None
+            transform = None
+            documentation = metric_key
             derive_labels = {}
+            tier = None
+            features = [metric_key]
             states = None
 
         if metric_type in PROM_METRIC_TYPES:
             sanitized_name = self.sanitize_metric_name(metric_key)
             metric_class = PROM_METRIC_TYPES[metric_type]
             label_names = list(self.dimensions.keys()) + list(derive_labels.keys())
+            options = {"states": states} if metric_type == PromMetricType.ENUM else {}
 
-            if metric_type == PromMetricType.ENUM:
-                self.metric_objects[metric_key] = {
-                    "metric": metric_class(
-                        f"{sanitized_name}",
-                        f"{metric_key}",
-                        states=states,
-                        labelnames=label_names,
-                        registry=self.registry,
-                    ),
-                    "getter": getter,
-                    "derive_labels": derive_labels,
-                }
-            else:
-                self.metric_objects[metric_key] = {
-                    "metric": metric_class(
-                        f"{sanitized_name}",
-                        f"{metric_key}",
-                        labelnames=label_names,
-                        registry=self.registry,
-                    ),
-                    "getter": getter,
-                    "derive_labels": derive_labels,
-                }
+            self.metric_objects[metric_key] = {
+                "metric": shared_metric(
+                    self.registry,
+                    metric_class,
+                    sanitized_name,
+                    documentation,
+                    label_names,
+                    **options,
+                ),
+                "getter": getter,
+                "feature": feature,
+                "transform": transform,
+                "states": states,
+                "derive_labels": derive_labels,
+                "tier": tier,
+                "features": features,
+            }
 
+            self._plan = None
             logger.info(
                 f"Registered {metric_type.name.lower()} metric for {metric_key}"
             )
@@ -148,37 +419,154 @@ class PrometheusDeviceExtractor:
             raise ValueError(f"Metric type '{metric_type}' not supported.")
 
     def update_metrics(self, device: Any) -> None:
-        for metric_key, metric_info in self.metric_objects.items():
-            getter = metric_info["getter"]
-            derive_labels = metric_info["derive_labels"]
+        if self._plan is None:
+            self.compile()
+        label_values = self.get_device_label_values(device)
+        now = time.monotonic()
+        self._device_seen[label_values] = now
+        for entry in self._device_plan(label_values, device):
+            getter, target, convert, derive, setter, metric, child, interval, updated_at, _, _ = entry
+            if getter is None:
+                continue  # The device does not have the feature
+            if interval and now - updated_at < interval:
+                continue  # Slower tier, the exported value is still fresh enough
+            metric_value = getter(target)
+            if metric_value is None:
+                continue
+            if convert is not None:
+                metric_value = convert(metric_value)
+                if metric_value is None:
+                    continue
+            entry[8] = now
+            if derive:
+                key = (metric, *label_values, *(func(device) for func in derive))
+                child = self._derived_children.get(key)
+                if child is None:
+                    child = self._new_series(metric, key[1:], label_values)
+                    if child is None:
+                        continue
+                    self._derived_children[key] = child
+                self._derived_seen[key] = now
+            elif child is None:
+                child = self._new_series(metric, label_values, label_values)
+                if child is None:
+                    continue
+                entry[6] = child
+            setter(child, metric_value)
+        logger.debug("Updated device metrics", device_labels=label_values)
+        if self.children is not None:
+            # The parent update already refreshed every child, fan out per child
+            for child_device in device.children:
+                self.children.update_metrics(child_device)
 
-            metric_value = (
-                getter(device) if getter else device.state_information.get(metric_key)
-            )
-            device_labels = self.get_device_labels(device)
-            derived_labels = {
-                label: func(device) for label, func in derive_labels.items()
-            }
-
-            all_labels = {**device_labels, **derived_labels}
-            if metric_value is not None:
-                metric_object = metric_info["metric"]
-                if isinstance(metric_object, Gauge):
-                    metric_object.labels(**all_labels).set(metric_value)
-                elif isinstance(metric_object, Counter):
-                    metric_object.labels(**all_labels).inc(metric_value)
-                elif isinstance(metric_object, Summary):
-                    metric_object.labels(**all_labels).observe(metric_value)
-                elif isinstance(metric_object, Histogram):
-                    metric_object.labels(**all_labels).observe(metric_value)
-                elif isinstance(metric_object, Info):
-                    metric_object.labels(**all_labels).info(metric_value)
-                elif isinstance(metric_object, PromEnum):
-                    metric_object.labels(**all_labels).state(metric_value)
-                logger.debug(
-                    f"Updated metric '{metric_key}'",
-                    value=metric_value,
-                    device_labels=device_labels,
-                    derived_labels=derived_labels,
-                    has_getter=bool(getter),
+    def _new_series(self, metric, values: tuple, device_labels: tuple):
+        """Bind a child for a new label set, or None when the metric is over budget."""
+        series_key = (metric, values)
+        if series_key not in self._series:
+            count = self._series_count.get(metric, 0)
+            if self.series_budget and count >= self.series_budget:
+                if self._lifecycle:
+                    self._lifecycle["rejected"].labels(metric=metric._name).inc()
+                logger.warning(
+                    f"Dropping new series for '{metric._name}', series budget reached",
+                    budget=self.series_budget,
                 )
+                return None
+            self._series[series_key] = device_labels
+            self._device_series.setdefault(device_labels, set()).add(series_key)
+            self._series_count[metric] = count + 1
+            if self._lifecycle:
+                self._lifecycle["series"].labels(metric=metric._name).set(count + 1)
+        return metric.labels(*values)
+
+    def _remove_series(self, series_key: tuple, reason: str) -> None:
+        metric, values = series_key
+        device_labels = self._series.pop(series_key, None)
+        if device_labels is None:
+            return
+        self._device_series.get(device_labels, set()).discard(series_key)
+        self._derived_children.pop((metric, *values), None)
+        self._derived_seen.pop((metric, *values), None)
+        try:
+            metric.remove(*values)
+        except KeyError:
+            pass
+        count = self._series_count[metric] = self._series_count[metric] - 1
+        if self._lifecycle:
+            self._lifecycle["series"].labels(metric=metric._name).set(count)
+            self._lifecycle["evicted"].labels(metric=metric._name, reason=reason).inc()
+
+    def _forget_labels(self, label_values: tuple, reason: str) -> int:
+        series = self._device_series.pop(label_values, set())
+        for series_key in list(series):
+            self._remove_series(series_key, reason)
+        self._device_plans.pop(label_values, None)
+        self._device_seen.pop(label_values, None)
+        return len(series)
+
+    def forget_device(self, device: Any) -> int:
+        """Remove every series exported for a device, returns how many were removed."""
+        removed = self._forget_labels(self.get_device_label_values(device), "pruned")
+        if self.children is not None:
+            for child_device in getattr(device, "children", None) or []:
+                removed += self.children.forget_device(child_device)
+        return removed
+
+    def clear_series(self, reason: str) -> int:
+        """Remove every series this extractor (and its children) exported."""
+        removed = 0
+        for series_key in list(self._series):
+            self._remove_series(series_key, reason)
+            removed += 1
+        self._reset_series()
+        self._device_plans = {}
+        if self.children is not None:
+            removed += self.children.clear_series(reason)
+        return removed
+
+    def adopt_series(self, previous: "PrometheusDeviceExtractor") -> int:
+        """Take over the series of the extractor this one replaces (e.g. on reload).
+
+        Metrics both export are the same registry objects, so their series stay
+        in place and keep being tracked for expiry. Series of metrics this one
+        no longer exports are removed, returns how many.
+        """
+        exported = {id(entry["metric"]) for entry in self.metric_objects.values()}
+        removed = 0
+        for series_key in list(previous._series):
+            if id(series_key[0]) not in exported:
+                previous._remove_series(series_key, "reloaded")
+                removed += 1
+        self._series = previous._series
+        self._device_series = previous._device_series
+        self._series_count = previous._series_count
+        self._device_seen = previous._device_seen
+        self._derived_seen = previous._derived_seen
+        previous._reset_series()
+        if previous.children is not None:
+            if self.children is not None:
+                removed += self.children.adopt_series(previous.children)
+            else:
+                removed += previous.children.clear_series("reloaded")
+        return removed
+
+    def expire_series(self, ttl: Optional[float] = None) -> int:
+        """Remove series not updated within ttl seconds (default series_ttl).
+
+        Covers devices that stopped reporting under a label set (renamed, gone
+        without being pruned) and derived label combinations left behind, e.g.
+        the previous rate_class after a tariff period change.
+        """
+        ttl = self.series_ttl if ttl is None else ttl
+        if not ttl:
+            return 0
+        cutoff = time.monotonic() - ttl
+        removed = 0
+        for label_values in [lv for lv, seen in self._device_seen.items() if seen < cutoff]:
+            removed += self._forget_labels(label_values, "expired")
+        for key in [key for key, seen in self._derived_seen.items() if seen < cutoff]:
+            self._remove_series((key[0], key[1:]), "expired")
+            removed += 1
+        if self.children is not None:
+            removed += self.children.expire_series(ttl)
+        return removed
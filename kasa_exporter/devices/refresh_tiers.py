@@ -0,0 +1,98 @@
+"""Refresh tiers: how often each group of device metrics needs new data.
+
+An extractor spec assigns its metrics to named tiers (e.g. power, energy,
+inventory) with a refresh interval each. The extractor only re-publishes a
+metric once its tier is due, and apply_module_intervals tells python-kasa to
+leave the queries of modules nothing needs yet out of the next update.
+tune_queries applies both to a device and, for strips, to its outlets.
+"""
+from typing import Dict
+
+from kasa import Module
+from kasa.smart.modules import DeviceModule
+
+RULE_MODULES = (Module.IotAntitheft, Module.IotSchedule, Module.IotCountdown, Module.IotUsage)
+
+
+def parse_tiers(spec: str, defaults: Dict[str, float]) -> Dict[str, float]:
+    """Tier intervals from a "power=0,energy=60,inventory=3600" override."""
+    tiers = dict(defaults)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, seconds = item.partition("=")
+        try:
+            tiers[name.strip()] = float(seconds)
+        except ValueError:
+            raise ValueError(f"Invalid refresh tier '{item}', expected name=seconds")
+    return tiers
+
+
+def apply_module_intervals(device, feature_intervals: Dict[str, float]) -> int:
+    """Set the update interval of every device module from the metrics it backs.
+
+    Smart (KLAP/AES) devices only query a module when its update interval
+    elapsed, so a module gets the shortest interval of the features the
+    extractor reads from it and modules backing no metric get the slowest
+    tier. Intervals python-kasa already enforces (e.g. daily firmware checks)
+    are never shortened. DeviceModule carries the device info every other
+    module builds on and Time the device clock on_since and auto_off_at are
+    computed from, both are always queried. Legacy devices query every module
+    on every update and are left alone. Returns the number of modules changed.
+    """
+    modules = getattr(device, "modules", None)
+    features = getattr(device, "features", None)
+    if not modules or not features or not feature_intervals:
+        return 0
+    slowest = max(feature_intervals.values())
+    intervals = {}
+    for feature_id, feature in features.items():
+        container = getattr(feature, "container", None)
+        if container is None or feature_id not in feature_intervals:
+            continue
+        interval = feature_intervals[feature_id]
+        intervals[id(container)] = min(interval, intervals.get(id(container), interval))
+
+    changed = 0
+    for name, module in modules.items():
+        if isinstance(module, DeviceModule) or name == Module.Time:
+            continue
+        if not hasattr(module, "update_interval"):
+            continue
+        default = type(module).MINIMUM_UPDATE_INTERVAL_SECS
+        interval = max(default, intervals.get(id(module), slowest))
+        if interval != module.MINIMUM_UPDATE_INTERVAL_SECS:
+            # Instance attribute, other devices of the same model keep their own
+            module.MINIMUM_UPDATE_INTERVAL_SECS = interval
+            changed += 1
+    return changed
+
+
+def drop_rule_modules(device) -> int:
+    """Stop querying the legacy modules that only manage device rules.
+
+    Legacy devices query every module on every update. Schedules, anti-theft
+    rules, countdowns and usage statistics back no feature and so no metric,
+    and on a strip they are asked for once per outlet. Other featureless
+    modules stay: outlets take their on_since from the strip's clock.
+    Returns the number of modules dropped.
+    """
+    queried = getattr(device, "_modules", None)
+    if not isinstance(queried, dict):
+        return 0
+    dropped = [
+        name
+        for name in RULE_MODULES
+        if name in queried and not hasattr(queried[name], "update_interval")
+    ]
+    for name in dropped:
+        del queried[name]
+    return len(dropped)
+
+
+def tune_queries(device, extractor) -> int:
+    """Trim the queries of a device, and of its children, to what the extractor reads."""
+    changed = apply_module_intervals(device, extractor.feature_intervals())
+    changed += drop_rule_modules(device)
+    if extractor.children is not None:
+        for child in device.children:
+            changed += tune_queries(child, extractor.children)
+    return changed
@@ -0,0 +1,386 @@
+"""Capture and replay of raw device traffic.
+
+With KASA_CAPTURE_DIR set, TrafficRecorder wraps the transport of every polled
+device, so each query python-kasa sends and the decoded response (or the
+error) is appended with its timing to `<dir>/<host>.jsonl.gz`. One JSON object
+per line, gzip members are appended so captures from several runs
+concatenate into one file:
+
+    {"device": {...discovery cache entry...}, "started": 1718000000.0}
+    {"t": 0.0, "d": 0.214, "q": {...request...}, "r": {...response...}}
+    {"t": 10.0, "d": 5.0, "q": {...request...}, "e": "TimeoutError", "m": "..."}
+
+Responses are redacted unless KASA_CAPTURE_REDACT is false: network names,
+addresses and the location are blanked and the MAC becomes one derived from
+the device's IP address, so a capture can be shared. A capture file that
+grows past KASA_CAPTURE_MAX_BYTES (counted before compression) is moved to
+`<host>.jsonl.gz.1`, replacing the previous one, and a new one is started.
+
+ReplayTransport serves a capture back through the real protocol and device
+classes, at the recorded speed or faster, and ReplayFleet multiplies the
+captures across as many virtual hosts as a load test needs.
+"""
+import asyncio
+import base64
+import copy
+import glob
+import gzip
+import ipaddress
+import json
+import os
+import time
+from kasa import Device
+from kasa.exceptions import KasaException
+from kasa.protocol import BaseTransport
+import structlog
+from ..routines.discovery_cache import DiscoveryCache
+
+logger = structlog.get_logger()
+
+# Request fields that change on every query and must not take part in matching
+VOLATILE_FIELDS = ("request_time_milis", "terminal_uuid")
+# Response fields that identify the owner's network or whereabouts
+SENSITIVE_FIELDS = (
+    "ssid", "bssid", "ip", "latitude", "longitude", "latitude_i", "longitude_i", "region",
+)
+
+
+def normalize_request(request) -> dict:
+    if isinstance(request, str):
+        request = json.loads(request)
+    return {key: value for key, value in request.items() if key not in VOLATILE_FIELDS}
+
+
+def request_key(request: dict) -> str:
+    return json.dumps(request, sort_keys=True, separators=(",", ":"))
+
+
+def request_shape(value):
+    """The request with every parameter value dropped, used when no exact match exists.
+
+    Legacy devices are asked for e.g. the daily statistics of the current month,
+    so a capture replayed a month later still has an answer for that query.
+    """
+    if isinstance(value, dict):
+        return {key: request_shape(item) for key, item in value.items() if key != "params"}
+    if isinstance(value, list):
+        return [request_shape(item) for item in value]
+    return None
+
+
+def pseudonymous_mac(host: str) -> str:
+    """A locally administered MAC built from the device's IPv4 address."""
+    try:
+        octets = ipaddress.IPv4Address(host).packed
+    except ValueError:
+        octets = bytes(4)
+    return ":".join(f"{octet:02X}" for octet in (2, 0, *octets))
+
+
+def redact(value, mac: str):
+    """Copy of a response without the SENSITIVE_FIELDS, with the MAC replaced."""
+    if isinstance(value, list):
+        return [redact(item, mac) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {}
+    for key, item in value.items():
+        if key == "mac" and isinstance(item, str):
+            item = mac
+        elif key in SENSITIVE_FIELDS and not isinstance(item, (dict, list)):
+            # Same type, so the device classes still parse the replayed response
+            item = "" if isinstance(item, str) else 0
+        else:
+            item = redact(item, mac)
+        result[key] = item
+    return result
+
+
+class RecordingTransport:
+    """Wraps a device transport and records every exchange through it."""
+
+    def __init__(self, transport: BaseTransport, capture):
+        self._transport = transport
+        self._capture = capture
+
+    def __getattr__(self, name):
+        return getattr(self._transport, name)
+
+    # Device.host writes the host into the transport
+    @property
+    def _host(self):
+        return self._transport._host
+
+    @_host.setter
+    def _host(self, value):
+        self._transport._host = value
+
+    async def send(self, request: str) -> dict:
+        start = time.monotonic()
+        try:
+            response = await self._transport.send(request)
+        except BaseException as e:
+            self._capture.exchange(request, start, error=e)
+            raise
+        self._capture.exchange(request, start, response=response)
+        return response
+
+    async def close(self) -> None:
+        await self._transport.close()
+
+    async def reset(self) -> None:
+        await self._transport.reset()
+
+
+class DeviceCapture:
+    def __init__(self, path, device: Device, started, max_bytes=0, redacted=True):
+        self.path = path
+        self.started = started
+        self.max_bytes = max_bytes  # 0: unbounded
+        self.mac = pseudonymous_mac(device.host) if redacted else None
+        self.header = {"device": DiscoveryCache.serialize_device(device)}
+        self._open()
+
+    def _open(self):
+        # Appending to an earlier capture starts from its (compressed) size
+        self.written = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        self.file = gzip.open(self.path, "at", encoding="utf-8")
+        self._write(dict(self.header, started=time.time()))
+
+    def _rotate(self):
+        self.file.close()
+        os.replace(self.path, self.path + ".1")
+        self._open()
+
+    def _write(self, entry):
+        line = json.dumps(entry, separators=(",", ":"), default=str) + "\n"
+        self.file.write(line)
+        self.written += len(line)
+
+    def exchange(self, request, start, response=None, error=None):
+        entry = {
+            "t": round(start - self.started, 4),
+            "d": round(time.monotonic() - start, 4),
+            "q": normalize_request(request),
+        }
+        if error is None:
+            entry["r"] = response if self.mac is None else redact(response, self.mac)
+        else:
+            entry["e"] = type(error).__name__
+            entry["m"] = str(error)
+        self._write(entry)
+        if self.max_bytes and self.written > self.max_bytes:
+            self._rotate()
+
+
+class TrafficRecorder:
+    """Records the traffic of polled devices to KASA_CAPTURE_DIR (empty disables)."""
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.getenv("KASA_CAPTURE_DIR", "")
+        self.path = path or None
+        self.max_bytes = int(os.getenv("KASA_CAPTURE_MAX_BYTES", 64 * 1024 * 1024))
+        self.redacted = os.getenv("KASA_CAPTURE_REDACT", "true").lower() not in ("0", "false", "no")
+        self.started = time.monotonic()
+        self.captures = {}
+
+    def attach(self, addr, device):
+        """Start recording the device, a no-op when it is already recorded."""
+        if self.path is None:
+            return
+        protocol = getattr(device, "protocol", None)
+        if protocol is None:
+            return
+        if not hasattr(protocol, "_transport"):
+            # Recording hooks into a python-kasa internal, say so instead of capturing nothing
+            logger.error(
+                "Traffic capture disabled: python-kasa protocols no longer have a _transport",
+                protocol=type(protocol).__name__,
+            )
+            self.path = None
+            return
+        transport = protocol._transport
+        if isinstance(transport, RecordingTransport):
+            return
+        capture = self.captures.get(addr)
+        if capture is None:
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                capture = DeviceCapture(
+                    os.path.join(self.path, f"{addr}.jsonl.gz"),
+                    device,
+                    self.started,
+                    max_bytes=self.max_bytes,
+                    redacted=self.redacted,
+                )
+            except OSError as e:
+                logger.warning(f"Traffic capture disabled: {str(e)}")
+                self.path = None
+                return
+            self.captures[addr] = capture
+        protocol._transport = RecordingTransport(transport, capture)
+
+    def flush(self):
+        for capture in self.captures.values():
+            capture.file.flush()
+
+    def close(self):
+        for capture in self.captures.values():
+            capture.file.close()
+        self.captures = {}
+
+
+def load_capture(path) -> tuple:
+    """Returns the device entry and the exchanges of a capture file."""
+    entry = None
+    exchanges = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn write
+                if "device" in record:
+                    entry = record["device"]
+                else:
+                    exchanges.append(record)
+        except EOFError:
+            pass  # the exporter is still writing to the last member
+    if entry is None:
+        raise ValueError(f"{path} has no device header")
+    return entry, exchanges
+
+
+def virtual_identity(value, suffix: str):
+    """Copy of a response that names the device differently, for multiplied replays."""
+    if isinstance(value, list):
+        return [virtual_identity(item, suffix) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {}
+    for key, item in value.items():
+        if key in ("device_id", "deviceId", "mac") and isinstance(item, str):
+            item = f"{item}{suffix}"
+        elif key == "alias" and isinstance(item, str):
+            item = f"{item} {suffix}"
+        elif key == "nickname" and isinstance(item, str):
+            # Smart devices send the name base64 encoded
+            try:
+                name = base64.b64decode(item).decode()
+                item = base64.b64encode(f"{name} {suffix}".encode()).decode()
+            except ValueError:
+                pass
+        else:
+            item = virtual_identity(item, suffix)
+        result[key] = item
+    return result
+
+
+class ReplayTransport(BaseTransport):
+    """Answers queries from a capture instead of the network.
+
+    Responses to the same request are served in recorded order and wrap
+    around, so counters move like they did on the real device. Each answer
+    takes the recorded duration divided by `speed` (inf: no delay). Recorded
+    errors are raised again, a query that was never recorded fails.
+    """
+
+    def __init__(self, *, config, exchanges, speed=1.0, offset=0):
+        super().__init__(config=config)
+        self.speed = speed
+        self.requests = 0
+        self.misses = 0
+        self._replies = {}
+        self._shapes = {}
+        for exchange in exchanges:
+            request = exchange["q"]
+            self._replies.setdefault(request_key(request), []).append(exchange)
+            self._shapes.setdefault(request_key(request_shape(request)), []).append(exchange)
+        self._positions = {key: offset for key in self._replies}
+        self._positions.update({key: offset for key in self._shapes})
+
+    @property
+    def default_port(self) -> int:
+        return self._config.port_override or 80
+
+    @property
+    def credentials_hash(self):
+        return None
+
+    def _next(self, table, key):
+        replies = table.get(key)
+        if not replies:
+            return None
+        position = self._positions[key]
+        self._positions[key] = position + 1
+        return replies[position % len(replies)]
+
+    async def send(self, request: str) -> dict:
+        self.requests += 1
+        request = normalize_request(request)
+        exchange = self._next(self._replies, request_key(request))
+        if exchange is None:
+            exchange = self._next(self._shapes, request_key(request_shape(request)))
+        if exchange is None:
+            self.misses += 1
+            raise KasaException(f"No recorded response for {request_key(request_shape(request))}")
+        if exchange["d"] and self.speed != float("inf"):
+            await asyncio.sleep(exchange["d"] / self.speed)
+        if "e" in exchange:
+            if exchange["e"] in ("TimeoutError", "CancelledError"):
+                raise asyncio.TimeoutError(exchange["m"])
+            raise KasaException(exchange["m"])
+        return exchange["r"]
+
+    async def close(self) -> None:
+        pass
+
+    async def reset(self) -> None:
+        pass
+
+
+class ReplayFleet:
+    """`size` virtual devices replaying the captures in a directory round-robin.
+
+    The first copy of every capture keeps the identity of the real device,
+    further copies get their device id and name suffixed so their series
+    stay apart.
+    """
+
+    def __init__(self, path, size=None, speed=1.0):
+        captures = [load_capture(name) for name in sorted(glob.glob(os.path.join(path, "*.jsonl.gz")))]
+        if not captures:
+            raise ValueError(f"No captures in {path}")
+        self.devices = {}
+        self.transports = []
+        size = len(captures) if size is None else size
+        for i in range(size):
+            entry, exchanges = captures[i % len(captures)]
+            copy_index = i // len(captures)
+            if copy_index:
+                exchanges = [
+                    dict(exchange, r=virtual_identity(exchange["r"], f"#{copy_index}"))
+                    if "r" in exchange
+                    else exchange
+                    for exchange in exchanges
+                ]
+            host = f"10.{200 + i // 65536}.{i // 256 % 256}.{i % 256}"
+            device = DiscoveryCache.build_device(dict(copy.deepcopy(entry), host=host))
+            transport = ReplayTransport(
+                config=device.config, exchanges=exchanges, speed=speed, offset=copy_index
+            )
+            device.protocol._transport = transport
+            self.transports.append(transport)
+            self.devices[host] = device
+
+    async def discover(self, **_kwargs) -> dict:
+        """Drop-in for kasa.Discover.discover."""
+        return dict(self.devices)
+
+    def stats(self) -> dict:
+        return {
+            "requests": sum(t.requests for t in self.transports),
+            "misses": sum(t.misses for t in self.transports),
+        }
@@ -0,0 +1,150 @@
+"""Simulated fleet of KP125M-like plugs for tests and benchmarks.
+
+SimulatedPlug exposes what the exporter reads from a python-kasa device
+(alias, model, device_id, config, features, state_information) and answers
+update() after a configurable latency, jitter and error rate. The first
+update of a session pays a handshake: an extra round-trip plus the CPU of a
+key derivation, like KLAP; disconnect() drops the session.
+"""
+from datetime import datetime, timedelta, timezone
+import asyncio
+import hashlib
+import os
+import random
+from kasa import DeviceConfig, DeviceConnectionParameters, DeviceEncryptionType, DeviceFamily
+from kasa.exceptions import KasaException
+
+KLAP_PLUG = DeviceConnectionParameters(
+    DeviceFamily.SmartKasaPlug, DeviceEncryptionType.Klap, login_version=2
+)
+
+
+class SimulatedFeature:
+    def __init__(self, value):
+        self.value = value
+
+
+class SimulatedPlug:
+    model = "KP125M"
+
+    def __init__(
+        self,
+        host,
+        latency=0.02,
+        jitter=0.01,
+        error_rate=0.0,
+        handshake_latency=0.05,
+        handshake_rounds=1000,
+        rng=None,
+    ):
+        self.host = host
+        self.alias = f"sim-{host}"
+        self.device_id = hashlib.sha1(host.encode()).hexdigest().upper()
+        self.config = DeviceConfig(host, connection_type=KLAP_PLUG)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.handshake_latency = handshake_latency
+        self.handshake_rounds = handshake_rounds
+        self.rng = rng or random.Random(host)
+        self.session = False
+        self.updates = 0
+        self.handshakes = 0
+        self.errors = 0
+        self.on_since = datetime.now(timezone.utc) - timedelta(hours=self.rng.uniform(0, 48))
+        self.power = self.rng.uniform(0, 1500)
+        self.today = self.rng.uniform(0, 5)
+        self.month = self.today + self.rng.uniform(0, 100)
+        self.features = {}
+        self.state_information = {}
+
+    def _delay(self, base):
+        return max(0.0, base + self.rng.uniform(-self.jitter, self.jitter))
+
+    async def update(self):
+        if not self.session:
+            await asyncio.sleep(self._delay(self.handshake_latency))
+            hashlib.pbkdf2_hmac("sha256", self.host.encode(), b"kasa", self.handshake_rounds)
+            self.session = True
+            self.handshakes += 1
+        await asyncio.sleep(self._delay(self.latency))
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.errors += 1
+            self.session = False
+            raise KasaException(f"Simulated failure of {self.host}")
+        self.updates += 1
+        self._advance()
+
+    def _advance(self):
+        # Random walk of the load, energy counters integrate it
+        self.power = min(1800.0, max(0.0, self.power + self.rng.gauss(0, 25)))
+        self.today += self.power / 3600 / 1000
+        self.month += self.power / 3600 / 1000
+        values = {
+            "signal_level": self.rng.randint(1, 3),
+            "state": self.power > 0,
+            "rssi": self.rng.randint(-80, -40),
+            "ssid": "simulated",
+            "on_since": self.on_since,
+            "auto_off_enabled": False,
+            "auto_off_minutes": 0,
+            "auto_off_at": None,
+            "cloud_connection": True,
+            "current_consumption": round(self.power, 1),
+            "consumption_today": round(self.today, 3),
+            "consumption_this_month": round(self.month, 3),
+            "auto_update_enabled": True,
+            "update_available": False,
+            "current_firmware_version": "1.1.3 Build 240523 Rel.175054",
+            "available_firmware_version": "1.1.3 Build 240523 Rel.175054",
+            "led": True,
+        }
+        # Values change in place like python-kasa features, extractors keep their accessors
+        for key, value in values.items():
+            feature = self.features.get(key)
+            if feature is None:
+                self.features[key] = SimulatedFeature(value)
+            else:
+                feature.value = value
+        self.state_information = {"Current consumption": round(self.power, 1)}
+
+    async def disconnect(self):
+        self.session = False
+
+
+class SimulatedFleet:
+    """N simulated plugs on 10.x.y.z addresses, discoverable like the real thing."""
+
+    def __init__(self, size, seed=0, **plug_options):
+        rng = random.Random(seed)
+        self.devices = {}
+        for i in range(size):
+            host = f"10.{100 + i // 65536}.{i // 256 % 256}.{i % 256}"
+            self.devices[host] = SimulatedPlug(host, rng=random.Random(rng.random()), **plug_options)
+
+    async def discover(self, **_kwargs) -> dict:
+        """Drop-in for kasa.Discover.discover."""
+        return dict(self.devices)
+
+    def stats(self) -> dict:
+        plugs = self.devices.values()
+        return {
+            "updates": sum(p.updates for p in plugs),
+            "handshakes": sum(p.handshakes for p in plugs),
+            "errors": sum(p.errors for p in plugs),
+        }
+
+
+def plug_options_from_env() -> dict:
+    return {
+        "latency": float(os.getenv("KASA_SIM_LATENCY", 0.02)),
+        "jitter": float(os.getenv("KASA_SIM_JITTER", 0.01)),
+        "error_rate": float(os.getenv("KASA_SIM_ERROR_RATE", 0)),
+        "handshake_latency": float(os.getenv("KASA_SIM_HANDSHAKE_LATENCY", 0.05)),
+        "handshake_rounds": int(os.getenv("KASA_SIM_HANDSHAKE_ROUNDS", 1000)),
+    }
+
+
+def build_device(entry, credentials=None) -> SimulatedPlug:
+    """Worker device factory (KASA_WORKER_DEVICE_FACTORY=kasa_exporter.devices.simulator:build_device)."""
+    return SimulatedPlug(entry["host"], **plug_options_from_env())
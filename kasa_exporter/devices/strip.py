@@ -0,0 +1,103 @@
+import structlog
+
+from .prom_device_extractor import (DimensionsType,
+                                    PrometheusDeviceExtractor, PromMetricType)
+from .KP125M import hours_since, tiers
+
+logger = structlog.get_logger()
+
+# Power strips (HS300, KP303, KP400, ...) are polled as one device, the strip
+# update refreshes every outlet and the outlet metrics fan out per child.
+# Outlets without an emeter (KP303) only export their state.
+
+
+def outlet_index(device) -> str:
+    return str(device.parent.children.index(device))
+
+
+dimensions: DimensionsType = {
+    "device_id": None,
+    "alias": None,
+    "model": None,
+}
+
+outlet_dimensions: DimensionsType = {
+    "device_id": None,
+    "alias": None,
+    "model": None,
+    "parent_id": lambda d: d.parent.device_id,
+    "outlet": outlet_index,
+}
+
+metrics = {
+    "strip_outlets_on": {
+        "tier": "power",
+        "features": [],
+        "type": PromMetricType.GAUGE,
+        "getter": lambda d: sum(1 for outlet in d.children if outlet.is_on),
+    },
+    "strip_current_consumption": {
+        "tier": "power",
+        "type": PromMetricType.GAUGE,
+        "feature": "current_consumption",
+    },
+    "strip_rssi": {
+        "tier": "energy",
+        "type": PromMetricType.GAUGE,
+        "feature": "rssi",
+    },
+}
+
+outlet_metrics = {
+    "outlet_state": {
+        "tier": "power",
+        "type": PromMetricType.ENUM,
+        "feature": "state",
+        "states": ["on", "off"],
+    },
+    "outlet_on_since": {
+        "tier": "energy",
+        "type": PromMetricType.GAUGE,
+        "feature": "on_since",
+        "transform": hours_since,
+    },
+    "outlet_current_consumption": {
+        "tier": "power",
+        "type": PromMetricType.GAUGE,
+        "feature": "current_consumption",
+    },
+    "outlet_voltage": {
+        "tier": "power",
+        "type": PromMetricType.GAUGE,
+        "feature": "voltage",
+    },
+    "outlet_current": {
+        "tier": "power",
+        "type": PromMetricType.GAUGE,
+        "feature": "current",
+    },
+    "outlet_consumption_today": {
+        "tier": "energy",
+        "type": PromMetricType.GAUGE,
+        "feature": "consumption_today",
+    },
+    "outlet_consumption_this_month": {
+        "tier": "energy",
+        "type": PromMetricType.GAUGE,
+        "feature": "consumption_this_month",
+    },
+}
+
+OutletExtractor = PrometheusDeviceExtractor(
+    metrics=outlet_metrics,
+    dimensions=outlet_dimensions,
+    tiers=tiers,
+)
+
+Extractor = PrometheusDeviceExtractor(
+    metrics=metrics,
+    dimensions=dimensions,
+    tiers=tiers,
+    children=OutletExtractor,
+)
+
@@ -0,0 +1,181 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from kasa import DeviceType, Feature
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.devices import KP125M
+from kasa_exporter.devices.extractor_registry import build_extractor, default_registry
+from kasa_exporter.devices.generic import FeatureExtractor, dimensions
+from kasa_exporter.devices.prom_device_extractor import (
+    PromMetricType,
+    PrometheusDeviceExtractor,
+)
+
+SPEC = """
+name = "HS110"
+models = ["HS110"]
+
+[metrics.current_consumption]
+type = "gauge"
+tier = "power"
+
+[metrics.hs110_led]
+type = "enum"
+feature = "led"
+states = ["on", "off"]
+"""
+
+
+class EnergyModule:
+    def __init__(self):
+        self.power = 12.5
+        self.voltage = None
+
+
+def make_device(model="HS110(EU)", device_type=DeviceType.Plug):
+    device = SimpleNamespace(
+        device_id="8006",
+        alias="kitchen",
+        model=model,
+        device_type=device_type,
+        is_on=True,
+        led=False,
+        ssid="home",
+    )
+    energy = EnergyModule()
+    device.features = {
+        "state": Feature(device, id="state", name="State", attribute_getter="is_on",
+                         attribute_setter="set_state", type=Feature.Type.Switch,
+                         category=Feature.Category.Primary),
+        "led": Feature(device, id="led", name="LED", attribute_getter="led",
+                       attribute_setter="set_led", type=Feature.Type.Switch),
+        "ssid": Feature(device, id="ssid", name="SSID", attribute_getter="ssid",
+                        type=Feature.Type.Sensor),
+        "current_consumption": Feature(device, id="current_consumption",
+                                       name="Current consumption", attribute_getter="power",
+                                       container=energy, type=Feature.Type.Sensor,
+                                       unit_getter=lambda: "W",
+                                       category=Feature.Category.Primary),
+        "voltage": Feature(device, id="voltage", name="Voltage", attribute_getter="voltage",
+                           container=energy, type=Feature.Type.Sensor),
+        "reboot": Feature(device, id="reboot", name="Reboot", attribute_setter="reboot",
+                          type=Feature.Type.Action),
+    }
+    return device, energy
+
+
+class TestExtractorSelection(unittest.TestCase):
+    def setUp(self):
+        self.registry = default_registry()
+
+    def test_model_then_family_then_generic(self):
+        self.assertEqual(self.registry.select(SimpleNamespace(model="KP125M(US)")), "KP125M")
+        strip = SimpleNamespace(model="HS300(US)", device_type=DeviceType.Strip)
+        self.assertEqual(self.registry.select(strip), "strip")
+        bulb = SimpleNamespace(model="KL130(US)", device_type=DeviceType.Bulb)
+        self.assertEqual(self.registry.select(bulb), "generic")
+
+    def test_specs_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, "hs110.toml"), "w") as f:
+                f.write(SPEC)
+            self.assertEqual(self.registry.load_specs(tmp), 1)
+        device, energy = make_device()
+        self.assertEqual(self.registry.select(device), "HS110")
+
+        collector_registry = CollectorRegistry()
+        extractor = self.registry.extractors["HS110"]
+        # Shares current_consumption with the KP125M extractor
+        KP125M.Extractor.copy().initialize_metrics(collector_registry)
+        extractor.initialize_metrics(collector_registry)
+        extractor.update_metrics(device)
+        labels = {"device_id": "8006", "alias": "kitchen", "model": "HS110(EU)"}
+        sample = collector_registry.get_sample_value
+        self.assertEqual(sample("current_consumption", labels), 12.5)
+        self.assertEqual(sample("hs110_led", {**labels, "hs110_led": "off"}), 1)
+
+    def test_invalid_spec(self):
+        with self.assertRaises(ValueError):
+            build_extractor({"metrics": {"power": {"type": "gauge", "getter": "power"}}})
+        with self.assertRaises(ValueError):
+            build_extractor({"metrics": {"power": {"type": "meter"}}})
+
+    def test_conflicting_metric(self):
+        collector_registry = CollectorRegistry()
+        KP125M.Extractor.copy().initialize_metrics(collector_registry)
+        extractor = build_extractor({"metrics": {"current_consumption": {"type": "counter"}}})
+        with self.assertRaises(ValueError):
+            extractor.initialize_metrics(collector_registry)
+
+
+class TestCompiledAccessors(unittest.TestCase):
+    def setUp(self):
+        self.collector_registry = CollectorRegistry()
+        self.labels = {"device_id": "8006", "alias": "kitchen", "model": "HS110(EU)"}
+
+    def test_missing_features_are_skipped(self):
+        extractor = KP125M.Extractor.copy()
+        extractor.initialize_metrics(self.collector_registry)
+        device, energy = make_device()
+        extractor.update_metrics(device)  # no signal_level, rssi, firmware, ...
+
+        sample = self.collector_registry.get_sample_value
+        self.assertEqual(sample("current_consumption", self.labels), 12.5)
+        self.assertEqual(sample("state", {**self.labels, "state": "on"}), 1)
+        self.assertEqual(sample("ssid_info", {**self.labels, "ssid": "home"}), 1)
+        self.assertIsNone(sample("signal_level", self.labels))
+
+        # Accessors read the feature's container, not a copy of its value
+        energy.power = 20
+        device.is_on = False
+        extractor.update_metrics(device)
+        self.assertEqual(sample("current_consumption", self.labels), 20)
+        self.assertEqual(sample("state", {**self.labels, "state": "off"}), 1)
+
+    def test_rebinds_when_features_change(self):
+        extractor = PrometheusDeviceExtractor(
+            metrics={"current_consumption": {"type": PromMetricType.GAUGE,
+                                              "feature": "current_consumption"}},
+            dimensions=dimensions,
+        )
+        extractor.initialize_metrics(self.collector_registry)
+        device, _ = make_device()
+        features = device.features
+        device.features = {}
+        extractor.update_metrics(device)
+        self.assertIsNone(self.collector_registry.get_sample_value("current_consumption", self.labels))
+        device.features = features
+        extractor.update_metrics(device)
+        self.assertEqual(self.collector_registry.get_sample_value("current_consumption", self.labels), 12.5)
+
+
+class TestGenericExtractor(unittest.TestCase):
+    def test_metrics_from_features(self):
+        collector_registry = CollectorRegistry()
+        extractor = FeatureExtractor(dimensions=dimensions, tiers=KP125M.tiers)
+        extractor.initialize_metrics(collector_registry)
+        device, _ = make_device(model="KL130(US)", device_type=DeviceType.Bulb)
+        extractor.update_metrics(device)
+
+        # Numbers and booleans, not strings, actions or features without a value
+        self.assertEqual(
+            set(extractor.metrics), {"kasa_state", "kasa_led", "kasa_current_consumption"}
+        )
+        labels = {"device_id": "8006", "alias": "kitchen", "model": "KL130(US)"}
+        sample = collector_registry.get_sample_value
+        self.assertEqual(sample("kasa_current_consumption", labels), 12.5)
+        self.assertEqual(sample("kasa_state", labels), 1)
+        self.assertEqual(sample("kasa_led", labels), 0)
+        self.assertEqual(extractor.metrics["kasa_state"]["tier"], "power")
+        self.assertEqual(extractor.metrics["kasa_led"]["tier"], "inventory")
+        self.assertEqual(
+            extractor.metric_objects["kasa_current_consumption"]["metric"]._documentation,
+            "Current consumption (W)",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
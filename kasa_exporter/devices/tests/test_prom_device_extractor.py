@@ -79,5 +79,167 @@ class TestPrometheusDeviceExtractor(unittest.TestCase):
     #     mock_logger.debug.assert_called()
 
 
+class FakeDevice:
+    def __init__(self, device_id, alias, **state):
+        self.device_id = device_id
+        self.alias = alias
+        self.state_information = state
+
+
+class TestCompiledUpdateMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.rate_class = "off_peak"
+        self.extractor = PrometheusDeviceExtractor(
+            metrics={
+                "power": PromMetricType.GAUGE,
+                "state": {
+                    "type": PromMetricType.ENUM,
+                    "states": ["on", "off"],
+                    "getter": lambda d: "on" if d.state_information["power"] else "off",
+                },
+                "cost": {
+                    "type": PromMetricType.GAUGE,
+                    "getter": lambda d: d.state_information["power"] / 1000,
+                    "derive_labels": {"rate_class": lambda _d: self.rate_class},
+                },
+                "missing": PromMetricType.GAUGE,
+            },
+            dimensions={"device_id": None, "alias": lambda d: d.alias.upper()},
+        )
+        self.extractor.initialize_metrics(registry=self.registry)
+
+    def sample(self, name, **labels):
+        return self.registry.get_sample_value(name, labels)
+
+    def test_update_metrics_sets_values(self):
+        self.extractor.update_metrics(FakeDevice("d1", "desk", power=120))
+        self.extractor.update_metrics(FakeDevice("d2", "lamp", power=0))
+
+        self.assertEqual(self.sample("power", device_id="d1", alias="DESK"), 120)
+        self.assertEqual(self.sample("state", device_id="d2", alias="LAMP", state="off"), 1)
+        self.assertEqual(
+            self.sample("cost", device_id="d1", alias="DESK", rate_class="off_peak"), 0.12
+        )
+        # Metrics without a value are skipped instead of exported as empty series
+        self.assertIsNone(self.sample("missing", device_id="d1", alias="DESK"))
+
+    def test_bound_children_are_cached_per_device(self):
+        device = FakeDevice("d1", "desk", power=120)
+        self.extractor.update_metrics(device)
+        plan = self.extractor._device_plans[("d1", "DESK")]
+
+        device.state_information["power"] = 80
+        self.extractor.update_metrics(device)
+        self.assertIs(self.extractor._device_plans[("d1", "DESK")], plan)
+        self.assertEqual(self.sample("power", device_id="d1", alias="DESK"), 80)
+
+    def test_derived_labels_follow_current_value(self):
+        device = FakeDevice("d1", "desk", power=1000)
+        self.extractor.update_metrics(device)
+        self.rate_class = "on_peak"
+        self.extractor.update_metrics(device)
+        self.assertEqual(
+            self.sample("cost", device_id="d1", alias="DESK", rate_class="on_peak"), 1
+        )
+
+    def test_registering_a_metric_recompiles(self):
+        self.extractor.update_metrics(FakeDevice("d1", "desk", power=1))
+        self.extractor.register_metric("voltage", PromMetricType.GAUGE)
+        self.extractor.update_metrics(FakeDevice("d1", "desk", power=1, voltage=120))
+        self.assertEqual(self.sample("voltage", device_id="d1", alias="DESK"), 120)
+
+
+class TestSeriesLifecycle(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.rate_class = "off_peak"
+        self.extractor = PrometheusDeviceExtractor(
+            metrics={
+                "power": PromMetricType.GAUGE,
+                "cost": {
+                    "type": PromMetricType.GAUGE,
+                    "getter": lambda d: d.state_information["power"] / 1000,
+                    "derive_labels": {"rate_class": lambda _d: self.rate_class},
+                },
+            },
+            dimensions={"device_id": None, "alias": None},
+        )
+        self.extractor.initialize_metrics(registry=self.registry)
+
+    def series(self, name):
+        return [
+            sample.labels
+            for family in self.registry.collect()
+            if family.name == name
+            for sample in family.samples
+        ]
+
+    def test_forget_device_removes_its_series(self):
+        desk, lamp = FakeDevice("d1", "desk", power=10), FakeDevice("d2", "lamp", power=20)
+        self.extractor.update_metrics(desk)
+        self.extractor.update_metrics(lamp)
+
+        self.assertEqual(self.extractor.forget_device(desk), 2)
+        self.assertEqual(self.series("power"), [{"device_id": "d2", "alias": "lamp"}])
+        self.assertEqual(len(self.series("cost")), 1)
+        self.assertEqual(
+            self.registry.get_sample_value(
+                "device_extractor_series_evicted_total", {"metric": "power", "reason": "pruned"}
+            ),
+            1,
+        )
+
+        # A device coming back gets fresh series
+        self.extractor.update_metrics(desk)
+        self.assertEqual(len(self.series("power")), 2)
+
+    def test_expire_series_drops_stale_derived_labels(self):
+        device = FakeDevice("d1", "desk", power=10)
+        self.extractor.update_metrics(device)
+        self.rate_class = "on_peak"
+        self.extractor.update_metrics(device)
+        self.assertEqual(len(self.series("cost")), 2)
+
+        # Only the frozen off_peak series is past the TTL
+        self.extractor._derived_seen[
+            (self.extractor.metric_objects["cost"]["metric"], "d1", "desk", "off_peak")
+        ] -= 1000
+        self.assertEqual(self.extractor.expire_series(ttl=600), 1)
+        self.assertEqual(
+            self.series("cost"), [{"device_id": "d1", "alias": "desk", "rate_class": "on_peak"}]
+        )
+        self.assertEqual(len(self.series("power")), 1)
+
+    def test_expire_series_drops_silent_devices(self):
+        self.extractor.update_metrics(FakeDevice("d1", "desk", power=10))
+        self.extractor.update_metrics(FakeDevice("d1", "renamed", power=10))
+        self.extractor._device_seen[("d1", "desk")] -= 1000
+
+        self.assertEqual(self.extractor.expire_series(ttl=600), 2)
+        self.assertEqual(self.series("power"), [{"device_id": "d1", "alias": "renamed"}])
+        self.assertEqual(
+            self.registry.get_sample_value("device_extractor_series", {"metric": "power"}), 1
+        )
+
+    def test_series_budget_rejects_new_series(self):
+        self.extractor.series_budget = 2
+        for i in range(3):
+            self.extractor.update_metrics(FakeDevice(f"d{i}", "plug", power=10))
+
+        self.assertEqual(len(self.series("power")), 2)
+        self.assertEqual(
+            self.registry.get_sample_value(
+                "device_extractor_series_rejected_total", {"metric": "power"}
+            ),
+            1,
+        )
+
+        # Freed budget is available again
+        self.extractor.forget_device(FakeDevice("d0", "plug"))
+        self.extractor.update_metrics(FakeDevice("d2", "plug", power=10))
+        self.assertIn({"device_id": "d2", "alias": "plug"}, self.series("power"))
+
+
 if __name__ == "__main__":
     unittest.main()
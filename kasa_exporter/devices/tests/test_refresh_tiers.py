@@ -0,0 +1,218 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from kasa import Credentials, DeviceConfig, Module
+from kasa.protocol import BaseTransport
+from kasa.smart import SmartDevice
+from kasa.smart.modules import DeviceModule, Time
+from kasa.smartprotocol import SmartProtocol
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.devices.prom_device_extractor import (
+    PromMetricType,
+    PrometheusDeviceExtractor,
+)
+from kasa_exporter.devices.refresh_tiers import apply_module_intervals, parse_tiers
+
+
+class FakeModule:
+    MINIMUM_UPDATE_INTERVAL_SECS = 0
+
+    @property
+    def update_interval(self):
+        return self.MINIMUM_UPDATE_INTERVAL_SECS
+
+
+class FakeFirmware(FakeModule):
+    MINIMUM_UPDATE_INTERVAL_SECS = 86400
+
+
+SMART_RESULTS = {
+    "component_nego": {"component_list": [
+        {"id": "device", "ver_code": 2},
+        {"id": "time", "ver_code": 1},
+        {"id": "energy_monitoring", "ver_code": 2},
+        {"id": "led", "ver_code": 1},
+    ]},
+    "get_device_info": {
+        "device_id": "8006", "model": "KP125M", "type": "SMART.KASAPLUG",
+        "nickname": "a2l0Y2hlbg==", "ssid": "aG9tZQ==", "mac": "AA-BB-CC-DD-EE-FF",
+        "device_on": True, "on_time": 120, "rssi": -50, "signal_level": 3,
+        "fw_ver": "1.0", "hw_ver": "1.0", "overheated": False,
+        "region": "America/Denver", "time_diff": -420,
+    },
+    "get_device_time": {"timestamp": 1718000000, "time_diff": -420, "region": "America/Denver"},
+    "get_energy_usage": {"today_energy": 10, "month_energy": 100, "current_power": 12500},
+    "get_current_power": {"current_power": 12},
+    "get_led_info": {"led_rule": "always", "led_status": True},
+}
+
+
+class FakeSmartTransport(BaseTransport):
+    """Answers the queries of a KP125M, records the methods of every request."""
+
+    default_port = 80
+    credentials_hash = None
+
+    def __init__(self, *, config):
+        super().__init__(config=config)
+        self.methods = []
+
+    async def send(self, request) -> dict:
+        request = json.loads(request) if isinstance(request, str) else request
+        requests = request["params"]["requests"] if request["method"] == "multipleRequest" else [request]
+        self.methods.append([r["method"] for r in requests])
+        responses = [
+            {"method": r["method"], "result": SMART_RESULTS.get(r["method"], {}),
+             "error_code": 0 if r["method"] in SMART_RESULTS else -1}
+            for r in requests
+        ]
+        if request["method"] != "multipleRequest":
+            return responses[0]
+        return {"error_code": 0, "result": {"responses": responses}}
+
+    async def close(self):
+        pass
+
+    async def reset(self):
+        pass
+
+
+class TestParseTiers(unittest.TestCase):
+    def test_overrides(self):
+        tiers = parse_tiers(" energy=30, extra=5 ", {"power": 0, "energy": 60})
+        self.assertEqual(tiers, {"power": 0, "energy": 30.0, "extra": 5.0})
+        self.assertEqual(parse_tiers("", {"power": 0}), {"power": 0})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_tiers("energy", {})
+
+
+class TestTieredExtractor(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.device = SimpleNamespace(alias="plug", power=1.0, firmware=1.0)
+        self.extractor = PrometheusDeviceExtractor(
+            metrics={
+                "power": {
+                    "type": PromMetricType.GAUGE,
+                    "tier": "power",
+                    "getter": lambda d: d.power,
+                },
+                "firmware": {
+                    "type": PromMetricType.GAUGE,
+                    "tier": "inventory",
+                    "features": ["firmware", "alias"],
+                    "getter": lambda d: d.firmware,
+                },
+            },
+            dimensions={"alias": None},
+            tiers={"power": 0, "inventory": 3600},
+        )
+        self.extractor.initialize_metrics(self.registry)
+
+    def sample(self, name):
+        return self.registry.get_sample_value(name, {"alias": "plug"})
+
+    def test_slower_tier_waits_for_its_interval(self):
+        clock = "kasa_exporter.devices.prom_device_extractor.time.monotonic"
+        with patch(clock, return_value=1000.0):
+            self.extractor.update_metrics(self.device)
+        self.device.power, self.device.firmware = 2.0, 2.0
+        with patch(clock, return_value=1060.0):
+            self.extractor.update_metrics(self.device)
+        self.assertEqual(self.sample("power"), 2.0)
+        self.assertEqual(self.sample("firmware"), 1.0)
+        with patch(clock, return_value=4600.0):
+            self.extractor.update_metrics(self.device)
+        self.assertEqual(self.sample("firmware"), 2.0)
+
+    def test_feature_intervals(self):
+        self.assertEqual(
+            self.extractor.feature_intervals(),
+            {"power": 0.0, "firmware": 3600.0, "alias": 3600.0},
+        )
+
+    def test_unknown_tier(self):
+        extractor = PrometheusDeviceExtractor(
+            metrics={"power": {"type": PromMetricType.GAUGE, "tier": "fast"}},
+            tiers={"power": 0},
+        )
+        with self.assertRaises(ValueError):
+            extractor.initialize_metrics(CollectorRegistry())
+
+
+class TestApplyModuleIntervals(unittest.TestCase):
+    def test_module_intervals(self):
+        energy, led, time, firmware = FakeModule(), FakeModule(), FakeModule(), FakeFirmware()
+        info = DeviceModule.__new__(DeviceModule)
+        device = SimpleNamespace(
+            modules={
+                "Energy": energy,
+                "Led": led,
+                "Time": time,
+                "Firmware": firmware,
+                "DeviceModule": info,
+            },
+            features={
+                "current_consumption": SimpleNamespace(container=energy),
+                "consumption_today": SimpleNamespace(container=energy),
+                "led": SimpleNamespace(container=led),
+                "update_available": SimpleNamespace(container=firmware),
+                "device_time": SimpleNamespace(container=time),
+                "rssi": SimpleNamespace(container=None),
+            },
+        )
+        intervals = {
+            "current_consumption": 0,
+            "consumption_today": 60,
+            "led": 3600,
+            "update_available": 3600,
+            "rssi": 60,
+        }
+        self.assertEqual(apply_module_intervals(device, intervals), 1)
+        # Shortest interval of the features read from the module
+        self.assertEqual(energy.update_interval, 0)
+        self.assertEqual(led.update_interval, 3600)
+        # No metric reads the device clock, but on_since is computed from it
+        self.assertEqual(time.update_interval, 0)
+        # The library default is longer and kept
+        self.assertEqual(firmware.update_interval, 86400)
+        self.assertNotIn("MINIMUM_UPDATE_INTERVAL_SECS", vars(info))
+        # Set per instance, other devices keep the class default
+        self.assertEqual(FakeModule.MINIMUM_UPDATE_INTERVAL_SECS, 0)
+
+    def test_legacy_devices_are_left_alone(self):
+        module = SimpleNamespace(MINIMUM_UPDATE_INTERVAL_SECS=0)
+        device = SimpleNamespace(
+            modules={"Energy": module}, features={"led": SimpleNamespace(container=module)}
+        )
+        self.assertEqual(apply_module_intervals(device, {"led": 3600}), 0)
+        self.assertEqual(apply_module_intervals(SimpleNamespace(), {"led": 3600}), 0)
+
+
+
+class TestSmartDeviceIntervals(unittest.IsolatedAsyncioTestCase):
+    async def test_device_clock_is_always_queried(self):
+        config = DeviceConfig("10.0.0.1", credentials=Credentials("user", "password"))
+        transport = FakeSmartTransport(config=config)
+        device = SmartDevice("10.0.0.1", config=config, protocol=SmartProtocol(transport=transport))
+        await device.update()
+        on_since = device.features["on_since"].value
+
+        changed = apply_module_intervals(device, {"current_consumption": 60, "led": 3600, "rssi": 60})
+        self.assertEqual(changed, 1)
+        self.assertEqual(device.modules[Module.Energy].update_interval, 60)
+        self.assertEqual(device.modules[Module.Time].update_interval, Time.MINIMUM_UPDATE_INTERVAL_SECS)
+
+        await device.update()
+        self.assertIn("get_device_time", transport.methods[-1])
+        self.assertNotIn("get_energy_usage", transport.methods[-1])
+        self.assertEqual(device.features["on_since"].value, on_since)
+
+
+if __name__ == "__main__":
+    unittest.main()
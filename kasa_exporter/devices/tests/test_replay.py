@@ -0,0 +1,231 @@
+import asyncio
+import gzip
+import json
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from kasa import DeviceConfig
+from kasa.exceptions import KasaException
+from kasa.iot import IotPlug
+from kasa.iotprotocol import IotProtocol
+from kasa.protocol import BaseTransport
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.devices.replay import (
+    ReplayFleet,
+    ReplayTransport,
+    TrafficRecorder,
+    load_capture,
+    virtual_identity,
+)
+from kasa_exporter.routines.device_registry import DeviceRegistry
+from kasa_exporter.routines.exporter import DeviceExporter
+
+SYSINFO = {
+    "alias": "kitchen",
+    "model": "HS110(EU)",
+    "mac": "AA:BB:CC:DD:EE:FF",
+    "deviceId": "8006",
+    "hwId": "1",
+    "relay_state": 1,
+    "on_time": 10,
+    "sw_ver": "1.0",
+    "hw_ver": "1.0",
+    "rssi": -50,
+    "led_off": 0,
+    "feature": "TIM:ENE",
+    "type": "IOT.SMARTPLUGSWITCH",
+    "updating": 0,
+    "err_code": 0,
+}
+
+
+class FakeIotTransport(BaseTransport):
+    """Answers every legacy query, power goes up by one watt per update."""
+
+    default_port = 9999
+    credentials_hash = None
+
+    def __init__(self, *, config):
+        super().__init__(config=config)
+        self.power = 10
+        self.sysinfo = SYSINFO
+
+    async def send(self, request: str) -> dict:
+        request = json.loads(request)
+        response = {
+            module: {method: {} for method in methods} for module, methods in request.items()
+        }
+        response["system"]["get_sysinfo"] = dict(self.sysinfo)
+        if "emeter" in request:
+            self.power += 1
+            response["emeter"]["get_realtime"] = {"power_mw": self.power * 1000}
+        return response
+
+    async def close(self):
+        pass
+
+    async def reset(self):
+        pass
+
+
+def make_plug(host):
+    config = DeviceConfig(host)
+    return IotPlug(host, protocol=IotProtocol(transport=FakeIotTransport(config=config)))
+
+
+class TestCaptureAndReplay(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_exporter(self):
+        collector_registry = CollectorRegistry()
+        registry = DeviceRegistry(collector_registry)
+        registry.discovery_cache.path = None
+        exporter = DeviceExporter(registry, collector_registry)
+        exporter.sample_ring.path = None
+        return registry, exporter
+
+    async def test_capture_during_polling(self):
+        registry, exporter = self.make_exporter()
+        exporter.recorder = TrafficRecorder(self.tmp.name)
+        registry.devices = {"10.0.0.1": make_plug("10.0.0.1")}
+        await exporter.poll_devices()
+        await exporter.poll_devices()
+        exporter.recorder.close()
+
+        entry, exchanges = load_capture(os.path.join(self.tmp.name, "10.0.0.1.jsonl.gz"))
+        self.assertEqual(entry["host"], "10.0.0.1")
+        self.assertEqual(entry["device_class"], "IotPlug")
+        # Initial sysinfo query, then one full module query per cycle
+        self.assertEqual(len(exchanges), 3)
+        self.assertEqual(exchanges[0]["q"], {"system": {"get_sysinfo": {}}})
+        self.assertEqual(
+            [e["r"]["emeter"]["get_realtime"]["power_mw"] for e in exchanges[1:]], [11000, 12000]
+        )
+
+    async def test_replay_multiplies_the_capture(self):
+        registry, exporter = self.make_exporter()
+        exporter.recorder = TrafficRecorder(self.tmp.name)
+        registry.devices = {"10.0.0.1": make_plug("10.0.0.1")}
+        for _ in range(3):
+            await exporter.poll_devices()
+        exporter.recorder.close()
+
+        fleet = ReplayFleet(self.tmp.name, size=3, speed=float("inf"))
+        self.assertEqual(len(fleet.devices), 3)
+        original = fleet.devices["10.200.0.0"]
+        for _ in range(4):
+            await original.update()
+        # Recorded cycles come back in order and wrap around
+        self.assertEqual(original.features["current_consumption"].value, 11)
+        for device in fleet.devices.values():
+            await device.update()
+
+        # Every device starts with the sysinfo query
+        self.assertEqual(fleet.stats(), {"requests": 10, "misses": 0})
+        device_ids = sorted(device.device_id for device in fleet.devices.values())
+        # Captures are redacted, the MAC is derived from the recorded address
+        self.assertEqual(
+            device_ids, ["02:00:0A:00:00:01", "02:00:0A:00:00:01#1", "02:00:0A:00:00:01#2"]
+        )
+        aliases = sorted(device.alias for device in fleet.devices.values())
+        self.assertEqual(aliases, ["kitchen", "kitchen #1", "kitchen #2"])
+
+    async def test_captures_are_redacted_and_rotated(self):
+        registry, exporter = self.make_exporter()
+        recorder = exporter.recorder = TrafficRecorder(self.tmp.name)
+        recorder.max_bytes = 2000
+        plug = make_plug("10.0.0.1")
+        plug.protocol._transport.sysinfo = dict(SYSINFO, ssid="home-wifi", latitude_i=397392)
+        registry.devices = {"10.0.0.1": plug}
+        for _ in range(6):
+            await exporter.poll_devices()
+        recorder.close()
+
+        path = os.path.join(self.tmp.name, "10.0.0.1.jsonl.gz")
+        self.assertTrue(os.path.exists(path + ".1"))
+        _, exchanges = load_capture(path)
+        _, rotated = load_capture(path + ".1")
+        self.assertLess(len(exchanges), 7)
+        info = rotated[0]["r"]["system"]["get_sysinfo"]
+        self.assertEqual((info["mac"], info["ssid"], info["latitude_i"]), ("02:00:0A:00:00:01", "", 0))
+        self.assertEqual(info["alias"], "kitchen")
+        for name in (path, path + ".1"):
+            with gzip.open(name, "rt") as f:
+                content = f.read()
+            self.assertNotIn("AA:BB:CC:DD:EE:FF", content)
+            self.assertNotIn("home-wifi", content)
+
+    async def test_unredacted_capture_and_missing_transport(self):
+        with patch.dict(os.environ, {"KASA_CAPTURE_REDACT": "false"}):
+            recorder = TrafficRecorder(self.tmp.name)
+        plug = make_plug("10.0.0.1")
+        recorder.attach("10.0.0.1", plug)
+        await plug.update()
+        recorder.close()
+        _, exchanges = load_capture(os.path.join(self.tmp.name, "10.0.0.1.jsonl.gz"))
+        self.assertEqual(exchanges[0]["r"]["system"]["get_sysinfo"]["mac"], "AA:BB:CC:DD:EE:FF")
+
+        # A python-kasa without protocol._transport disables capture with an error
+        recorder = TrafficRecorder(self.tmp.name)
+        recorder.attach("10.0.0.2", SimpleNamespace(protocol=SimpleNamespace()))
+        self.assertIsNone(recorder.path)
+
+
+class TestReplayTransport(unittest.IsolatedAsyncioTestCase):
+    def make_transport(self, exchanges, speed=1.0):
+        return ReplayTransport(config=DeviceConfig("10.0.0.1"), exchanges=exchanges, speed=speed)
+
+    async def test_responses_cycle_in_recorded_order(self):
+        query = {"method": "get_device_info"}
+        transport = self.make_transport(
+            [{"d": 0, "q": query, "r": {"n": 1}}, {"d": 0, "q": query, "r": {"n": 2}}]
+        )
+        request = json.dumps(dict(query, request_time_milis=1, terminal_uuid="x"))
+        answers = [(await transport.send(request))["n"] for _ in range(3)]
+        self.assertEqual(answers, [1, 2, 1])
+
+    async def test_falls_back_to_the_request_shape(self):
+        recorded = {"emeter": {"get_daystat": {"year": 2024, "month": 1}}}
+        transport = self.make_transport([{"d": 0, "q": recorded, "r": {"ok": True}}])
+        request = {"emeter": {"get_daystat": {"year": 2026, "month": 10}}}
+        # Parameter values of nested queries differ, the modules and methods match
+        with self.assertRaises(KasaException):
+            await transport.send(json.dumps({"time": {"get_time": {}}}))
+        self.assertEqual(transport.misses, 1)
+        self.assertEqual(await transport.send(json.dumps(request)), {"ok": True})
+
+    async def test_speed_and_recorded_errors(self):
+        query = {"method": "get_device_info"}
+        transport = self.make_transport(
+            [{"d": 0.2, "q": query, "e": "KasaException", "m": "boom"}], speed=10
+        )
+        start = time.monotonic()
+        with self.assertRaisesRegex(KasaException, "boom"):
+            await transport.send(json.dumps(query))
+        self.assertLess(time.monotonic() - start, 0.15)
+
+        transport = self.make_transport([{"d": 0.2, "q": query, "e": "TimeoutError", "m": ""}], 100)
+        with self.assertRaises(asyncio.TimeoutError):
+            await transport.send(json.dumps(query))
+
+    def test_virtual_identity(self):
+        nickname = "a2l0Y2hlbg=="  # kitchen
+        renamed = virtual_identity(
+            {"result": {"device_id": "X", "nickname": nickname, "rssi": -50}}, "#2"
+        )
+        self.assertEqual(renamed["result"]["device_id"], "X#2")
+        self.assertEqual(renamed["result"]["nickname"], "a2l0Y2hlbiAjMg==")
+        self.assertEqual(renamed["result"]["rssi"], -50)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from unittest.mock import patch
+
+from kasa.exceptions import KasaException
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.devices.simulator import SimulatedFleet, SimulatedPlug
+from kasa_exporter.routines.device_registry import DeviceRegistry
+from kasa_exporter.routines.exporter import DeviceExporter
+
+
+class TestSimulatedPlug(unittest.IsolatedAsyncioTestCase):
+    async def test_handshake_only_once_per_session(self):
+        plug = SimulatedPlug("10.0.0.1", latency=0, jitter=0, handshake_latency=0)
+        await plug.update()
+        await plug.update()
+        self.assertEqual((plug.updates, plug.handshakes), (2, 1))
+        self.assertGreater(plug.features["current_consumption"].value, -1)
+
+        await plug.disconnect()
+        await plug.update()
+        self.assertEqual(plug.handshakes, 2)
+
+    async def test_error_rate(self):
+        plug = SimulatedPlug("10.0.0.1", latency=0, jitter=0, handshake_latency=0, error_rate=1)
+        with self.assertRaises(KasaException):
+            await plug.update()
+        # A failure drops the session like a real transport error
+        self.assertFalse(plug.session)
+
+
+class TestSimulatedFleet(unittest.IsolatedAsyncioTestCase):
+    async def test_fleet_drives_the_exporter(self):
+        fleet = SimulatedFleet(20, latency=0, jitter=0, handshake_latency=0)
+        self.assertEqual(len(set(fleet.devices)), 20)
+
+        collector_registry = CollectorRegistry()
+        registry = DeviceRegistry(collector_registry)
+        registry.discovery_cache.path = None
+        exporter = DeviceExporter(registry, collector_registry)
+        exporter.sample_ring.path = None
+        with patch("kasa_exporter.routines.device_registry.Discover.discover", fleet.discover):
+            await registry.discover_devices(None, {})
+        await exporter.poll_devices()
+
+        polled = collector_registry.get_sample_value("device_exporter_last_cycle_polled_devices")
+        self.assertEqual(polled, 20)
+        self.assertEqual(fleet.stats(), {"updates": 20, "handshakes": 20, "errors": 0})
+        content, _, _ = exporter.snapshot.rendered
+        self.assertIn(b'alias="sim-10.100.0.19"', content)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+import json
+import unittest
+
+from kasa import DeviceConfig
+from kasa.iot import IotStrip
+from kasa.iotprotocol import IotProtocol
+from kasa.protocol import BaseTransport
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.routines.device_registry import DeviceRegistry
+from kasa_exporter.routines.exporter import DeviceExporter
+
+
+def strip_sysinfo(model, feature, outlets):
+    return {
+        "alias": "rack",
+        "model": model,
+        "mac": "AA:BB:CC:DD:EE:FF",
+        "deviceId": "8006AB",
+        "hwId": "1",
+        "oemId": "1",
+        "sw_ver": "1.0",
+        "hw_ver": "1.0",
+        "rssi": -50,
+        "led_off": 0,
+        "feature": feature,
+        "type": "IOT.SMARTPLUGSWITCH",
+        "updating": 0,
+        "err_code": 0,
+        "child_num": outlets,
+        "children": [
+            {
+                "id": f"8006AB{i:02d}",
+                "alias": f"outlet {i}",
+                "state": i % 2,
+                "on_time": 60 * i,
+                "next_action": {"type": -1},
+            }
+            for i in range(outlets)
+        ],
+    }
+
+
+class FakeStripTransport(BaseTransport):
+    """Answers legacy strip queries, outlet n draws n + 1 watts."""
+
+    default_port = 9999
+    credentials_hash = None
+
+    def __init__(self, *, config, sysinfo):
+        super().__init__(config=config)
+        self.sysinfo = sysinfo
+        self.requests = []
+
+    async def send(self, request: str) -> dict:
+        request = json.loads(request)
+        self.requests.append(request)
+        response = {
+            module: {method: {} for method in methods}
+            for module, methods in request.items()
+            if module != "context"
+        }
+        if "system" in request:
+            response["system"]["get_sysinfo"] = json.loads(json.dumps(self.sysinfo))
+        if "time" in request:
+            response["time"] = {
+                "get_time": {"year": 2026, "month": 1, "mday": 1, "hour": 12, "min": 0, "sec": 0},
+                "get_timezone": {"index": 12},
+            }
+        if "emeter" in request:
+            outlet = int(request["context"]["child_ids"][0][-2:])
+            response["emeter"] = {
+                "get_realtime": {
+                    "power_mw": 1000 * (outlet + 1),
+                    "voltage_mv": 120000,
+                    "current_ma": 100,
+                    "total_wh": 5,
+                },
+                "get_daystat": {"day_list": []},
+                "get_monthstat": {"month_list": []},
+            }
+        return response
+
+    async def close(self):
+        pass
+
+    async def reset(self):
+        pass
+
+
+def make_strip(model="HS300(US)", feature="TIM:ENE", outlets=6):
+    config = DeviceConfig("10.0.0.1")
+    transport = FakeStripTransport(config=config, sysinfo=strip_sysinfo(model, feature, outlets))
+    return IotStrip("10.0.0.1", protocol=IotProtocol(transport=transport)), transport
+
+
+class TestStripPolling(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.collector_registry = CollectorRegistry()
+        self.registry = DeviceRegistry(self.collector_registry)
+        self.registry.discovery_cache.path = None
+        self.exporter = DeviceExporter(self.registry, self.collector_registry)
+        self.exporter.sample_ring.path = None
+
+    def sample(self, name, outlet):
+        return self.collector_registry.get_sample_value(
+            name,
+            {
+                "device_id": f"AA:BB:CC:DD:EE:FF_8006AB{outlet:02d}",
+                "alias": f"outlet {outlet}",
+                "model": "Socket for HS300(US)",
+                "parent_id": "AA:BB:CC:DD:EE:FF",
+                "outlet": str(outlet),
+            },
+        )
+
+    async def test_outlets_fan_out_from_one_strip_poll(self):
+        strip, transport = make_strip()
+        self.registry.devices = {"10.0.0.1": strip}
+        await self.exporter.poll_devices()
+        transport.requests.clear()
+        await self.exporter.poll_devices()
+
+        self.assertEqual(
+            self.collector_registry.get_sample_value("device_exporter_last_cycle_polled_devices"), 1
+        )
+        for outlet in range(6):
+            self.assertEqual(self.sample("outlet_current_consumption", outlet), outlet + 1)
+            self.assertEqual(self.sample("outlet_voltage", outlet), 120)
+        self.assertEqual(
+            self.collector_registry.get_sample_value(
+                "outlet_state",
+                {
+                    "device_id": "AA:BB:CC:DD:EE:FF_8006AB01",
+                    "alias": "outlet 1",
+                    "model": "Socket for HS300(US)",
+                    "parent_id": "AA:BB:CC:DD:EE:FF",
+                    "outlet": "1",
+                    "outlet_state": "on",
+                },
+            ),
+            1,
+        )
+        strip_labels = {"device_id": "AA:BB:CC:DD:EE:FF", "alias": "rack", "model": "HS300(US)"}
+        sample = self.collector_registry.get_sample_value
+        self.assertEqual(sample("strip_current_consumption", strip_labels), 21)
+        self.assertEqual(sample("strip_outlets_on", strip_labels), 3)
+
+        # One strip query carrying every outlet's state, one emeter read per outlet,
+        # schedules and anti-theft rules are no longer asked for
+        parent, *outlets = transport.requests
+        self.assertNotIn("context", parent)
+        self.assertIn("system", parent)
+        self.assertEqual(len(outlets), 6)
+        for request in outlets:
+            self.assertEqual(set(request), {"context", "emeter"})
+
+    async def test_strip_without_emeter(self):
+        strip, transport = make_strip(model="KP303(US)", feature="TIM", outlets=3)
+        self.registry.devices = {"10.0.0.1": strip}
+        await self.exporter.poll_devices()
+        transport.requests.clear()
+        await self.exporter.poll_devices()
+
+        self.assertEqual(len(transport.requests), 1)
+        names = {metric.name for metric in self.collector_registry.collect()}
+        labels = {
+            sample.labels["outlet"]
+            for metric in self.collector_registry.collect()
+            if metric.name == "outlet_state"
+            for sample in metric.samples
+        }
+        self.assertEqual(labels, {"0", "1", "2"})
+        samples = [
+            sample
+            for metric in self.collector_registry.collect()
+            if metric.name == "outlet_current_consumption"
+            for sample in metric.samples
+        ]
+        self.assertIn("outlet_current_consumption", names)
+        self.assertEqual(samples, [])
+
+    async def test_pruned_strip_drops_outlet_series(self):
+        strip, _ = make_strip()
+        self.registry.devices = {"10.0.0.1": strip}
+        await self.exporter.poll_devices()
+        self.exporter.forget_device("10.0.0.1", strip)
+        for outlet in range(6):
+            self.assertIsNone(self.sample("outlet_current_consumption", outlet))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,53 +1,172 @@
 import asyncio
 from contextlib import asynccontextmanager
-import logging
+import math
 import os
-from fastapi import FastAPI
-from fastapi.responses import PlainTextResponse
-from prometheus_client import CollectorRegistry, generate_latest
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry
+from prometheus_client.openmetrics.exposition import CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE
 import structlog
 
 from kasa_exporter.routines.device_registry import DeviceRegistry
 from kasa_exporter.routines.exporter import DeviceExporter
+from kasa_exporter.routines.instrumentation import EventLoopMonitor
+from kasa_exporter.routines.live import LiveStream
+from kasa_exporter.routines.probe import DeviceProber
 from kasa_exporter.routines.pushgateway import PushGateway
+from kasa_exporter.routines.reload import ConfigFile, ConfigReloader
+from kasa_exporter.routines.workers import WorkerPool
+from kasa_exporter.utils.log_config import configure_logging
+from kasa_exporter.utils.profiler import sample_stacks
 
-structlog.configure(
-    wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
-    processors=[
-        structlog.processors.TimeStamper(fmt="iso", utc=True),
-        structlog.processors.JSONRenderer(),
-    ],
-)
-
+configure_logging()
 logger = structlog.get_logger()
 
-# Note if you want to push to the gateway as well as scrape, you need to clone the registry, pushing
-# it increments the registry to its next scrape state
+# KASA_CONFIG_FILE settings go into the environment before anything reads it
+config_file = ConfigFile()
+config_file.apply(config_file.load().get("settings", {}))
+
 collector_registry = CollectorRegistry()
 device_registry = DeviceRegistry(collector_registry)
 device_exporter = DeviceExporter(device_registry, collector_registry)
-push_gateway = PushGateway(collector_registry)
+# Pushes the same per-cycle snapshot that /metrics serves
+push_gateway = PushGateway(
+    collector_registry, device_exporter.snapshot, device_exporter.sample_ring
+)
+
+# Polling moves to worker processes when KASA_POLL_WORKERS > 0
+worker_pool = WorkerPool(device_registry, device_exporter)
+event_loop_monitor = EventLoopMonitor(collector_registry)
+# /live subscribers share the exporter's polls, only in-process polling feeds them
+live_stream = LiveStream(collector_registry, device_exporter.scheduler, device_registry)
+device_exporter.poll_listeners.append(live_stream.publish)
+# /debug/profile samples the running process, off unless asked for
+profiler_enabled = os.getenv("KASA_PROFILER", "false").lower() in ("1", "true", "yes")
+device_prober = DeviceProber(
+    device_registry,
+    device_exporter.connection_pool,
+    device_exporter.credentials,
+    collector_registry,
+)
+# SIGHUP or an edit of the config file or an extractor spec reloads in place
+config_reloader = ConfigReloader(collector_registry, device_exporter, config_file)
+config_reloader.reload_listeners.append(
+    lambda registry: setattr(device_prober, "extractor_registry", registry)
+)
+if config_file.path:
+    # The tariff and refresh tiers were set up on import, before the file was applied
+    config_reloader.reload("startup")
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
-    # Load the ML model
-    asyncio.create_task(device_exporter.scrape_devices())
+    if device_registry.membership.path:
+        # Join the shard map first so the warm start already assigns only our devices
+        device_registry.rebalance(device_registry.membership.heartbeat())
+        asyncio.create_task(device_registry.run_membership())
+    # Devices known from the previous run are polled right away, discovery reconciles later
+    device_registry.warm_start(device_exporter.credentials)
+    device_exporter.snapshot.publish()
+    if worker_pool.workers:
+        if device_exporter.lazy:
+            logger.warning("KASA_POLL_MODE=lazy is ignored when polling in worker processes")
+            device_exporter.lazy = False
+        worker_pool.start()
+        asyncio.create_task(worker_pool.run())
+    elif not device_exporter.lazy:
+        asyncio.create_task(device_exporter.scrape_devices())
+    if not device_exporter.lazy:
+        # In lazy mode /metrics requests drive discovery, polling and pruning
+        asyncio.create_task(device_registry.run_discovery(device_exporter.credentials))
+        asyncio.create_task(device_registry.update_registry())
     asyncio.create_task(push_gateway.push_to_gateway())
-    asyncio.create_task(device_registry.update_registry())
+    asyncio.create_task(device_exporter.connection_pool.maintain())
+    asyncio.create_task(event_loop_monitor.run())
+    asyncio.create_task(config_reloader.watch())
+    config_reloader.install_signal_handler(asyncio.get_running_loop())
     yield
+    device_registry.membership.leave()
+    worker_pool.stop()
+    await device_exporter.connection_pool.close_all()
+    push_gateway.close()
+    device_exporter.sample_ring.close()
+    device_exporter.recorder.close()
     
 app = FastAPI(lifespan=lifespan, title="Kasa Exporter", version="0.1.0")
 
 @app.get("/metrics")
-async def get_metrics():
-    metrics_data = generate_latest(collector_registry)
-    return PlainTextResponse(content=metrics_data, media_type="text/plain")
+async def get_metrics(request: Request):
+    if device_exporter.lazy:
+        await device_exporter.refresh_stale()
+    # Rendered once per poll cycle, see SnapshotCollector
+    content, gzipped, etag = device_exporter.snapshot.rendered
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if gzipped is not None and "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        content = gzipped
+    return Response(content=content, media_type=CONTENT_TYPE_LATEST, headers=headers)
+
+@app.get("/probe")
+async def probe(target: str, request: Request):
+    # Leave Prometheus some slack to receive the answer within its scrape timeout
+    try:
+        scrape_timeout = float(request.headers["x-prometheus-scrape-timeout-seconds"])
+        if not math.isfinite(scrape_timeout):
+            raise ValueError(scrape_timeout)
+        timeout = max(scrape_timeout - 0.5, 0.1)
+    except (KeyError, ValueError):
+        # A missing or malformed header leaves the probe at KASA_PROBE_TIMEOUT
+        timeout = None
+    try:
+        content = await device_prober.probe(target, timeout)
+    except PermissionError as e:
+        return Response(content=str(e), status_code=403, media_type="text/plain")
+    return Response(content=content, media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/targets")
+async def targets():
+    # http_sd_configs target list for /probe
+    return device_prober.http_sd_targets()
+
+@app.get("/backfill")
+async def get_backfill(start: float = None, end: float = None):
+    # Buffered device samples as OpenMetrics, for promtool tsdb create-blocks-from openmetrics
+    content = await asyncio.to_thread(device_exporter.sample_ring.export_openmetrics, start, end)
+    return Response(content=content, media_type=OPENMETRICS_CONTENT_TYPE)
+
+def comma_list(value):
+    return [part.strip() for part in value.split(",") if part.strip()] if value else None
+
+@app.get("/live")
+async def live(devices: str = None, fields: str = None):
+    # Server-sent power readings as devices are polled, devices are addresses,
+    # aliases or device ids and fields a subset of LIVE_FIELDS, comma separated
+    try:
+        subscription = live_stream.subscribe(comma_list(devices), comma_list(fields))
+    except ValueError as e:
+        return Response(content=str(e), status_code=400, media_type="text/plain")
+    except OverflowError as e:
+        return Response(content=str(e), status_code=503, media_type="text/plain")
+    return StreamingResponse(
+        live_stream.events(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/debug")
 async def debug_device():
     devices_info = device_registry.get_devices_info()
     return {"devices": devices_info}
 
+@app.get("/debug/profile")
+async def profile(seconds: float = 10, rate: int = 100):
+    # Folded stacks of every thread, for flamegraph.pl, inferno or speedscope
+    if not profiler_enabled:
+        return Response(status_code=404)
+    content = await asyncio.to_thread(sample_stacks, min(seconds, 60), max(1, min(rate, 1000)))
+    return Response(content=content, media_type="text/plain")
+
 if __name__ == "__main__":
     import uvicorn
 
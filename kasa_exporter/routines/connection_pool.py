@@ -0,0 +1,178 @@
+import asyncio
+import os
+import time
+from kasa.exceptions import KasaException, UnsupportedDeviceError
+from prometheus_client import Gauge, Counter, CollectorRegistry
+import structlog
+from .scheduler import ticker
+
+logger = structlog.get_logger()
+
+# Failures after which the session is dropped and re-established before retrying
+RECOVERABLE_ERRORS = (KasaException, OSError)
+
+
+class PooledConnection:
+    def __init__(self, device):
+        self.device = device
+        self.opened_at = time.monotonic()
+        self.last_used = self.opened_at
+        self.failures = 0
+        self.lock = asyncio.Lock()
+
+
+class ConnectionPool:
+    """Keeps authenticated device sessions alive across polling cycles.
+
+    python-kasa transports (KLAP/AES) only handshake when they have no valid
+    session, so as long as the device is not disconnected the next update()
+    reuses the session. The pool owns that lifecycle: it recycles sessions that
+    failed or outlived KASA_POOL_MAX_AGE, retries a failed update once over a
+    fresh handshake and closes connections idle for KASA_POOL_IDLE_TIMEOUT.
+    Sessions of devices the registry prunes (or hands to another shard) are
+    closed right away, see forget_device().
+    """
+
+    def __init__(self, collector_registry: CollectorRegistry):
+        self.connections = {}
+        self.closing = set()  # tasks closing the sessions of forgotten devices
+        self.configure()
+        self.maintenance_interval = float(os.getenv("KASA_POOL_MAINTENANCE_INTERVAL", 30))
+
+        self.open_connections = Gauge(
+            "device_pool_connections",
+            "Number of device sessions held open by the connection pool",
+            registry=collector_registry,
+        )
+        self.handshakes = Counter(
+            "device_pool_handshakes_total",
+            "Device sessions (re-)established by the connection pool",
+            ["reason"],
+            registry=collector_registry,
+        )
+        self.evictions = Counter(
+            "device_pool_evictions_total",
+            "Device sessions closed by the connection pool",
+            ["reason"],
+            registry=collector_registry,
+        )
+
+    @staticmethod
+    def read_settings() -> dict:
+        """The settings a configuration reload may change, from the environment."""
+        return {
+            "idle_timeout": float(os.getenv("KASA_POOL_IDLE_TIMEOUT", 120)),
+            "max_age": float(os.getenv("KASA_POOL_MAX_AGE", 3600)),
+        }
+
+    def configure(self, settings: dict = None):
+        """Switch to new settings, read_settings() when none are given."""
+        for name, value in (settings or self.read_settings()).items():
+            setattr(self, name, value)
+
+    async def _checkout(self, addr, device) -> PooledConnection:
+        conn = self.connections.get(addr)
+        if conn is None or conn.device is not device:
+            replaced = conn
+            conn = self.connections[addr] = PooledConnection(device)
+            self.handshakes.labels(reason="new").inc()
+            self.open_connections.set(len(self.connections))
+            if replaced is not None:
+                # The registry replaced the device object, drop the old session
+                self.evictions.labels(reason="replaced").inc()
+                await self._close(replaced.device, addr)
+        return conn
+
+    def is_healthy(self, conn: PooledConnection) -> bool:
+        return conn.failures == 0 and time.monotonic() - conn.opened_at < self.max_age
+
+    async def _recycle(self, addr, conn: PooledConnection, reason: str):
+        """Drop the session, the next query performs a full handshake again."""
+        await self._close(conn.device, addr)
+        conn.opened_at = time.monotonic()
+        conn.failures = 0
+        self.handshakes.labels(reason=reason).inc()
+
+    async def _close(self, device, addr):
+        try:
+            await device.disconnect()
+        except Exception as e:
+            logger.warning(f"Error disconnecting device {addr}: {str(e)}")
+
+    async def update(self, addr, device):
+        """Refresh the device over its pooled session."""
+        conn = await self._checkout(addr, device)
+        async with conn.lock:
+            conn.last_used = time.monotonic()
+            if not self.is_healthy(conn):
+                await self._recycle(addr, conn, "expired" if conn.failures == 0 else "failure")
+            try:
+                await device.update()
+            except UnsupportedDeviceError:
+                conn.failures += 1
+                raise
+            except RECOVERABLE_ERRORS as e:
+                logger.info(f"Session to {addr} failed, re-handshaking: {str(e)}")
+                await self._recycle(addr, conn, "failure")
+                try:
+                    await device.update()
+                except BaseException:
+                    conn.failures += 1
+                    raise
+            except BaseException:
+                # Includes cancellation by the poll timeout, the session state is unknown
+                conn.failures += 1
+                raise
+
+    async def release(self, addr, reason="released"):
+        conn = self.connections.pop(addr, None)
+        if conn is None:
+            return
+        await self._close(conn.device, addr)
+        self.evictions.labels(reason=reason).inc()
+        self.open_connections.set(len(self.connections))
+
+    def forget_device(self, addr, device):
+        """Prune listener of the device registry, closes the device's session.
+
+        Listeners are called synchronously, so the session leaves the pool at
+        once and is closed by a task after any update still using it.
+        """
+        conn = self.connections.get(addr)
+        if conn is None or conn.device is not device:
+            return
+        del self.connections[addr]
+        self.evictions.labels(reason="pruned").inc()
+        self.open_connections.set(len(self.connections))
+        task = asyncio.get_running_loop().create_task(self._close_after_use(addr, conn))
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    async def _close_after_use(self, addr, conn: PooledConnection):
+        async with conn.lock:
+            await self._close(conn.device, addr)
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        idle = [
+            addr
+            for addr, conn in self.connections.items()
+            if now - conn.last_used > self.idle_timeout and not conn.lock.locked()
+        ]
+        for addr in idle:
+            logger.info(f"Closing idle connection to {addr}")
+            await self.release(addr, reason="idle")
+        return idle
+
+    async def maintain(self):
+        async for _ in ticker(self.maintenance_interval, jitter=0.1):
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Connection pool maintenance failed: {str(e)}")
+
+    async def close_all(self):
+        for addr in list(self.connections):
+            await self.release(addr, reason="shutdown")
+        if self.closing:
+            await asyncio.gather(*self.closing)
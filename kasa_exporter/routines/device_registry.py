@@ -1,25 +1,43 @@
 import asyncio
 from datetime import datetime, timedelta
-import logging
+import os
+import time
 from kasa import Discover
-from prometheus_client import Gauge, Counter, CollectorRegistry
+from prometheus_client import Gauge, Counter, CollectorRegistry, Histogram
 import structlog
+from ..utils.hash_ring import HashRing
+from .discovery_cache import DiscoveryCache
+from .membership import ShardMembership
+from .scheduler import ticker
 
-# Configure structured logging with timestamp
-structlog.configure(
-    wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
-    processors=[
-        structlog.processors.TimeStamper(fmt="iso", utc=True),
-        structlog.processors.JSONRenderer(),
-    ],
-)
 logger = structlog.get_logger()
 
 
 class DeviceRegistry:
-    def __init__(self, collector_registry: CollectorRegistry):
+    """Devices this instance polls.
+
+    `known` holds every device discovery (or the warm-start cache) found,
+    `devices` the subset this instance owns. Without sharding that is all
+    of them; with a ShardMembership file the owner of a device is picked by
+    consistent hashing of its address over the live instances, so when an
+    instance joins or disappears only its share of the devices moves.
+    """
+
+    def __init__(self, collector_registry: CollectorRegistry, membership: ShardMembership = None):
         self.devices = {}
+        self.known = {}
         self.last_checkin = {}
+        # Last discovery response of every known device, ours or another shard's
+        self.last_seen = {}
+        self.configure()
+        self.last_discovery = None  # monotonic start of the last discovery attempt
+        self.discovery_cache = DiscoveryCache()
+        # Called with (addr, device) whenever a device is pruned, replaced or handed to another shard
+        self.prune_listeners = []
+        self.membership = membership or ShardMembership()
+        self.vnodes = int(os.getenv("KASA_SHARD_VNODES", 64))
+        self.ring = HashRing([self.membership.instance_id], self.vnodes)
+        self.owners = {}  # addr -> owning instance id
 
         # Prometheus metrics with the provided registry
         self.total_devices = Gauge(
@@ -37,16 +55,203 @@ class DeviceRegistry:
             "Total number of devices discovered",
             registry=collector_registry,
         )
+        self.discovery_duration = Histogram(
+            "device_registry_discovery_duration_seconds",
+            "Wall time of a discovery broadcast including merging the responses",
+            buckets=(0.5, 1, 2.5, 5, 10, 15, 30, 60),
+            registry=collector_registry,
+        )
+        self.known_devices = Gauge(
+            "device_registry_known_devices",
+            "Devices found by discovery across all shards",
+            registry=collector_registry,
+        )
+        self.shard_members = Gauge(
+            "device_registry_shard_members",
+            "Live exporter instances sharing the fleet",
+            registry=collector_registry,
+        )
+        self.shard_owner = Gauge(
+            "device_registry_shard_owner",
+            "Exporter instance (shard) that polls the device",
+            ["address", "shard"],
+            registry=collector_registry,
+        )
+        self.rebalances = Counter(
+            "device_registry_shard_rebalances_total",
+            "Shard membership changes that reassigned devices",
+            registry=collector_registry,
+        )
+        self.shard_members.set(1)
+
+    @staticmethod
+    def read_settings() -> dict:
+        """The settings a configuration reload may change, from the environment."""
+        return {
+            # Broadcast discovery is slow, so it runs on its own schedule off the polling path
+            "discovery_interval": float(os.getenv("KASA_DISCOVERY_INTERVAL", 300)),
+            # Devices without a successful poll or discovery response for this long are pruned
+            "prune_after": timedelta(seconds=float(os.getenv("KASA_PRUNE_AFTER", 60))),
+        }
+
+    def configure(self, settings: dict = None):
+        """Switch to new settings, read_settings() when none are given."""
+        for name, value in (settings or self.read_settings()).items():
+            setattr(self, name, value)
+
+    def owns(self, addr) -> bool:
+        return self.ring.owner(addr) == self.membership.instance_id
+
+    def _assign(self, addr, device, now=None) -> bool:
+        """Track a known device and poll it if it is ours, returns True if owned."""
+        owner = self.ring.owner(addr)
+        previous = self.owners.get(addr)
+        if previous != owner:
+            if previous is not None:
+                self.shard_owner.remove(addr, previous)
+            self.owners[addr] = owner
+            self.shard_owner.labels(address=addr, shard=owner).set(1)
+        if owner != self.membership.instance_id:
+            return False
+        self.devices[addr] = device
+        self.last_checkin.setdefault(addr, now or datetime.now())
+        return True
+
+    def _release(self, addr, forget=False):
+        """Stop polling a device, forget it entirely when it is gone (pruned)."""
+        device = self.devices.pop(addr, None)
+        self.last_checkin.pop(addr, None)
+        if forget:
+            self.known.pop(addr, None)
+            self.last_seen.pop(addr, None)
+            owner = self.owners.pop(addr, None)
+            if owner is not None:
+                self.shard_owner.remove(addr, owner)
+        if device is not None:
+            for listener in self.prune_listeners:
+                try:
+                    listener(addr, device)
+                except Exception as e:
+                    logger.error(f"Prune listener failed for {addr}: {str(e)}")
+        return device
+
+    def rebalance(self, members) -> int:
+        """Rebuild the ring for the given live instances, returns how many devices moved."""
+        members = sorted(set(members) | {self.membership.instance_id})
+        self.shard_members.set(len(members))
+        if tuple(members) == self.ring.nodes:
+            return 0
+        self.ring = HashRing(members, self.vnodes)
+        moved = 0
+        for addr, device in list(self.known.items()):
+            was_owned = addr in self.devices
+            owned = self._assign(addr, device)
+            if was_owned and not owned:
+                self._release(addr)
+            moved += was_owned != owned
+        self.rebalances.inc()
+        self.total_devices.set(len(self.devices))
+        logger.info(
+            "Rebalanced devices across shards",
+            members=members,
+            owned=len(self.devices),
+            moved=moved,
+        )
+        return moved
+
+    async def run_membership(self):
+        if self.membership.path is None:
+            return
+        async for _ in ticker(self.membership.heartbeat_interval, jitter=0.1):
+            try:
+                # flock and file I/O, kept off the event loop
+                self.rebalance(await asyncio.to_thread(self.membership.heartbeat))
+            except Exception as e:
+                logger.error(f"Shard membership heartbeat failed: {str(e)}")
 
     async def discover_devices(self, credentials, interface):
+        """Broadcast for devices and merge the responses into the registry.
+
+        Known devices keep their existing object (and connection), a device that
+        misses a single broadcast stays registered until it is pruned.
+        """
         found_devices = await Discover.discover(credentials=credentials, **interface)
-        self.devices = dict(found_devices.items())
-        self.discovered_devices.inc(len(found_devices))
+        new_devices = 0
+        changed = False
+        now = datetime.now()
+        for addr, device in found_devices.items():
+            self.last_seen[addr] = now
+            known = self.known.get(addr)
+            if known is None:
+                self.known[addr] = device
+                new_devices += 1
+                changed = True
+                logger.info(
+                    "Discovered new device",
+                    alias=device.alias,
+                    model=device.model,
+                    address=addr,
+                )
+            elif known.config.connection_type != device.config.connection_type:
+                # Cached connection parameters went stale (firmware update, new device on the IP),
+                # listeners drop what they kept for the old object
+                self._release(addr)
+                self.known[addr] = device
+                changed = True
+                logger.info(
+                    "Reconciled device connection parameters",
+                    alias=device.alias,
+                    model=device.model,
+                    address=addr,
+                )
+            if self._assign(addr, self.known[addr], now):
+                self.last_checkin[addr] = now
+        self.discovered_devices.inc(new_devices)
         self.total_devices.set(len(self.devices))
-        for addr in self.devices:
-            self.last_checkin[addr] = datetime.now()
+        self.known_devices.set(len(self.known))
+        if changed:
+            self.discovery_cache.save(self.known)
         return self.devices
 
+    def warm_start(self, credentials) -> int:
+        """Register the devices persisted by a previous run, without any network I/O.
+
+        Discovery still runs afterwards and reconciles whatever changed.
+        """
+        cached = self.discovery_cache.load(credentials)
+        now = datetime.now()
+        for addr, device in cached.items():
+            if addr not in self.known:
+                self.known[addr] = device
+                self.last_seen[addr] = now
+                self._assign(addr, device, now)
+        self.total_devices.set(len(self.devices))
+        self.known_devices.set(len(self.known))
+        logger.info(
+            "Loaded devices from discovery cache",
+            devices=len(cached),
+            path=self.discovery_cache.path,
+        )
+        return len(cached)
+
+    async def discover_once(self, credentials, interface=None):
+        self.last_discovery = time.monotonic()
+        try:
+            with self.discovery_duration.time():
+                await self.discover_devices(credentials, interface or {})
+        except Exception as e:
+            logger.error(f"Device discovery failed: {str(e)}")
+
+    def discovery_due(self) -> bool:
+        return (
+            self.last_discovery is None
+            or time.monotonic() - self.last_discovery >= self.discovery_interval
+        )
+
+    async def run_discovery(self, credentials, interface=None):
+        async for _ in ticker(self.discovery_interval):
+            await self.discover_once(credentials, interface)
+
     def get_devices_info(self):
         return [
             {
@@ -58,18 +263,34 @@ class DeviceRegistry:
             for addr, device in self.devices.items()
         ]
 
+    def prune_stale(self) -> list:
+        """Drop devices that missed their check-in for longer than prune_after.
+
+        Devices another shard polls only check in through discovery, they are
+        forgotten once they missed two broadcasts (and prune_after).
+        """
+        now = datetime.now()
+        to_prune = [
+            addr
+            for addr, last_seen in self.last_checkin.items()
+            if now - last_seen > self.prune_after
+        ]
+        unseen_after = max(self.prune_after, timedelta(seconds=2 * self.discovery_interval))
+        to_prune.extend(
+            addr
+            for addr, last_seen in self.last_seen.items()
+            if addr not in self.devices and now - last_seen > unseen_after
+        )
+        for addr in to_prune:
+            logger.info(f"Pruning device {addr} due to missed check-in")
+            self._release(addr, forget=True)
+            self.pruned_devices.inc()  # Increment pruned devices counter
+        if to_prune:
+            self.discovery_cache.save(self.known)
+        self.total_devices.set(len(self.devices))  # Update total devices gauge
+        self.known_devices.set(len(self.known))
+        return to_prune
+
     async def update_registry(self):
-        while True:
-            now = datetime.now()
-            to_prune = [
-                addr
-                for addr, last_seen in self.last_checkin.items()
-                if now - last_seen > timedelta(minutes=1)
-            ]
-            for addr in to_prune:
-                logger.info(f"Pruning device {addr} due to missed check-in")
-                self.devices.pop(addr, None)
-                self.last_checkin.pop(addr, None)
-                self.pruned_devices.inc()  # Increment pruned devices counter
-            self.total_devices.set(len(self.devices))  # Update total devices gauge
-            await asyncio.sleep(10)
+        async for _ in ticker(10, jitter=0.1):
+            self.prune_stale()
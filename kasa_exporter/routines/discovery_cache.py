@@ -0,0 +1,115 @@
+import json
+import os
+import tempfile
+from kasa import Device, DeviceConfig, DeviceConnectionParameters
+from kasa.device_factory import get_device_class_from_family, get_protocol
+from kasa.iot import IotBulb, IotDimmer, IotLightStrip, IotPlug, IotStrip, IotWallSwitch
+from kasa.smart import SmartDevice
+import structlog
+
+logger = structlog.get_logger()
+
+CACHE_VERSION = 1
+
+# Legacy (XOR) devices all share the IOT.SMARTPLUGSWITCH family, the concrete class
+# is normally derived from sysinfo so we persist it to skip that round-trip
+DEVICE_CLASSES = {
+    cls.__name__: cls
+    for cls in (IotBulb, IotDimmer, IotLightStrip, IotPlug, IotStrip, IotWallSwitch, SmartDevice)
+}
+
+
+class DiscoveryCache:
+    """Persists how to reach each known device so a restart skips discovery.
+
+    Only connection parameters are stored (host, device family, encryption
+    type, login version, port), never credentials or session keys.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.getenv(
+                "KASA_DISCOVERY_CACHE",
+                os.path.expanduser("~/.cache/kasa-exporter/devices.json"),
+            )
+        # An empty path disables the cache
+        self.path = path or None
+
+    @staticmethod
+    def serialize_device(device: Device) -> dict:
+        config = device.config
+        entry = {
+            "host": config.host,
+            "device_class": type(device).__name__,
+            "connection_type": config.connection_type.to_dict(),
+            "uses_http": config.uses_http,
+        }
+        if config.port_override:
+            entry["port_override"] = config.port_override
+        if config.timeout:
+            entry["timeout"] = config.timeout
+        return entry
+
+    @staticmethod
+    def build_device(entry: dict, credentials=None) -> Device:
+        """Create a device object from a cache entry without touching the network."""
+        config = DeviceConfig(
+            host=entry["host"],
+            timeout=entry.get("timeout", DeviceConfig.DEFAULT_TIMEOUT),
+            port_override=entry.get("port_override"),
+            credentials=credentials,
+            connection_type=DeviceConnectionParameters.from_dict(entry["connection_type"]),
+            uses_http=entry.get("uses_http", False),
+        )
+        device_class = DEVICE_CLASSES.get(entry.get("device_class"))
+        if device_class is None:
+            device_class = get_device_class_from_family(
+                config.connection_type.device_family.value,
+                https=config.connection_type.https,
+            )
+        protocol = get_protocol(config)
+        if device_class is None or protocol is None:
+            raise ValueError(f"Unsupported cached device {entry}")
+        return device_class(config.host, protocol=protocol)
+
+    def load(self, credentials=None) -> dict:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable discovery cache {self.path}: {str(e)}")
+            return {}
+        if data.get("version") != CACHE_VERSION:
+            logger.warning(f"Ignoring discovery cache {self.path} with unknown version")
+            return {}
+
+        devices = {}
+        for addr, entry in data.get("devices", {}).items():
+            try:
+                devices[addr] = self.build_device(entry, credentials)
+            except Exception as e:
+                logger.warning(f"Skipping cached device {addr}: {str(e)}")
+        return devices
+
+    def save(self, devices: dict) -> None:
+        if not self.path:
+            return
+        data = {
+            "version": CACHE_VERSION,
+            "devices": {
+                addr: self.serialize_device(device) for addr, device in devices.items()
+            },
+        }
+        directory = os.path.dirname(self.path) or "."
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Write then rename so a crash never leaves a truncated cache behind
+            with tempfile.NamedTemporaryFile(
+                "w", dir=directory, delete=False, suffix=".tmp"
+            ) as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(f.name, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write discovery cache {self.path}: {str(e)}")
@@ -1,53 +1,453 @@
 from datetime import datetime
-import logging
 import asyncio
+import math
 import os
+import time
+import weakref
 from kasa import Credentials
-from prometheus_client import CollectorRegistry
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
 import structlog
-from ..devices.KP125M import Extractor as KP125MDeviceExtractor
-
-# Configure structured logging with timestamp
-structlog.configure(
-    wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
-    processors=[
-        structlog.processors.TimeStamper(fmt="iso", utc=True),
-        structlog.processors.JSONRenderer(),
-    ],
-)
+from ..devices.extractor_registry import default_registry
+from ..devices.prom_device_extractor import release_unused_metrics
+from ..devices.refresh_tiers import tune_queries
+from ..devices.replay import TrafficRecorder
+from ..utils.sample_ring import SampleRing
+from ..utils.singleflight import SingleFlight
+from .connection_pool import ConnectionPool
+from .health import DeviceHealth, failure_reason
+from .instrumentation import LATENCY_BUCKETS, PollInstrumentation
+from .scheduler import PollScheduler
+from .snapshot import SnapshotCollector
+
 logger = structlog.get_logger()
 
 class DeviceExporter:
     def __init__(self, device_registry, collector_registry: CollectorRegistry):
         self.device_registry = device_registry
         self.collector_registry = collector_registry
-        self.credentials = Credentials(
-            os.getenv("KASA_USERNAME"),
-            os.getenv("KASA_PASSWORD"),
+        self.started_at = time.monotonic()
+        self.first_sample_at = None
+        self.credentials = Credentials()
+        self.configure()
+        self.scheduler = PollScheduler(base_interval=self.poll_interval)
+        # lazy: no background polling, a /metrics request refreshes the devices whose
+        # last sample is older than KASA_STALENESS_TTL (and nothing when idle)
+        self.lazy = os.getenv("KASA_POLL_MODE", "background").lower() == "lazy"
+        self.refreshed_at = {}  # addr -> monotonic time of the last successful poll
+        self.refreshes = SingleFlight()
+        self.discovery_task = None
+        # What the batches of the running cycle did, see complete_cycle()
+        self.cycle_results = []
+        self.cycle_busy = 0.0
+        # Label names -> label values of the series the running cycle polled
+        self.cycle_series = {}
+        # Sessions stay open between cycles instead of re-handshaking every poll
+        self.connection_pool = ConnectionPool(collector_registry)
+        self.health = DeviceHealth(collector_registry)
+        # What /metrics serves, refreshed once at the end of every cycle
+        self.snapshot = SnapshotCollector(collector_registry)
+        # Device samples of every cycle, kept on disk to backfill downstream outages
+        self.sample_ring = SampleRing()
+        # Raw device traffic for deterministic replays, only when KASA_CAPTURE_DIR is set
+        self.recorder = TrafficRecorder()
+        self.instrumentation = PollInstrumentation(collector_registry)
+        # Extractor per model or device family, see extractor_registry
+        self.extractor_registry = default_registry()
+        self.extractors = self.extractor_registry.extractors
+        # Device -> name of its extractor, chosen on the first successful poll
+        self.assigned = weakref.WeakKeyDictionary()
+
+        self.cycle_duration = Histogram(
+            "device_exporter_cycle_duration_seconds",
+            "Wall time of a full device polling cycle",
+            buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+            registry=collector_registry,
+        )
+        self.last_cycle_duration = Gauge(
+            "device_exporter_last_cycle_duration_seconds",
+            "Wall time of the most recent device polling cycle",
+            registry=collector_registry,
+        )
+        self.polled_devices = Gauge(
+            "device_exporter_last_cycle_polled_devices",
+            "Devices refreshed successfully in the most recent polling cycle",
+            registry=collector_registry,
+        )
+        self.first_sample_latency = Gauge(
+            "device_exporter_startup_first_sample_seconds",
+            "Seconds from exporter start until the first device sample was exported",
+            registry=collector_registry,
+        )
+        self.scheduler_lag = Histogram(
+            "device_exporter_scheduler_lag_seconds",
+            "How late device polls start relative to their scheduled deadline",
+            buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+            registry=collector_registry,
+        )
+        self.poll_interval_seconds = Histogram(
+            "device_exporter_poll_interval_seconds",
+            "Adaptive poll interval chosen for a device after each poll",
+            buckets=(1, 2, 5, 10, 15, 30, 60, 120),
+            registry=collector_registry,
+        )
+        self.failed_devices = Gauge(
+            "device_exporter_last_cycle_failed_devices",
+            "Devices that failed or timed out in the most recent polling cycle",
+            registry=collector_registry,
+        )
+
+        self.extractor_update = Histogram(
+            "device_exporter_extractor_update_seconds",
+            "Time an extractor takes to turn a refreshed device into samples",
+            ["extractor"],
+            buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+            registry=collector_registry,
+        )
+        self.cycle_overruns = Counter(
+            "device_exporter_cycle_overruns_total",
+            "Polling cycles that took longer than the poll interval",
+            registry=collector_registry,
+        )
+        self.render_duration = Histogram(
+            "device_exporter_render_duration_seconds",
+            "Time to collect and render the /metrics snapshot",
+            buckets=LATENCY_BUCKETS,
+            registry=collector_registry,
         )
+        self.render_bytes = Gauge(
+            "device_exporter_render_bytes",
+            "Size of the last rendered /metrics snapshot",
+            ["encoding"],
+            registry=collector_registry,
+        )
+        self.snapshot.publish_listeners.append(self.observe_render)
+
         # Initialize metrics for device extractors
-        for extractor in [KP125MDeviceExtractor]:
+        for extractor in self.extractors.values():
             extractor.initialize_metrics(registry=self.collector_registry)
+        self.device_registry.prune_listeners.append(self.forget_device)
+        self.device_registry.prune_listeners.append(self.connection_pool.forget_device)
+        # Called with (addr, device) after every successful poll (e.g. live streams)
+        self.poll_listeners = []
 
-    async def scrape_devices(self):
-        interface = {}
+    @staticmethod
+    def read_settings() -> dict:
+        """The settings a configuration reload may change, from the environment."""
+        return {
+            "username": os.getenv("KASA_USERNAME"),
+            "password": os.getenv("KASA_PASSWORD"),
+            "poll_interval": float(os.getenv("KASA_POLL_INTERVAL", 10)),
+            # Devices coming due within this window are polled together as one cycle
+            "batch_window": float(os.getenv("KASA_POLL_BATCH_WINDOW", 0.5)),
+            # Maximum number of devices being refreshed at the same time
+            "poll_concurrency": int(os.getenv("KASA_POLL_CONCURRENCY", 16)),
+            # Upper bound on a single device.update(), a dead plug gives up after this
+            "poll_timeout": float(os.getenv("KASA_POLL_TIMEOUT", 5)),
+            "staleness_ttl": float(os.getenv("KASA_STALENESS_TTL", 15)),
+        }
+
+    def configure(self, settings: dict = None):
+        """Switch to new settings, read_settings() when none are given."""
+        settings = dict(settings or self.read_settings())
+        # Updated in place, discovery and the prober hold the same object
+        self.credentials.username = settings.pop("username")
+        self.credentials.password = settings.pop("password")
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    def swap_extractors(self, extractor_registry):
+        """Switch to the extractors of a rebuilt registry (e.g. after reloading specs).
+
+        Nothing changes when registering the new extractors' metrics fails
+        (a metric re-declared with another type or labels). Otherwise a new
+        extractor takes over the series of the one it replaces, devices are
+        re-assigned by model and family and the series of metrics no longer
+        exported are removed.
+        """
+        previous = self.extractors
+        fresh = [
+            extractor
+            for extractor in extractor_registry.extractors.values()
+            if all(extractor is not old for old in previous.values())
+        ]
+        try:
+            for extractor in fresh:
+                extractor.initialize_metrics(registry=self.collector_registry)
+        except Exception:
+            release_unused_metrics(self.collector_registry, previous.values())
+            raise
+        extractors = extractor_registry.extractors
+        for name, old in previous.items():
+            extractor = extractors.get(name)
+            if extractor is None:
+                old.clear_series("reloaded")
+            elif extractor is not old:
+                extractor.adopt_series(old)
+        for device, name in list(self.assigned.items()):
+            selected = extractor_registry.select(device)
+            if selected != name and name in extractors:
+                extractors[name].forget_device(device)
+            self.assigned[device] = selected
+            # Refresh tiers may have changed
+            tune_queries(device, extractors[selected])
+        for extractor in extractors.values():
+            for part in extractor.tree():
+                part.compile()
+        self.extractor_registry = extractor_registry
+        self.extractors = extractors
+        release_unused_metrics(self.collector_registry, extractors.values())
+
+    def forget_device(self, addr, device):
+        """Drop the series of a pruned device instead of exporting them forever."""
+        name = self.assigned.pop(device, None)
+        removed = self.extractors[name].forget_device(device) if name is not None else 0
+        self.health.forget(addr)
+        self.refreshed_at.pop(addr, None)
+        self.instrumentation.forget(addr)
+        logger.info(f"Removed {removed} series of pruned device {addr}")
+
+    def observe_render(self):
+        self.render_duration.observe(self.snapshot.render_duration)
+        plain, gzipped = self.snapshot.render_size
+        self.render_bytes.labels(encoding="identity").set(plain)
+        if gzipped is not None:
+            self.render_bytes.labels(encoding="gzip").set(gzipped)
+
+    async def poll_device(self, addr, device, semaphore: asyncio.Semaphore):
+        """Refresh a single device and publish its metrics.
+
+        Returns True on success, False on failure and None when the device was
+        skipped because its circuit breaker is open.
+        """
+        if not self.health.allow(addr):
+            self.scheduler.defer(addr, self.health.retry_in(addr))
+            return None
+        # Polled, whatever the outcome: device_up changes either way
+        self.cycle_series.setdefault(("address",), set()).add((addr,))
+        async with semaphore:
+            self.recorder.attach(addr, device)
+            self.instrumentation.attach(addr, device)
+            try:
+                start = time.perf_counter()
+                await asyncio.wait_for(
+                    self.connection_pool.update(addr, device), timeout=self.poll_timeout
+                )
+                self.instrumentation.observe(addr, time.perf_counter() - start)
+                self.device_registry.last_checkin[addr] = datetime.now()
+                self.refreshed_at[addr] = time.monotonic()
+                logger.info(
+                    "Discovered and scraping device",
+                    alias=device.alias,
+                    model=device.model,
+                    address=addr,
+                )
+                name = self.assigned.get(device)
+                if name is None:
+                    # Features are known after the first update, the model and
+                    # device family pick the extractor
+                    name = self.extractor_registry.select(device)
+                extractor = self.extractors[name]
+                start = time.perf_counter()
+                extractor.update_metrics(device)
+                self.extractor_update.labels(extractor=name).observe(
+                    time.perf_counter() - start
+                )
+                if device not in self.assigned:
+                    self.assigned[device] = name
+                    # Later updates skip the queries of modules whose tier is not due
+                    tune_queries(device, extractor)
+                polled_series(extractor, device, self.cycle_series)
+                for listener in self.poll_listeners:
+                    try:
+                        listener(addr, device)
+                    except Exception as e:
+                        logger.error(f"Poll listener failed for {addr}: {str(e)}")
+                self.health.record_success(addr)
+                if self.first_sample_at is None:
+                    self.first_sample_at = time.monotonic()
+                    self.first_sample_latency.set(self.first_sample_at - self.started_at)
+                if addr in self.scheduler:
+                    interval = self.scheduler.adapt(addr, current_consumption(device))
+                    self.poll_interval_seconds.observe(interval)
+                self.scheduler.reschedule(addr)
+                return True
+            except asyncio.TimeoutError as e:
+                logger.error(
+                    f"Timed out updating device {addr} after {self.poll_timeout}s"
+                )
+                error = e
+            except Exception as e:
+                logger.error(f"Error updating device {addr}: {str(e)}")
+                error = e
+            await self.device_failed(addr, error)
+            return False
+
+    async def device_failed(self, addr, error: BaseException):
+        """Count the failure, back the device off when its circuit opens."""
+        if not self.health.record_failure(addr, error):
+            self.scheduler.reschedule(addr)
+            return
+        backoff = self.health.retry_in(addr)
+        logger.warning(
+            "Circuit opened, backing off device",
+            address=addr,
+            reason=failure_reason(error),
+            backoff=round(backoff, 1),
+        )
+        self.scheduler.defer(addr, backoff)
+        # Do not keep a session to a device that is not going to be polled for a while
+        await self.connection_pool.release(addr, reason="circuit_open")
+
+    async def poll_devices(self, devices=None) -> float:
+        """Refresh devices (default all known) as one cycle, returns its wall time."""
+        await self.poll_batch(devices)
+        return self.complete_cycle()
+
+    async def poll_batch(self, devices=None):
+        """Refresh devices concurrently (default all known) within the running cycle."""
+        semaphore = asyncio.Semaphore(self.poll_concurrency)
+        if devices is None:
+            devices = list(self.device_registry.devices.items())
+
+        start = time.monotonic()
+        results = await asyncio.gather(
+            *(self.poll_device(addr, device, semaphore) for addr, device in devices)
+        )
+        self.cycle_busy += time.monotonic() - start
+        self.cycle_results.extend(results)
+
+    def complete_cycle(self) -> float:
+        """Publish what the batches since the last call polled, returns their wall time.
+
+        Runs once per cycle however many batches the deadline scheduler made
+        of it: one render (and push) of the snapshot, one record in the sample
+        ring holding only the series of the devices polled during the cycle.
+        """
+        results, duration, series = self.cycle_results, self.cycle_busy, self.cycle_series
+        self.cycle_results, self.cycle_busy, self.cycle_series = [], 0.0, {}
+
+        succeeded = results.count(True)
+        failed = results.count(False)
+        self.cycle_duration.observe(duration)
+        self.last_cycle_duration.set(duration)
+        self.polled_devices.set(succeeded)
+        self.failed_devices.set(failed)
+        if duration > self.poll_interval:
+            self.cycle_overruns.inc()
+        for extractor in self.extractors.values():
+            extractor.expire_series()
+        logger.info(
+            "Completed polling cycle",
+            devices=len(results),
+            failed=failed,
+            skipped=len(results) - succeeded - failed,
+            duration=round(duration, 3),
+        )
+        self.snapshot.publish()
+        self.record_samples(series)
+        self.recorder.flush()
+        return duration
+
+    def stale_devices(self) -> list:
+        cutoff = time.monotonic() - self.staleness_ttl
+        return [
+            (addr, device)
+            for addr, device in self.device_registry.devices.items()
+            if self.refreshed_at.get(addr, float("-inf")) <= cutoff
+        ]
+
+    async def refresh_stale(self):
+        """Lazy mode: bring the snapshot up to date before it is served.
+
+        Concurrent scrapes share one refresh. Discovery is started in the
+        background when due, so an exporter nobody scrapes sends no traffic.
+        """
+        running = self.discovery_task is not None and not self.discovery_task.done()
+        if not running and self.device_registry.discovery_due():
+            self.discovery_task = asyncio.create_task(
+                self.device_registry.discover_once(self.credentials)
+            )
+        await self.refreshes.do("devices", self._refresh_stale)
 
+    async def _refresh_stale(self):
+        stale = self.stale_devices()
+        if stale:
+            await self.poll_devices(stale)
+            # No background prune loop in lazy mode, devices are only judged when polled
+            self.device_registry.prune_stale()
+
+    def recorded_families(self) -> set:
+        """Names of the device metric families kept in the sample ring."""
+        names = {"device_up"}
+        for extractor in self.extractors.values():
+            for part in extractor.tree():
+                for metric_object in part.metric_objects.values():
+                    names.update(family.name for family in metric_object["metric"].describe())
+        return names
+
+    def record_samples(self, series: dict):
+        """Record the samples of the given series (see polled_series) in the sample ring."""
+        if not series:
+            return
+
+        def polled(sample):
+            labels = sample.labels
+            return any(
+                tuple(labels.get(name) for name in names) in values
+                for names, values in series.items()
+            )
+
+        try:
+            self.sample_ring.record(
+                self.snapshot.families, include=self.recorded_families(), keep=polled
+            )
+        except Exception as e:
+            logger.error(f"Failed to record samples: {str(e)}")
+
+    async def scrape_devices(self):
+        # Discovery runs separately (DeviceRegistry.run_discovery), polling only
+        # talks to the hosts already known to the registry. Devices are polled in
+        # batches as they come due, the cycle completes on a fixed grid of the
+        # poll interval (the first one right after the first batch).
+        cycle_end = time.monotonic()
         while True:
-            await self.device_registry.discover_devices(self.credentials, interface)
-            for addr, device in self.device_registry.devices.items():
-                try:
-                    await device.update()
-                    self.device_registry.last_checkin[addr] = datetime.now()
-                    logger.info(
-                        "Discovered and scraping device",
-                        alias=device.alias,
-                        model=device.model,
-                        address=addr,
-                    )
-                    KP125MDeviceExtractor.update_metrics(device)
-                except Exception as e:
-                    logger.error(f"Error updating device {addr}: {str(e)}")
-                finally:
-                    await device.disconnect()
-
-            await asyncio.sleep(10)
+            devices = self.device_registry.devices
+            self.scheduler.sync(devices)
+            now = time.monotonic()
+            due = self.scheduler.pop_due(now, window=self.batch_window)
+            if due:
+                for _addr, deadline in due:
+                    self.scheduler_lag.observe(max(0.0, now - deadline))
+                await self.poll_batch([(addr, devices[addr]) for addr, _ in due if addr in devices])
+                now = time.monotonic()
+            if now >= cycle_end:
+                self.complete_cycle()
+                # Ticks missed entirely (a long batch) are skipped, the grid stays
+                cycle_end += self.poll_interval * max(1, math.ceil((now - cycle_end) / self.poll_interval))
+            if due:
+                continue
+            deadline = self.scheduler.next_deadline()
+            # Wake up at least every second to pick up newly discovered devices
+            wake = min(1.0, cycle_end - now, deadline - now if deadline else 1.0)
+            await asyncio.sleep(max(0.0, wake))
+
+
+def current_consumption(device):
+    """Current power draw in watts, None when the device does not report it."""
+    features = getattr(device, "features", None) or {}
+    feature = features.get("current_consumption")
+    value = getattr(feature, "value", None)
+    return value if isinstance(value, (int, float)) else None
+
+
+def polled_series(extractor, device, series: dict):
+    """Add the dimension labels of a device (and its outlets) to series.
+
+    series maps label names to the set of label value tuples polled.
+    """
+    labels = extractor.get_device_labels(device)
+    # Sample labels hold the values as exported, i.e. as strings
+    series.setdefault(tuple(labels), set()).add(tuple(str(value) for value in labels.values()))
+    if extractor.children is not None:
+        for child in getattr(device, "children", None) or ():
+            polled_series(extractor.children, child, series)
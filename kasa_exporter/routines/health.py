@@ -0,0 +1,182 @@
+import asyncio
+import os
+import random
+import time
+from kasa.exceptions import AuthenticationError, UnsupportedDeviceError
+from kasa.exceptions import TimeoutError as KasaTimeoutError
+from prometheus_client import Gauge, Counter, CollectorRegistry
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def failure_reason(error: BaseException) -> str:
+    """Coarse failure class used as the device_up reason label."""
+    if isinstance(error, (asyncio.TimeoutError, KasaTimeoutError)):
+        return "timeout"
+    if isinstance(error, AuthenticationError):
+        return "auth"
+    if isinstance(error, UnsupportedDeviceError):
+        return "unsupported"
+    if isinstance(error, OSError):
+        return "unreachable"
+    return "error"
+
+
+class CircuitBreaker:
+    """Health of a single device.
+
+    closed: the device is polled on its normal schedule. After
+    failure_threshold consecutive failures the circuit opens and the device
+    is left alone for a backoff period that doubles (up to max_backoff) every
+    time it opens again. Once the backoff expires the circuit is half-open:
+    exactly one trial poll is let through, success closes the circuit and
+    resets the backoff, failure opens it again. A trial that never reports
+    back (e.g. cancelled) gives way to a new one after another backoff.
+    """
+
+    def __init__(self, failure_threshold=3, base_backoff=10.0, max_backoff=600.0, jitter=0.1):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.state = CLOSED
+        self.failures = 0
+        self.backoff = 0.0
+        self.retry_at = 0.0
+        self.trial_until = None  # set while the half-open trial poll is in flight
+        self.reason = None
+
+    def allow(self, now=None) -> bool:
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic() if now is None else now
+        if self.state == OPEN:
+            if now < self.retry_at:
+                return False
+            self.state = HALF_OPEN
+        elif self.trial_until is not None and now < self.trial_until:
+            return False
+        self.trial_until = now + max(self.backoff, self.base_backoff)
+        return True
+
+    def retry_in(self, now=None) -> float:
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.retry_at - now) if self.state == OPEN else 0.0
+
+    def record_success(self):
+        self.state = CLOSED
+        self.trial_until = None
+        self.failures = 0
+        self.backoff = 0.0
+        self.reason = None
+
+    def record_failure(self, reason: str, now=None) -> bool:
+        """Count a failed poll, returns True when this failure opened the circuit."""
+        now = time.monotonic() if now is None else now
+        self.failures += 1
+        self.reason = reason
+        self.trial_until = None
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.backoff = min(self.max_backoff, self.backoff * 2 or self.base_backoff)
+            self.retry_at = now + self.backoff * (1 + random.uniform(0, self.jitter))
+            self.state = OPEN
+            return True
+        return False
+
+
+class DeviceHealth:
+    """Circuit breakers of every polled device plus the device_up series.
+
+    Breaker state is keyed by address and survives the registry pruning the
+    device, so a plug that disappears and is rediscovered keeps its backoff
+    instead of starting over with a full connect timeout every cycle.
+    """
+
+    def __init__(self, collector_registry: CollectorRegistry):
+        self.breakers = {}
+        self.failure_threshold = int(os.getenv("KASA_BREAKER_FAILURES", 3))
+        self.base_backoff = float(os.getenv("KASA_BREAKER_BACKOFF", 10))
+        self.max_backoff = float(os.getenv("KASA_BREAKER_MAX_BACKOFF", 600))
+        self._up_reason = {}
+        self._open = set()
+
+        self.device_up = Gauge(
+            "device_up",
+            "Whether the last poll of the device succeeded, reason says why it did not",
+            ["address", "reason"],
+            registry=collector_registry,
+        )
+        self.open_circuits = Gauge(
+            "device_health_open_circuits",
+            "Devices whose circuit breaker is currently open",
+            registry=collector_registry,
+        )
+        self.transitions = Counter(
+            "device_health_circuit_transitions_total",
+            "Circuit breaker state changes",
+            ["state"],
+            registry=collector_registry,
+        )
+
+    def breaker(self, addr) -> CircuitBreaker:
+        breaker = self.breakers.get(addr)
+        if breaker is None:
+            breaker = self.breakers[addr] = CircuitBreaker(
+                self.failure_threshold, self.base_backoff, self.max_backoff
+            )
+        return breaker
+
+    def allow(self, addr, now=None) -> bool:
+        breaker = self.breaker(addr)
+        was_open = breaker.state == OPEN
+        allowed = breaker.allow(now)
+        if was_open and allowed:
+            self.transitions.labels(state=HALF_OPEN).inc()
+            self._set_open(addr, False)
+        return allowed
+
+    def retry_in(self, addr, now=None) -> float:
+        return self.breaker(addr).retry_in(now)
+
+    def record_success(self, addr):
+        breaker = self.breaker(addr)
+        if breaker.state != CLOSED:
+            self.transitions.labels(state=CLOSED).inc()
+        breaker.record_success()
+        self._set_up(addr, 1, "")
+        self._set_open(addr, False)
+
+    def record_failure(self, addr, error: BaseException, now=None) -> bool:
+        """Returns True when the circuit (re-)opened and the device should back off."""
+        reason = failure_reason(error)
+        opened = self.breaker(addr).record_failure(reason, now)
+        if opened:
+            self.transitions.labels(state=OPEN).inc()
+            self._set_open(addr, True)
+        self._set_up(addr, 0, reason)
+        return opened
+
+    def forget(self, addr):
+        """Drop the device_up series, open breakers are kept for rediscovery."""
+        reason = self._up_reason.pop(addr, None)
+        if reason is not None:
+            self.device_up.remove(addr, reason)
+        breaker = self.breakers.get(addr)
+        if breaker is not None and breaker.state == CLOSED:
+            del self.breakers[addr]
+
+    def _set_up(self, addr, value, reason):
+        previous = self._up_reason.get(addr)
+        if previous is not None and previous != reason:
+            self.device_up.remove(addr, previous)
+        self._up_reason[addr] = reason
+        self.device_up.labels(address=addr, reason=reason).set(value)
+
+    def _set_open(self, addr, is_open):
+        if is_open:
+            self._open.add(addr)
+        else:
+            self._open.discard(addr)
+        self.open_circuits.set(len(self._open))
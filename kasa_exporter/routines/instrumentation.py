@@ -0,0 +1,180 @@
+import asyncio
+import os
+import time
+import aiohttp
+from kasa.httpclient import HttpClient, get_cookie_jar
+from kasa.protocol import BaseTransport
+from prometheus_client import CollectorRegistry, Histogram
+from ..devices.replay import RecordingTransport
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Transport methods that (re-)establish a session, per python-kasa transport
+HANDSHAKE_METHODS = ("perform_handshake", "perform_login")
+# Legacy XOR devices speak raw TCP, opening the socket is their connect phase
+CONNECT_METHODS = ("_connect",)
+
+
+class PollPhases:
+    """Time spent connecting and handshaking during the current poll of one device."""
+
+    def __init__(self):
+        self.connect = 0.0
+        self.handshake = 0.0
+        # Connects done while handshaking, counted as connect only
+        self.connect_in_handshake = 0.0
+        self.handshaking = False
+
+    def reset(self):
+        self.connect = self.handshake = self.connect_in_handshake = 0.0
+
+    def add_connect(self, duration):
+        self.connect += duration
+        if self.handshaking:
+            self.connect_in_handshake += duration
+
+
+class TracedHttpClient(HttpClient):
+    """python-kasa's HTTP client with aiohttp trace hooks on the sessions it opens."""
+
+    trace_config = None
+
+    @property
+    def client(self) -> aiohttp.ClientSession:
+        if self._client_session is None and self._config.http_client is None:
+            self._client_session = aiohttp.ClientSession(
+                cookie_jar=get_cookie_jar(), trace_configs=[self.trace_config]
+            )
+        return super().client
+
+
+def innermost_transport(device):
+    transport = getattr(getattr(device, "protocol", None), "_transport", None)
+    # The traffic capture wraps the transport that does the actual work
+    while isinstance(transport, RecordingTransport):
+        transport = transport._transport
+    return transport if isinstance(transport, BaseTransport) else None
+
+
+class PollInstrumentation:
+    """Splits device poll latency into connect, handshake and query phases.
+
+    The transport of every polled device gets its session methods wrapped
+    (perform_handshake/perform_login for KLAP and AES, _connect for XOR) and
+    HTTP transports open their aiohttp sessions with trace hooks that time
+    the TCP connects. Whatever remains of the update is the query phase.
+    """
+
+    def __init__(self, collector_registry: CollectorRegistry):
+        self.phases = {}
+        self.poll_phase = Histogram(
+            "device_exporter_poll_phase_seconds",
+            "Device poll latency by phase (connect, handshake, query)",
+            ["phase"],
+            buckets=LATENCY_BUCKETS,
+            registry=collector_registry,
+        )
+
+    def attach(self, addr, device) -> PollPhases:
+        """Prepare timing of the poll about to start."""
+        phases = self.phases.get(addr)
+        if phases is None:
+            phases = self.phases[addr] = PollPhases()
+        phases.reset()
+        transport = innermost_transport(device)
+        if transport is None:
+            return phases
+        instrumented = hasattr(transport, "_kasa_exporter_phases")
+        # The wrappers look the phases up on every call, the device may be forgotten and re-added
+        transport._kasa_exporter_phases = phases
+        if not instrumented:
+            for name in HANDSHAKE_METHODS:
+                if hasattr(transport, name):
+                    setattr(transport, name, self._timed(transport, name, True))
+            for name in CONNECT_METHODS:
+                if hasattr(transport, name):
+                    setattr(transport, name, self._timed(transport, name, False))
+            self._trace_http(transport)
+        return phases
+
+    @staticmethod
+    def _timed(transport, name, handshake: bool):
+        method = getattr(transport, name)
+
+        async def timed(*args, **kwargs):
+            phases = transport._kasa_exporter_phases
+            start = time.perf_counter()
+            if handshake:
+                phases.handshaking = True
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                if handshake:
+                    phases.handshaking = False
+                    phases.handshake += duration
+                else:
+                    phases.add_connect(duration)
+
+        return timed
+
+    @staticmethod
+    def _trace_http(transport):
+        http_client = getattr(transport, "_http_client", None)
+        if type(http_client) is not HttpClient:
+            return
+        started = {}
+
+        async def on_start(_session, context, _params):
+            started[id(context)] = time.perf_counter()
+
+        async def on_end(_session, context, _params):
+            start = started.pop(id(context), None)
+            if start is not None:
+                transport._kasa_exporter_phases.add_connect(time.perf_counter() - start)
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_start.append(on_start)
+        trace.on_connection_create_end.append(on_end)
+        http_client.trace_config = trace
+        http_client.__class__ = TracedHttpClient
+
+    def observe(self, addr, total: float):
+        """Record the phases of a finished poll that took `total` seconds."""
+        phases = self.phases.get(addr)
+        if phases is None:
+            return
+        connect = phases.connect
+        handshake = max(0.0, phases.handshake - phases.connect_in_handshake)
+        if connect:
+            self.poll_phase.labels(phase="connect").observe(connect)
+        if handshake:
+            self.poll_phase.labels(phase="handshake").observe(handshake)
+        self.poll_phase.labels(phase="query").observe(max(0.0, total - connect - handshake))
+
+    def forget(self, addr):
+        self.phases.pop(addr, None)
+
+
+class EventLoopMonitor:
+    """Measures how late the event loop wakes up a sleeping task.
+
+    Every KASA_LOOP_LAG_INTERVAL seconds the monitor sleeps and records by how
+    much the wake-up overshot; blocking code on the loop (a slow render, a
+    synchronous disk write) shows up as lag.
+    """
+
+    def __init__(self, collector_registry: CollectorRegistry, interval=None):
+        self.interval = interval or float(os.getenv("KASA_LOOP_LAG_INTERVAL", 0.5))
+        self.lag = Histogram(
+            "device_exporter_event_loop_lag_seconds",
+            "Delay of event loop wake-ups beyond their scheduled time",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+            registry=collector_registry,
+        )
+
+    async def run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lag.observe(max(0.0, time.perf_counter() - start - self.interval))
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import time
+from typing import Iterable, Optional
+from prometheus_client import CollectorRegistry, Counter, Gauge
+import structlog
+
+from .scheduler import PollScheduler
+
+logger = structlog.get_logger()
+
+# Device features a subscriber can ask for
+LIVE_FIELDS = ("current_consumption", "voltage", "current", "state", "consumption_today")
+
+
+def read_fields(device) -> dict:
+    features = getattr(device, "features", None) or {}
+    values = {}
+    for field in LIVE_FIELDS:
+        feature = features.get(field)
+        if feature is None:
+            continue
+        try:
+            values[field] = feature.value
+        except Exception:
+            continue
+    return values
+
+
+class Frame:
+    """One device reading, encoded once per field selection however many subscribers get it."""
+
+    __slots__ = ("addr", "header", "values", "outlets", "_encoded")
+
+    def __init__(self, addr, device):
+        self.addr = addr
+        self.header = {
+            "address": addr,
+            "alias": getattr(device, "alias", None),
+            "device_id": getattr(device, "device_id", None),
+            "model": getattr(device, "model", None),
+            "time": time.time(),
+        }
+        self.values = read_fields(device)
+        self.outlets = [
+            (getattr(child, "alias", None), read_fields(child))
+            for child in getattr(device, "children", None) or ()
+        ]
+        self._encoded = {}
+
+    def encode(self, fields: tuple) -> str:
+        """The frame as a server-sent event carrying only the given fields."""
+        encoded = self._encoded.get(fields)
+        if encoded is None:
+            payload = dict(self.header)
+            payload.update((field, self.values[field]) for field in fields if field in self.values)
+            if self.outlets:
+                payload["outlets"] = [
+                    {"outlet": index, "alias": alias,
+                     **{field: values[field] for field in fields if field in values}}
+                    for index, (alias, values) in enumerate(self.outlets)
+                ]
+            encoded = self._encoded[fields] = (
+                f"event: power\ndata: {json.dumps(payload, default=str)}\n\n"
+            )
+        return encoded
+
+
+class Subscription:
+    """What one client asked for and the frames it has not received yet.
+
+    Only the newest frame per device is kept: a reading that arrives before
+    the previous one was sent replaces it, so a slow client skips readings
+    instead of growing a queue.
+    """
+
+    def __init__(self, devices: Optional[Iterable[str]], fields: Iterable[str]):
+        self.devices = frozenset(devices) if devices else None  # None: every device
+        self.fields = tuple(fields)
+        self.pending = {}  # addr -> newest unsent Frame
+        self.ready = asyncio.Event()
+        self.watched = set()
+        self.dropped = 0
+
+    def matches(self, addr, device) -> bool:
+        if self.devices is None:
+            return True
+        return (
+            addr in self.devices
+            or getattr(device, "alias", None) in self.devices
+            or getattr(device, "device_id", None) in self.devices
+        )
+
+    def offer(self, frame: Frame) -> bool:
+        """Queue a frame, returns False when it replaced one that was never sent."""
+        replaced = self.pending.pop(frame.addr, None) is not None
+        self.pending[frame.addr] = frame
+        self.ready.set()
+        if replaced:
+            self.dropped += 1
+        return not replaced
+
+    async def next_frames(self, timeout: Optional[float] = None) -> list:
+        """Wait for frames, an empty list when nothing arrived within timeout."""
+        if not self.ready.is_set():
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self.ready.clear()
+        frames = list(self.pending.values())
+        self.pending.clear()
+        return frames
+
+
+class LiveStream:
+    """Pushes device readings to subscribers as the poll loop takes them.
+
+    publish() is a poll listener of the DeviceExporter: every subscriber is
+    fed from the same poll, a viewer never causes device traffic of its own.
+    Subscribing to named devices asks the scheduler to poll them at least
+    every KASA_LIVE_INTERVAL seconds while anyone watches them (once per
+    device, however many viewers), a device that only matches later (newly
+    discovered, renamed) from its first poll on. Subscribing to everything
+    leaves the poll pace alone.
+    """
+
+    def __init__(
+        self,
+        collector_registry: CollectorRegistry,
+        scheduler: PollScheduler,
+        device_registry=None,
+    ):
+        self.scheduler = scheduler
+        self.device_registry = device_registry
+        self.interval = float(os.getenv("KASA_LIVE_INTERVAL", 1))
+        self.keepalive = float(os.getenv("KASA_LIVE_KEEPALIVE", 15))
+        self.max_subscribers = int(os.getenv("KASA_LIVE_MAX_SUBSCRIBERS", 64))
+        self.subscriptions = []
+        self.watchers = {}  # addr -> number of subscriptions watching it
+
+        self.subscribers = Gauge(
+            "device_live_subscribers",
+            "Clients connected to the live power stream",
+            registry=collector_registry,
+        )
+        self.frames = Counter(
+            "device_live_frames_total",
+            "Device readings queued for live stream subscribers",
+            registry=collector_registry,
+        )
+        self.frames_dropped = Counter(
+            "device_live_frames_dropped_total",
+            "Live stream readings replaced by a newer one before a slow client received them",
+            registry=collector_registry,
+        )
+
+    def publish(self, addr, device):
+        if not self.subscriptions:
+            return
+        frame = None
+        for subscription in self.subscriptions:
+            if not subscription.matches(addr, device):
+                continue
+            if subscription.devices is not None and addr not in subscription.watched:
+                self.watch(subscription, addr)
+            if frame is None:
+                frame = Frame(addr, device)
+            self.frames.inc()
+            if not subscription.offer(frame):
+                self.frames_dropped.inc()
+
+    def subscribe(self, devices=None, fields=None) -> Subscription:
+        fields = list(fields) if fields else list(LIVE_FIELDS)
+        unknown = [field for field in fields if field not in LIVE_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields {unknown}, expected some of {list(LIVE_FIELDS)}")
+        if len(self.subscriptions) >= self.max_subscribers:
+            raise OverflowError(f"Already {len(self.subscriptions)} live subscribers")
+        subscription = Subscription(devices, fields)
+        if subscription.devices is not None and self.device_registry is not None:
+            for addr, device in list(self.device_registry.devices.items()):
+                if subscription.matches(addr, device):
+                    self.watch(subscription, addr)
+        self.subscriptions.append(subscription)
+        self.subscribers.set(len(self.subscriptions))
+        logger.info("Live subscriber joined", devices=len(subscription.watched), fields=fields)
+        return subscription
+
+    def watch(self, subscription: Subscription, addr):
+        subscription.watched.add(addr)
+        self.watchers[addr] = self.watchers.get(addr, 0) + 1
+        self.scheduler.watch(addr, self.interval)
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription not in self.subscriptions:
+            return
+        self.subscriptions.remove(subscription)
+        self.subscribers.set(len(self.subscriptions))
+        for addr in subscription.watched:
+            self.watchers[addr] -= 1
+            if not self.watchers[addr]:
+                del self.watchers[addr]
+                self.scheduler.unwatch(addr)
+        logger.info("Live subscriber left", dropped_frames=subscription.dropped)
+
+    async def events(self, subscription: Subscription):
+        """Server-sent events for a subscription, unsubscribes when the client goes away."""
+        try:
+            while True:
+                frames = await subscription.next_frames(self.keepalive)
+                if not frames:
+                    # Keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                for frame in frames:
+                    yield frame.encode(subscription.fields)
+        finally:
+            self.unsubscribe(subscription)
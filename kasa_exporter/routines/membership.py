@@ -0,0 +1,73 @@
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import time
+import structlog
+
+logger = structlog.get_logger()
+
+
+class ShardMembership:
+    """Exporter instances sharing a fleet, tracked through a shared file.
+
+    Each instance writes a heartbeat (unix time) under its id into
+    KASA_SHARD_MEMBERS_FILE, an instance whose heartbeat is older than
+    KASA_SHARD_MEMBER_TTL is considered gone. Updates are serialized with
+    flock() on a sibling lock file and written atomically, so any number of
+    instances on hosts sharing the file (local disk, NFS with lock support)
+    can join and leave. Without a file the instance runs alone.
+    """
+
+    def __init__(self, instance_id=None, path=None):
+        self.instance_id = instance_id or os.getenv("KASA_SHARD_ID") or socket.gethostname()
+        if path is None:
+            path = os.getenv("KASA_SHARD_MEMBERS_FILE", "")
+        # An empty path disables sharding
+        self.path = path or None
+        self.heartbeat_interval = float(os.getenv("KASA_SHARD_HEARTBEAT", 10))
+        self.member_ttl = float(os.getenv("KASA_SHARD_MEMBER_TTL", 30))
+
+    def _update(self, change):
+        """Apply change(members) under the lock, returns the resulting members."""
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path) as f:
+                    members = json.load(f).get("members", {})
+            except (OSError, ValueError):
+                members = {}
+            change(members)
+            with tempfile.NamedTemporaryFile(
+                "w", dir=directory, delete=False, suffix=".tmp"
+            ) as f:
+                json.dump({"members": members}, f, indent=2, sort_keys=True)
+            os.replace(f.name, self.path)
+        return members
+
+    def heartbeat(self, now=None) -> list:
+        """Refresh our own heartbeat, returns the ids of the live members."""
+        if self.path is None:
+            return [self.instance_id]
+        now = time.time() if now is None else now
+
+        def beat(members):
+            members[self.instance_id] = now
+            # Long dead members are dropped from the file, not only ignored
+            for member in [m for m, seen in members.items() if now - seen > 10 * self.member_ttl]:
+                del members[member]
+
+        members = self._update(beat)
+        return sorted(m for m, seen in members.items() if now - seen <= self.member_ttl)
+
+    def leave(self):
+        """Remove ourselves so the other instances take over without waiting for the TTL."""
+        if self.path is None:
+            return
+        try:
+            self._update(lambda members: members.pop(self.instance_id, None))
+        except OSError as e:
+            logger.warning(f"Could not leave shard membership {self.path}: {str(e)}")
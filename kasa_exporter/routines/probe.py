@@ -0,0 +1,192 @@
+import asyncio
+from collections import OrderedDict
+import ipaddress
+import os
+import time
+import weakref
+from kasa import Discover
+from prometheus_client import CollectorRegistry, Counter, Gauge, generate_latest
+import structlog
+from ..devices.extractor_registry import default_registry
+from ..utils.singleflight import SingleFlight
+from .connection_pool import ConnectionPool
+from .device_registry import DeviceRegistry
+from .health import failure_reason
+
+logger = structlog.get_logger()
+
+
+class DeviceProber:
+    """Multi-target mode: polls one device per request, like the blackbox exporter.
+
+    Each probe refreshes the target over the shared connection pool and
+    renders it through a copy of its model's extractor bound to a registry of
+    its own, so Prometheus scrapes (and times out) every plug independently.
+    The copy is bound once per extractor, the target's series are removed
+    again as soon as they are rendered. Probes for
+    the same target that arrive while one is running share its result, which
+    is then served from cache for KASA_PROBE_CACHE_TTL seconds.
+
+    Only devices the registry knows are probed, plus addresses within the
+    networks of KASA_PROBE_ALLOW (e.g. "192.168.1.0/24,10.0.0.7"), so a
+    caller cannot point the exporter at arbitrary hosts. Allowed targets the
+    registry does not know are kept for KASA_PROBE_TARGET_TTL seconds after
+    their last probe, at most KASA_PROBE_MAX_TARGETS of them (least recently
+    probed go first), and their pooled session is closed when they go.
+    """
+
+    def __init__(self, device_registry: DeviceRegistry, connection_pool: ConnectionPool,
+                 credentials, collector_registry: CollectorRegistry):
+        self.device_registry = device_registry
+        self.connection_pool = connection_pool
+        self.credentials = credentials
+        self.timeout = float(os.getenv("KASA_PROBE_TIMEOUT", os.getenv("KASA_POLL_TIMEOUT", 5)))
+        self.flights = SingleFlight(ttl=float(os.getenv("KASA_PROBE_CACHE_TTL", 2)))
+        self.allowed_networks = parse_networks(os.getenv("KASA_PROBE_ALLOW", ""))
+        self.max_targets = max(1, int(os.getenv("KASA_PROBE_MAX_TARGETS", 64)))
+        self.target_ttl = float(os.getenv("KASA_PROBE_TARGET_TTL", 600))
+        # Targets that are not (yet) in the registry, resolved on their first probe:
+        # target -> (device, monotonic time of the last probe), least recently probed first
+        self.devices = OrderedDict()
+        self.extractor_registry = default_registry()
+        # Extractor -> its copy bound to a registry of its own, dropped with the
+        # extractor when a reload replaces it
+        self.bound = weakref.WeakKeyDictionary()
+
+        self.requests = Counter(
+            "device_probe_requests_total",
+            "Probe requests received, including those answered from a shared poll",
+            registry=collector_registry,
+        )
+        self.polls = Counter(
+            "device_probe_polls_total",
+            "Device polls performed for probe requests",
+            ["result"],
+            registry=collector_registry,
+        )
+
+    def allowed(self, target: str) -> bool:
+        if target in self.device_registry.devices or target in getattr(self.device_registry, "known", {}):
+            return True
+        try:
+            address = ipaddress.ip_address(target)
+        except ValueError:
+            return False
+        return any(address in network for network in self.allowed_networks)
+
+    async def probe(self, target: str, timeout: float = None) -> bytes:
+        """Render the target's metrics, PermissionError for a target that may not be probed."""
+        self.requests.inc()
+        if not self.allowed(target):
+            self.polls.labels(result="refused").inc()
+            raise PermissionError(f"{target} is neither a known device nor within KASA_PROBE_ALLOW")
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        return await self.flights.do(target, lambda: self._probe(target, timeout))
+
+    async def resolve(self, target: str):
+        device = self.device_registry.devices.get(target)
+        if device is not None:
+            return device
+        await self.evict_targets()
+        cached = self.devices.pop(target, None)
+        if cached is not None:
+            device = cached[0]
+        else:
+            device = await Discover.discover_single(target, credentials=self.credentials)
+            if device is None:
+                raise ConnectionError(f"No device answered at {target}")
+        self.devices[target] = (device, time.monotonic())
+        await self.evict_targets()
+        return device
+
+    async def evict_targets(self, now=None) -> list:
+        """Forget targets probed too long ago or beyond KASA_PROBE_MAX_TARGETS."""
+        now = time.monotonic() if now is None else now
+        evicted = []
+        while self.devices:
+            target, (_, probed_at) = next(iter(self.devices.items()))
+            if len(self.devices) <= self.max_targets and now - probed_at < self.target_ttl:
+                break
+            del self.devices[target]
+            evicted.append(target)
+            # The exporter polls over the same pool once the registry knows the device
+            if target not in self.device_registry.devices:
+                await self.connection_pool.release(target, reason="probe_evicted")
+        return evicted
+
+    async def _probe(self, target: str, timeout: float) -> bytes:
+        registry = CollectorRegistry()
+        success = Gauge("probe_success", "Whether the device answered the probe", registry=registry)
+        duration = Gauge(
+            "probe_duration_seconds", "How long the probe took to complete", registry=registry
+        )
+
+        start = time.monotonic()
+        try:
+            async with asyncio.timeout(timeout):
+                device = await self.resolve(target)
+                await self.connection_pool.update(target, device)
+            extractor = self.bound_extractor(
+                self.extractor_registry.extractors[self.extractor_registry.select(device)]
+            )
+            # No await from here on, concurrent probes of the same model never mix
+            try:
+                extractor.update_metrics(device)
+                content = generate_latest(DeviceMetrics(extractor))
+            finally:
+                extractor.forget_device(device)
+            success.set(1)
+            self.polls.labels(result="success").inc()
+        except Exception as e:
+            # Like the blackbox exporter a failed probe is still a 200 with probe_success 0
+            logger.error(f"Probe of {target} failed: {str(e)}", reason=failure_reason(e))
+            self.polls.labels(result="failure").inc()
+            content = b""
+        duration.set(time.monotonic() - start)
+        return generate_latest(registry) + content
+
+    def bound_extractor(self, extractor):
+        bound = self.bound.get(extractor)
+        if bound is None:
+            bound = self.bound[extractor] = extractor.copy()
+            bound.initialize_metrics(CollectorRegistry())
+        return bound
+
+    def http_sd_targets(self) -> list:
+        """Prometheus http_sd target groups, one per registered device."""
+        return [
+            {
+                "targets": [addr],
+                "labels": {
+                    "__meta_kasa_alias": str(getattr(device, "alias", "") or ""),
+                    "__meta_kasa_model": str(getattr(device, "model", "") or ""),
+                },
+            }
+            for addr, device in sorted(self.device_registry.devices.items())
+        ]
+
+
+class DeviceMetrics:
+    """Collector of an extractor's device metrics, without its series lifecycle metrics."""
+
+    def __init__(self, extractor):
+        self.metrics = {
+            id(metric_object["metric"]): metric_object["metric"]
+            for part in extractor.tree()
+            for metric_object in part.metric_objects.values()
+        }
+
+    def collect(self):
+        for metric in self.metrics.values():
+            yield from metric.collect()
+
+
+def parse_networks(spec: str) -> list:
+    """Networks from a comma separated list of addresses and CIDR ranges."""
+    networks = []
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            networks.append(ipaddress.ip_network(part, strict=False))
+        except ValueError:
+            raise ValueError(f"Invalid KASA_PROBE_ALLOW entry '{part}', expected an address or CIDR")
+    return networks
@@ -1,38 +1,170 @@
 import asyncio
-from datetime import datetime, timedelta
-import logging
+import gzip
+import http.client
 import os
-from prometheus_client import push_to_gateway, CollectorRegistry
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, CollectorRegistry
 import structlog
+from ..utils.sample_ring import SampleRing
+from .snapshot import SnapshotCollector
 
-# Configure structured logging with timestamp
-structlog.configure(
-    wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
-    processors=[
-        structlog.processors.TimeStamper(fmt="iso", utc=True),
-        structlog.processors.JSONRenderer(),
-    ],
-)
 logger = structlog.get_logger()
 
 
+class PushError(Exception):
+    def __init__(self, status, body):
+        super().__init__(f"Pushgateway answered {status}: {body[:200]!r}")
+        self.status = status
+
+
 class PushGateway:
-    def __init__(self, collector_registry: CollectorRegistry):
+    """Pushes the published snapshot to a Prometheus Pushgateway.
+
+    A push is triggered by the snapshot being published, i.e. once per
+    completed poll cycle, and sends the already rendered exposition gzip
+    compressed with PUT (replacing the job's group like prometheus_client's
+    push_to_gateway). The HTTP round-trip runs in a worker thread over one
+    kept-alive connection, so a slow or hung gateway never blocks the event
+    loop. Failed pushes are retried with bounded exponential backoff; a
+    snapshot published in the meantime supersedes the one that failed.
+
+    The Pushgateway rejects samples carrying timestamps, so what was sampled
+    during an outage cannot be replayed through it. Instead, once a push
+    succeeds again, everything sampled since the last successful push is
+    exported from the sample ring into
+    PUSH_GATEWAY_BACKFILL_DIR as an OpenMetrics file for promtool.
+    """
+
+    def __init__(
+        self,
+        collector_registry: CollectorRegistry,
+        snapshot: SnapshotCollector,
+        sample_ring: SampleRing = None,
+    ):
         self.collector_registry = collector_registry
+        self.snapshot = snapshot
         self.pg_host = os.getenv("PUSH_GATEWAY_HOST", "localhost")
         self.pg_port = int(os.getenv("PUSH_GATEWAY_PORT", 9091))
-        self.pg_disabled = bool(os.getenv("PUSH_GATEWAY_DISABLED", True))
+        self.pg_disabled = os.getenv("PUSH_GATEWAY_DISABLED", "true").lower() in ("1", "true", "yes")
+        self.job = os.getenv("PUSH_GATEWAY_JOB", "kasa_exporter")
+        self.timeout = float(os.getenv("PUSH_GATEWAY_TIMEOUT", 10))
+        self.base_backoff = float(os.getenv("PUSH_GATEWAY_BACKOFF", 1))
+        self.max_backoff = float(os.getenv("PUSH_GATEWAY_MAX_BACKOFF", 60))
+        self.sample_ring = sample_ring
+        self.backfill_dir = os.getenv(
+            "PUSH_GATEWAY_BACKFILL_DIR", os.path.expanduser("~/.cache/kasa-exporter/backfill")
+        )
+        self.last_pushed_at = None
+        self.outage_started = None
+        self.connection = None
+        self.pending = asyncio.Event()
+        snapshot.publish_listeners.append(self.pending.set)
+
+        self.push_duration = Histogram(
+            "device_pushgateway_push_duration_seconds",
+            "Duration of successful pushes to the Pushgateway",
+            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+            registry=collector_registry,
+        )
+        self.push_failures = Counter(
+            "device_pushgateway_push_failures_total",
+            "Failed pushes to the Pushgateway",
+            ["reason"],
+            registry=collector_registry,
+        )
+        self.last_success = Gauge(
+            "device_pushgateway_last_success_timestamp_seconds",
+            "Unix time of the last successful push",
+            registry=collector_registry,
+        )
+        self.pushed_bytes = Gauge(
+            "device_pushgateway_last_push_bytes",
+            "Compressed size of the last pushed body",
+            registry=collector_registry,
+        )
+        self.backfill_files = Counter(
+            "device_pushgateway_backfill_files_total",
+            "OpenMetrics backfill files written for Pushgateway outages",
+            registry=collector_registry,
+        )
+
+    def _send(self, body: bytes):
+        """Blocking PUT of one body, runs in a worker thread."""
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(
+                self.pg_host, self.pg_port, timeout=self.timeout
+            )
+        headers = {"Content-Type": CONTENT_TYPE_LATEST, "Content-Encoding": "gzip"}
+        try:
+            self.connection.request("PUT", f"/metrics/job/{self.job}", body=body, headers=headers)
+            response = self.connection.getresponse()
+            # Drain the response so the connection can be reused
+            payload = response.read()
+        except Exception:
+            self.connection.close()
+            self.connection = None
+            raise
+        if response.will_close:
+            self.connection.close()
+            self.connection = None
+        if not 200 <= response.status < 300:
+            raise PushError(response.status, payload)
+
+    async def push(self):
+        content, gzipped, _ = self.snapshot.rendered
+        body = gzipped if gzipped is not None else gzip.compress(content, compresslevel=5)
+        start = time.monotonic()
+        await asyncio.to_thread(self._send, body)
+        self.push_duration.observe(time.monotonic() - start)
+        self.last_pushed_at = time.time()
+        self.last_success.set(self.last_pushed_at)
+        self.pushed_bytes.set(len(body))
 
     async def push_to_gateway(self):
+        if self.pg_disabled:
+            return
+        backoff = 0.0
         while True:
-            if not self.pg_disabled:
-                try:
-                    push_to_gateway(
-                        f"{self.pg_host}:{self.pg_port}",
-                        job="kasa_exporter",
-                        registry=self.collector_registry,
-                    )
-                    logger.info("Pushed metrics to gateway")
-                except Exception as e:
-                    logger.error(f"Failed to push metrics to gateway: {str(e)}")
-            await asyncio.sleep(10)
+            await self.pending.wait()
+            self.pending.clear()
+            try:
+                await self.push()
+                backoff = 0.0
+                logger.info("Pushed metrics to gateway")
+                if self.outage_started is not None:
+                    await self.write_backfill(self.outage_started, self.last_pushed_at)
+                    self.outage_started = None
+            except Exception as e:
+                if self.outage_started is None:
+                    # Samples taken after the last successful push never reached the gateway
+                    self.outage_started = self.last_pushed_at or 0.0
+                reason = f"http_{e.status}" if isinstance(e, PushError) else type(e).__name__
+                self.push_failures.labels(reason=reason).inc()
+                backoff = min(self.max_backoff, backoff * 2 or self.base_backoff)
+                logger.error(f"Failed to push metrics to gateway, retrying in {backoff}s: {str(e)}")
+                # Retry with whatever snapshot is current once the backoff expires
+                self.pending.set()
+                await asyncio.sleep(backoff)
+
+    async def write_backfill(self, start: float, end: float):
+        """Export the samples of an outage window for `promtool tsdb create-blocks-from openmetrics`."""
+        if self.sample_ring is None or not self.backfill_dir:
+            return None
+        try:
+            content = await asyncio.to_thread(self.sample_ring.export_openmetrics, start, end)
+            os.makedirs(self.backfill_dir, exist_ok=True)
+            path = os.path.join(self.backfill_dir, f"backfill-{int(start)}-{int(end)}.om")
+            with open(path + ".tmp", "wb") as f:
+                f.write(content)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            logger.error(f"Failed to write backfill for the Pushgateway outage: {str(e)}")
+            return None
+        self.backfill_files.inc()
+        logger.info("Wrote backfill for the Pushgateway outage", path=path, start=start, end=end)
+        return path
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,221 @@
+"""Configuration reload without a restart.
+
+KASA_CONFIG_FILE names a TOML file with two optional tables:
+
+    [settings]            # KASA_* variables, they override the environment
+    KASA_POLL_INTERVAL = 5
+    KASA_EXTRACTOR_SPECS = "/etc/kasa-exporter/specs"
+
+    [tariff]              # time-of-use tariff, laid out like TIME_OF_USE_CONFIG
+    timezone = "America/Denver"
+    ...
+
+A reload (SIGHUP, or a change of the file or of an extractor spec) re-reads
+it, rebuilds the extractors and the tariff and swaps them into the running
+exporter. The collector registry, the connection pool, the discovered devices
+and the series of every metric that is still exported stay as they are.
+"""
+import os
+import signal
+import time
+import tomllib
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+import structlog
+
+from ..devices import KP125M
+from ..devices.extractor_registry import default_registry, spec_files
+from ..devices.refresh_tiers import parse_tiers
+from ..utils.time_of_use_calc import TIME_OF_USE_CONFIG, TimeOfUseCalc
+from .scheduler import ticker
+
+logger = structlog.get_logger()
+
+
+class ConfigFile:
+    def __init__(self, path: str = None):
+        self.path = os.getenv("KASA_CONFIG_FILE", "") if path is None else path
+        # Variable -> value it had before the file set it (None: unset)
+        self.original = {}
+
+    def load(self) -> dict:
+        """The parsed file, empty without KASA_CONFIG_FILE."""
+        if not self.path:
+            return {}
+        with open(self.path, "rb") as f:
+            config = tomllib.load(f)
+        settings = config.get("settings", {})
+        if not isinstance(settings, dict):
+            raise ValueError(f"{self.path}: [settings] must be a table")
+        unknown = [name for name in settings if not name.startswith("KASA_")]
+        if unknown:
+            raise ValueError(f"{self.path}: unknown settings {unknown}, expected KASA_* variables")
+        if "KASA_CONFIG_FILE" in settings:
+            raise ValueError(f"{self.path}: KASA_CONFIG_FILE cannot be set from the file itself")
+        if not isinstance(config.get("tariff", {}), dict):
+            raise ValueError(f"{self.path}: [tariff] must be a table")
+        return config
+
+    def apply(self, settings: dict) -> dict:
+        """Set the environment from settings, returns what restore() needs to undo it.
+
+        Variables a previous apply() set and settings no longer has go back
+        to their value from before the file.
+        """
+        undo = {
+            "environ": {name: os.environ.get(name) for name in {*settings, *self.original}},
+            "original": dict(self.original),
+        }
+        for name in list(self.original):
+            if name not in settings:
+                set_environ(name, self.original.pop(name))
+        for name, value in settings.items():
+            self.original.setdefault(name, os.environ.get(name))
+            set_environ(name, str(value).lower() if isinstance(value, bool) else str(value))
+        return undo
+
+    def restore(self, undo: dict):
+        for name, value in undo["environ"].items():
+            set_environ(name, value)
+        self.original = undo["original"]
+
+
+def set_environ(name: str, value):
+    if value is None:
+        os.environ.pop(name, None)
+    else:
+        os.environ[name] = value
+
+
+class ConfigReloader:
+    """Re-reads the configuration into a running DeviceExporter.
+
+    Every setting is parsed and the new extractors and tariff are fully
+    built before anything is swapped, and the swap itself never awaits, so
+    a poll sees either the old or the new configuration. A reload that
+    fails (unreadable file, invalid setting, tariff or spec, a metric
+    re-declared with another type) leaves the previous configuration in
+    place.
+
+    Re-read on reload: poll pacing and timeouts, credentials (used by
+    devices discovered from then on), discovery and pruning, connection
+    pool lifetimes, refresh tiers, extractor specs and the tariff. Poll
+    workers, the poll mode and the listening address need a restart.
+    """
+
+    def __init__(self, collector_registry: CollectorRegistry, device_exporter, config_file: ConfigFile = None):
+        self.exporter = device_exporter
+        self.config_file = config_file or ConfigFile()
+        # Seconds between checks for changed files, 0 only reloads on SIGHUP
+        self.poll_interval = float(os.getenv("KASA_CONFIG_POLL_INTERVAL", 5))
+        # Called with the new ExtractorRegistry after every successful reload
+        self.reload_listeners = []
+        self.stamps = self.file_stamps()
+
+        self.reloads = Counter(
+            "device_exporter_config_reloads_total",
+            "Configuration reloads by result",
+            ["result"],
+            registry=collector_registry,
+        )
+        self.reload_duration = Histogram(
+            "device_exporter_config_reload_duration_seconds",
+            "Wall time of a configuration reload, failed ones included",
+            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+            registry=collector_registry,
+        )
+        self.last_successful = Gauge(
+            "device_exporter_config_last_reload_successful",
+            "Whether the last configuration reload succeeded",
+            registry=collector_registry,
+        )
+        self.last_success = Gauge(
+            "device_exporter_config_last_reload_success_timestamp_seconds",
+            "Unix time of the last successful configuration reload",
+            registry=collector_registry,
+        )
+        self.last_successful.set(1)
+
+    def watched_files(self) -> list:
+        files = spec_files(os.getenv("KASA_EXTRACTOR_SPECS", ""))
+        return [self.config_file.path, *files] if self.config_file.path else files
+
+    def file_stamps(self) -> dict:
+        stamps = {}
+        for path in self.watched_files():
+            try:
+                stamps[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                stamps[path] = None
+        return stamps
+
+    def reload(self, reason: str = "signal") -> bool:
+        start = time.perf_counter()
+        try:
+            registry = self._reload()
+        except Exception as e:
+            logger.error(f"Configuration reload failed: {str(e)}", reason=reason)
+            self.reloads.labels(result="failure").inc()
+            self.last_successful.set(0)
+            return False
+        finally:
+            self.reload_duration.observe(time.perf_counter() - start)
+            # A broken file is not retried until it changes again
+            self.stamps = self.file_stamps()
+        self.reloads.labels(result="success").inc()
+        self.last_successful.set(1)
+        self.last_success.set_to_current_time()
+        for listener in self.reload_listeners:
+            try:
+                listener(registry)
+            except Exception as e:
+                logger.error(f"Reload listener failed: {str(e)}")
+        logger.info(
+            "Configuration reloaded",
+            reason=reason,
+            extractors=sorted(registry.extractors),
+            seconds=round(time.perf_counter() - start, 4),
+        )
+        return True
+
+    def _reload(self):
+        config = self.config_file.load()
+        calculator = TimeOfUseCalc(config.get("tariff") or TIME_OF_USE_CONFIG)
+        undo = self.config_file.apply(config.get("settings", {}))
+        tiers = dict(KP125M.tiers)
+        components = (
+            self.exporter,
+            self.exporter.scheduler,
+            self.exporter.device_registry,
+            self.exporter.connection_pool,
+        )
+        try:
+            settings = [component.read_settings() for component in components]
+            # Specs built below start from the new tiers
+            update(KP125M.tiers, parse_tiers(os.getenv("KASA_REFRESH_TIERS", ""), KP125M.DEFAULT_TIERS))
+            registry = default_registry()
+            self.exporter.swap_extractors(registry)
+        except Exception:
+            self.config_file.restore(undo)
+            update(KP125M.tiers, tiers)
+            raise
+        KP125M.calculator.adopt(calculator)
+        for component, values in zip(components, settings):
+            component.configure(values)
+        return registry
+
+    def install_signal_handler(self, loop):
+        loop.add_signal_handler(signal.SIGHUP, self.reload, "signal")
+
+    async def watch(self):
+        """Reload whenever the config file or an extractor spec changes."""
+        if self.poll_interval <= 0:
+            return
+        async for _ in ticker(self.poll_interval):
+            if self.file_stamps() != self.stamps:
+                self.reload("file")
+
+
+def update(target: dict, values: dict):
+    target.clear()
+    target.update(values)
@@ -0,0 +1,186 @@
+import asyncio
+import heapq
+import math
+import os
+import random
+import time
+
+
+async def ticker(interval: float, jitter: float = 0.0):
+    """Yield every `interval` seconds on a fixed grid.
+
+    Unlike sleeping `interval` after the work, the period does not stretch by
+    the time the work takes. Ticks that were missed entirely are skipped.
+    `jitter` (a fraction of the interval) is added to each sleep without
+    moving the grid, so loops started together do not stay in lockstep.
+    """
+    next_tick = time.monotonic()
+    while True:
+        yield
+        next_tick += interval
+        now = time.monotonic()
+        if next_tick <= now:
+            next_tick += interval * math.ceil((now - next_tick) / interval)
+        await asyncio.sleep(next_tick - now + random.uniform(0, jitter * interval))
+
+
+class PollScheduler:
+    """Per-device poll deadlines kept in a priority queue.
+
+    Every device has a nominal deadline that advances by its own interval
+    from the previous nominal deadline (drift-free), the deadline actually
+    used adds a random jitter on top so devices do not all come due together.
+    Intervals adapt to what the device reports: a device whose consumption is
+    changing is polled faster (down to min_interval), an idle or switched off
+    device backs off (up to max_interval), a steady one returns to the base
+    interval. A watched device (see watch()) is polled at least every watch
+    interval, whatever its adaptive pace.
+    """
+
+    def __init__(self, base_interval=None, min_interval=None, max_interval=None, jitter=None):
+        self.intervals = {}
+        self.configure(self.read_settings(base_interval, min_interval, max_interval, jitter))
+
+        self._heap = []  # (deadline, seq, addr), stale entries are skipped on pop
+        self._seq = 0
+        self.deadlines = {}  # addr -> jittered deadline
+        self.nominal = {}  # addr -> deadline on the drift-free grid
+        self.last_value = {}
+        self.watched = {}  # addr -> longest interval allowed while someone watches it
+
+    @staticmethod
+    def read_settings(base_interval=None, min_interval=None, max_interval=None, jitter=None) -> dict:
+        """The pacing settings from the environment, arguments given take precedence."""
+        return {
+            "base_interval": base_interval or float(os.getenv("KASA_POLL_INTERVAL", 10)),
+            "min_interval": min_interval or float(os.getenv("KASA_POLL_MIN_INTERVAL", 2)),
+            "max_interval": max_interval or float(os.getenv("KASA_POLL_MAX_INTERVAL", 60)),
+            "jitter": float(os.getenv("KASA_POLL_JITTER", 0.1)) if jitter is None else jitter,
+            # Consumption change (in watts, or relative) that counts as "changing"
+            "change_watts": float(os.getenv("KASA_POLL_CHANGE_WATTS", 5)),
+            "change_ratio": float(os.getenv("KASA_POLL_CHANGE_RATIO", 0.1)),
+        }
+
+    def configure(self, settings: dict = None):
+        """Switch to new pacing settings, devices at the base pace move to the new one."""
+        settings = settings or self.read_settings()
+        previous = getattr(self, "base_interval", None)
+        for name, value in settings.items():
+            setattr(self, name, value)
+        for addr, interval in self.intervals.items():
+            if interval == previous:
+                self.intervals[addr] = self.base_interval
+            else:
+                self.intervals[addr] = min(max(interval, self.min_interval), self.max_interval)
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, addr):
+        return addr in self.deadlines
+
+    def _push(self, addr, deadline):
+        self.deadlines[addr] = deadline
+        self._seq += 1
+        heapq.heappush(self._heap, (deadline, self._seq, addr))
+
+    def _jittered(self, nominal, interval):
+        return nominal + random.uniform(0, self.jitter * interval)
+
+    def add(self, addr, now=None):
+        now = time.monotonic() if now is None else now
+        self.intervals[addr] = self.base_interval
+        # Spread the first polls over the jitter window instead of one burst
+        self.nominal[addr] = now
+        self._push(addr, self._jittered(now, self.base_interval))
+
+    def remove(self, addr):
+        for state in (self.deadlines, self.nominal, self.intervals, self.last_value):
+            state.pop(addr, None)
+
+    def watch(self, addr, interval, now=None):
+        """Poll addr at least every interval seconds until unwatch(addr).
+
+        A device due later than that is pulled forward to now.
+        """
+        self.watched[addr] = interval
+        now = time.monotonic() if now is None else now
+        if addr in self.deadlines and self.deadlines[addr] > now + interval:
+            self.nominal[addr] = now
+            self._push(addr, now)
+
+    def unwatch(self, addr):
+        self.watched.pop(addr, None)
+
+    def sync(self, addrs, now=None):
+        """Track exactly the given addresses."""
+        for addr in addrs:
+            if addr not in self.deadlines:
+                self.add(addr, now)
+        for addr in [addr for addr in self.deadlines if addr not in addrs]:
+            self.remove(addr)
+
+    def next_deadline(self):
+        while self._heap:
+            deadline, _, addr = self._heap[0]
+            if self.deadlines.get(addr) == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now=None, window=0.0):
+        """Remove and return the addresses due by now + window, most overdue first."""
+        now = time.monotonic() if now is None else now
+        due = []
+        while (deadline := self.next_deadline()) is not None and deadline <= now + window:
+            _, _, addr = heapq.heappop(self._heap)
+            due.append((addr, deadline))
+        return due
+
+    def adapt(self, addr, value) -> float:
+        """Pick the next interval from the device's latest consumption reading."""
+        interval = self.intervals.get(addr, self.base_interval)
+        if value is None:
+            # Nothing to go by (no energy monitoring), keep the current pace
+            return interval
+        previous = self.last_value.get(addr)
+        self.last_value[addr] = value
+        if not value:
+            # Off or idle, nothing to catch between polls
+            interval = interval * 2
+        elif previous is not None and abs(value - previous) >= max(
+            self.change_watts, self.change_ratio * abs(previous)
+        ):
+            interval = interval / 2
+        elif interval < self.base_interval:
+            interval = min(self.base_interval, interval * 1.5)
+        else:
+            interval = self.base_interval
+        interval = min(self.max_interval, max(self.min_interval, interval))
+        self.intervals[addr] = interval
+        return interval
+
+    def defer(self, addr, delay, now=None):
+        """Move the next poll `delay` seconds out, the grid restarts from there."""
+        if addr not in self.nominal:
+            return None
+        now = time.monotonic() if now is None else now
+        self.nominal[addr] = now + delay
+        self._push(addr, now + delay)
+        return now + delay
+
+    def reschedule(self, addr, interval=None, now=None):
+        """Queue the next poll one interval after the previous nominal deadline."""
+        if addr not in self.nominal:
+            return None
+        now = time.monotonic() if now is None else now
+        interval = self.intervals[addr] if interval is None else interval
+        interval = min(interval, self.watched.get(addr, interval))
+        nominal = self.nominal[addr] + interval
+        if nominal <= now:
+            # The poll overran one or more periods, skip them rather than bursting
+            nominal += interval * math.ceil((now - nominal) / interval)
+        self.nominal[addr] = nominal
+        deadline = self._jittered(nominal, interval)
+        self._push(addr, deadline)
+        return deadline
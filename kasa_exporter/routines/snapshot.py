@@ -0,0 +1,68 @@
+import gzip
+import hashlib
+import os
+import time
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.metrics_core import Metric
+
+
+def merge_families(families) -> list:
+    """Combine families of the same name (e.g. from several processes) into one."""
+    merged = {}
+    for family in families:
+        target = merged.get(family.name)
+        if target is None:
+            target = merged[family.name] = Metric(
+                family.name, family.documentation, family.type, family.unit
+            )
+        target.samples.extend(family.samples)
+    return list(merged.values())
+
+
+class SnapshotCollector:
+    """Serves the metric families captured at the end of the last poll cycle.
+
+    The live CollectorRegistry is written to while devices are being polled,
+    scraping it directly can observe half a cycle. publish() takes a consistent
+    copy of every family, renders the exposition once and keeps the bytes (plus
+    a gzip variant and an ETag) until the next cycle, so concurrent scrapes cost
+    a dictionary lookup instead of a full walk of every labeled child.
+    """
+
+    def __init__(self, source_registry: CollectorRegistry, compress=None):
+        self.source_registry = source_registry
+        if compress is None:
+            compress = os.getenv("KASA_METRICS_GZIP", "true").lower() in ("1", "true", "yes")
+        self.compress = compress
+        self.families = []
+        self.generation = 0
+        # (content, gzip content or None, etag), swapped as a whole on publish
+        self.rendered = (b"", None, '"0"')
+        # Called with no arguments after every publish (e.g. to push the new snapshot)
+        self.publish_listeners = []
+        # Callables returning more families (e.g. from worker processes) merged on publish
+        self.sources = []
+        # Cost of the last publish: seconds and (plain, gzip) exposition bytes
+        self.render_duration = 0.0
+        self.render_size = (0, None)
+
+    def collect(self):
+        return iter(self.families)
+
+    def publish(self):
+        start = time.perf_counter()
+        self.families = list(self.source_registry.collect())
+        if self.sources:
+            for source in self.sources:
+                self.families.extend(source())
+            self.families = merge_families(self.families)
+        content = generate_latest(self)
+        etag = '"%s"' % hashlib.blake2b(content, digest_size=12).hexdigest()
+        gzipped = gzip.compress(content, compresslevel=5) if self.compress else None
+        self.generation += 1
+        self.rendered = (content, gzipped, etag)
+        self.render_duration = time.perf_counter() - start
+        self.render_size = (len(content), None if gzipped is None else len(gzipped))
+        for listener in self.publish_listeners:
+            listener()
+        return self.rendered
@@ -0,0 +1,240 @@
+import asyncio
+import importlib
+import multiprocessing
+import os
+import queue
+import time
+from datetime import datetime
+from prometheus_client import CollectorRegistry, Counter, Gauge
+from prometheus_client.metrics_core import Metric
+import structlog
+from ..utils.hash_ring import HashRing
+from ..utils.log_config import configure_logging
+from ..utils.sample_ring import SampleRing
+from .device_registry import DeviceRegistry
+from .discovery_cache import DiscoveryCache
+from .exporter import DeviceExporter
+
+logger = structlog.get_logger()
+
+
+def load_device_factory(spec=None):
+    """Callable building a device from a discovery cache entry, "module:function"."""
+    spec = spec or os.getenv("KASA_WORKER_DEVICE_FACTORY")
+    if not spec:
+        return DiscoveryCache.build_device
+    module, _, name = spec.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class WorkerExporter(DeviceExporter):
+    """DeviceExporter running inside a worker process, counts the polls it makes."""
+
+    def __init__(self, device_registry, collector_registry):
+        super().__init__(device_registry, collector_registry)
+        # The HTTP process records the merged samples
+        self.sample_ring = SampleRing("")
+        self.polls = 0
+
+    async def poll_device(self, addr, device, semaphore):
+        result = await super().poll_device(addr, device, semaphore)
+        self.polls += result is True
+        return result
+
+
+async def run_worker(worker_id, commands, results, report_interval):
+    collector_registry = CollectorRegistry()
+    registry = DeviceRegistry(collector_registry)
+    registry.discovery_cache.path = None
+    exporter = WorkerExporter(registry, collector_registry)
+    build_device = load_device_factory()
+    last_report = float("-inf")
+
+    def report():
+        nonlocal last_report
+        now = time.monotonic()
+        if now - last_report < report_interval:
+            return
+        last_report = now
+        checkins = {addr: seen.timestamp() for addr, seen in registry.last_checkin.items()}
+        results.put((worker_id, exporter.snapshot.families, checkins, exporter.polls))
+        exporter.polls = 0
+
+    exporter.snapshot.publish_listeners.append(report)
+    polling = asyncio.create_task(exporter.scrape_devices())
+    try:
+        while True:
+            command = await asyncio.to_thread(commands.get)
+            if command is None:
+                break
+            # The full slice of this worker, devices already held keep their session
+            for addr in [addr for addr in registry.devices if addr not in command]:
+                registry._release(addr, forget=True)
+            for addr, entry in command.items():
+                if addr not in registry.devices:
+                    device = build_device(entry, exporter.credentials)
+                    registry.known[addr] = device
+                    registry._assign(addr, device)
+    finally:
+        polling.cancel()
+        await exporter.connection_pool.close_all()
+        exporter.recorder.close()
+
+
+def worker_main(worker_id, commands, results, report_interval):
+    configure_logging()
+    asyncio.run(run_worker(worker_id, commands, results, report_interval))
+
+
+class WorkerPool:
+    """Splits device polling across KASA_POLL_WORKERS processes.
+
+    The HTTP process keeps discovery, pruning and sharding; devices it owns
+    are spread over the workers by consistent hashing and sent to them as
+    discovery cache entries. Each worker polls its slice with a regular
+    DeviceExporter and reports the families of its last cycle (at most every
+    KASA_WORKER_REPORT_INTERVAL seconds), which are merged into the snapshot
+    /metrics serves. Reports arriving within one report interval share a
+    single publish, however many workers there are. prometheus_client's multiprocess mode is not used because
+    it does not support the Info and Enum metrics the extractors export.
+    Exporter-internal metrics get a worker label, device metrics are merged
+    as they are since every device is polled by exactly one worker.
+    """
+
+    def __init__(self, device_registry: DeviceRegistry, exporter: DeviceExporter, workers=None):
+        self.device_registry = device_registry
+        self.exporter = exporter
+        self.workers = int(os.getenv("KASA_POLL_WORKERS", 0)) if workers is None else workers
+        self.report_interval = float(os.getenv("KASA_WORKER_REPORT_INTERVAL", 1))
+        self.ring = HashRing([str(worker) for worker in range(self.workers)])
+        self.processes = {}
+        self.commands = {}
+        self.assigned = {}  # worker -> set of addresses last sent
+        self.families = {}  # worker -> families of its last report
+        self.results = None
+        self.unpublished = 0  # reports not yet merged into the snapshot
+        self.published_at = float("-inf")
+        self.context = multiprocessing.get_context("spawn")
+        exporter.snapshot.sources.append(self.collect)
+
+        registry = exporter.collector_registry
+        self.worker_polls = Counter(
+            "device_worker_polls_total",
+            "Successful device polls per worker process",
+            ["worker"],
+            registry=registry,
+        )
+        self.worker_devices = Gauge(
+            "device_worker_devices",
+            "Devices assigned to each worker process",
+            ["worker"],
+            registry=registry,
+        )
+        self.worker_restarts = Counter(
+            "device_worker_restarts_total",
+            "Worker processes restarted after exiting",
+            ["worker"],
+            registry=registry,
+        )
+
+    def start(self):
+        self.results = self.context.Queue()
+        for worker in range(self.workers):
+            self._spawn(str(worker))
+
+    def _spawn(self, worker):
+        commands = self.commands[worker] = self.context.Queue()
+        process = self.context.Process(
+            target=worker_main,
+            args=(worker, commands, self.results, self.report_interval),
+            name=f"kasa-worker-{worker}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[worker] = process
+        self.assigned.pop(worker, None)
+
+    def assign(self):
+        """Send every worker its slice when it changed."""
+        slices = {worker: {} for worker in self.processes}
+        for addr, device in self.device_registry.devices.items():
+            slices[self.ring.owner(addr)][addr] = device
+        for worker, devices in slices.items():
+            if set(devices) == self.assigned.get(worker):
+                continue
+            entries = {}
+            for addr, device in devices.items():
+                try:
+                    entries[addr] = DiscoveryCache.serialize_device(device)
+                except Exception as e:
+                    logger.warning(f"Cannot hand device {addr} to a worker: {str(e)}")
+            self.commands[worker].put(entries)
+            self.assigned[worker] = set(devices)
+            self.worker_devices.labels(worker=worker).set(len(entries))
+
+    def collect(self) -> list:
+        device_families = self.exporter.recorded_families()
+        families = []
+        for worker, worker_families in self.families.items():
+            for family in worker_families:
+                if family.name in device_families:
+                    families.append(family)
+                    continue
+                labeled = Metric(family.name, family.documentation, family.type, family.unit)
+                labeled.samples = [
+                    sample._replace(labels={**sample.labels, "worker": worker})
+                    for sample in family.samples
+                ]
+                families.append(labeled)
+        return families
+
+    def handle_report(self, worker, families, checkins, polls):
+        self.families[worker] = families
+        for addr, seen in checkins.items():
+            if addr in self.device_registry.devices:
+                self.device_registry.last_checkin[addr] = datetime.fromtimestamp(seen)
+        self.worker_polls.labels(worker=worker).inc(polls)
+        self.unpublished += 1
+        device_families = self.exporter.recorded_families()
+        try:
+            self.exporter.sample_ring.record(families, include=device_families)
+        except Exception as e:
+            logger.error(f"Failed to record samples: {str(e)}")
+
+    async def run(self):
+        while True:
+            for worker, process in list(self.processes.items()):
+                if not process.is_alive():
+                    logger.error(f"Worker {worker} exited ({process.exitcode}), restarting")
+                    self.worker_restarts.labels(worker=worker).inc()
+                    self._spawn(worker)
+            self.assign()
+            timeout = 1.0
+            if self.unpublished:
+                timeout = max(0.0, self.published_at + self.report_interval - time.monotonic())
+            try:
+                self.handle_report(*await asyncio.to_thread(self.results.get, timeout=timeout))
+                # Reports that queued up meanwhile go into the same publish
+                while True:
+                    self.handle_report(*self.results.get_nowait())
+            except queue.Empty:
+                pass
+            self.publish_due()
+
+    def publish_due(self, now=None) -> bool:
+        """Publish the merged reports, at most once per report interval."""
+        now = time.monotonic() if now is None else now
+        if not self.unpublished or now - self.published_at < self.report_interval:
+            return False
+        self.unpublished = 0
+        self.published_at = now
+        self.exporter.snapshot.publish()
+        return True
+
+    def stop(self):
+        for worker, commands in self.commands.items():
+            commands.put(None)
+        for process in self.processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,232 @@
+"""Minimal exporter entry point for small hosts.
+
+    python -m kasa_exporter.slim
+
+Serves /metrics (the per-cycle snapshot of kasa_exporter.main, with the same
+ETag and gzip handling) and the /healthz and /readyz checks from a bare
+asyncio HTTP/1.1 server, without FastAPI, pydantic or uvicorn. The probe,
+live, backfill and debug endpoints stay with kasa_exporter.main.
+
+The port opens before the device stack (python-kasa with aiohttp and
+cryptography, the extractors) is imported. That import runs in a thread
+while the server already answers: until polling has started /metrics serves
+an empty exposition and /readyz answers 503.
+"""
+import asyncio
+from http import HTTPStatus
+import importlib
+import os
+import signal
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry
+import structlog
+
+from .routines.snapshot import SnapshotCollector
+from .utils.log_config import configure_logging
+
+logger = structlog.get_logger()
+
+# Imported off the event loop once the port is open
+STACK_MODULES = (
+    "kasa_exporter.routines.device_registry",
+    "kasa_exporter.routines.exporter",
+    "kasa_exporter.routines.instrumentation",
+    "kasa_exporter.routines.pushgateway",
+    "kasa_exporter.routines.reload",
+    "kasa_exporter.routines.workers",
+)
+
+MAX_HEADER_BYTES = 16384
+KEEPALIVE_TIMEOUT = 75  # longer than Prometheus keeps an idle scrape connection
+TEXT = {"Content-Type": "text/plain; charset=utf-8"}
+
+
+def import_stack():
+    for module in STACK_MODULES:
+        importlib.import_module(module)
+
+
+def render_response(
+    status: int, headers: dict, body: bytes, keep_alive: bool, content_length: int = None
+) -> bytes:
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    lines.append(f"Content-Length: {len(body) if content_length is None else content_length}")
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+
+class SlimServer:
+    def __init__(self, host=None, port=None):
+        self.host = host or os.getenv("METRICS_HOST", "0.0.0.0")
+        self.port = int(os.getenv("METRICS_PORT", 8000)) if port is None else port
+        self.collector_registry = CollectorRegistry()
+        # Answers /metrics until the exporter publishes its own snapshot
+        self.snapshot = SnapshotCollector(self.collector_registry)
+        self.device_registry = None
+        self.device_exporter = None
+        self.push_gateway = None
+        self.worker_pool = None
+        self.config_reloader = None
+        self.ready = False
+        self.server = None
+        self.tasks = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(
+            self.handle, self.host, self.port, limit=MAX_HEADER_BYTES
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("Listening", host=self.host, port=self.port)
+
+    async def load(self):
+        """Import the device stack and start polling, like main's lifespan."""
+        await asyncio.to_thread(import_stack)
+        from .routines.device_registry import DeviceRegistry
+        from .routines.exporter import DeviceExporter
+        from .routines.instrumentation import EventLoopMonitor
+        from .routines.pushgateway import PushGateway
+        from .routines.reload import ConfigFile, ConfigReloader
+        from .routines.workers import WorkerPool
+
+        config_file = ConfigFile()
+        config_file.apply(config_file.load().get("settings", {}))
+        device_registry = self.device_registry = DeviceRegistry(self.collector_registry)
+        exporter = self.device_exporter = DeviceExporter(device_registry, self.collector_registry)
+        self.push_gateway = PushGateway(
+            self.collector_registry, exporter.snapshot, exporter.sample_ring
+        )
+        self.worker_pool = WorkerPool(device_registry, exporter)
+        event_loop_monitor = EventLoopMonitor(self.collector_registry)
+        self.config_reloader = ConfigReloader(self.collector_registry, exporter, config_file)
+        if config_file.path:
+            self.config_reloader.reload("startup")
+
+        spawn = self.tasks.append
+        if device_registry.membership.path:
+            device_registry.rebalance(device_registry.membership.heartbeat())
+            spawn(asyncio.create_task(device_registry.run_membership()))
+        device_registry.warm_start(exporter.credentials)
+        exporter.snapshot.publish()
+        self.snapshot = exporter.snapshot
+        if self.worker_pool.workers:
+            if exporter.lazy:
+                logger.warning("KASA_POLL_MODE=lazy is ignored when polling in worker processes")
+                exporter.lazy = False
+            self.worker_pool.start()
+            spawn(asyncio.create_task(self.worker_pool.run()))
+        elif not exporter.lazy:
+            spawn(asyncio.create_task(exporter.scrape_devices()))
+        if not exporter.lazy:
+            spawn(asyncio.create_task(device_registry.run_discovery(exporter.credentials)))
+            spawn(asyncio.create_task(device_registry.update_registry()))
+        spawn(asyncio.create_task(self.push_gateway.push_to_gateway()))
+        spawn(asyncio.create_task(exporter.connection_pool.maintain()))
+        spawn(asyncio.create_task(event_loop_monitor.run()))
+        spawn(asyncio.create_task(self.config_reloader.watch()))
+        self.config_reloader.install_signal_handler(asyncio.get_running_loop())
+        self.ready = True
+        logger.info("Device stack loaded", port=self.port)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        for task in self.tasks:
+            task.cancel()
+        if self.device_exporter is not None:
+            self.device_registry.membership.leave()
+            self.worker_pool.stop()
+            await self.device_exporter.connection_pool.close_all()
+            self.push_gateway.close()
+            self.device_exporter.sample_ring.close()
+            self.device_exporter.recorder.close()
+
+    async def respond(self, method: str, path: str, headers: dict):
+        """(status, headers, body) for a request."""
+        if method not in ("GET", "HEAD"):
+            return 405, {"Allow": "GET, HEAD", **TEXT}, b""
+        if path == "/metrics":
+            if self.device_exporter is not None and self.device_exporter.lazy:
+                await self.device_exporter.refresh_stale()
+            content, gzipped, etag = self.snapshot.rendered
+            response_headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+            if headers.get("if-none-match") == etag:
+                return 304, response_headers, b""
+            response_headers["Content-Type"] = CONTENT_TYPE_LATEST
+            if gzipped is not None and "gzip" in headers.get("accept-encoding", ""):
+                response_headers["Content-Encoding"] = "gzip"
+                content = gzipped
+            return 200, response_headers, content
+        if path == "/healthz":
+            return 200, TEXT, b"ok\n"
+        if path == "/readyz":
+            return (200, TEXT, b"ready\n") if self.ready else (503, TEXT, b"starting\n")
+        return 404, TEXT, b"not found\n"
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(render_response(431, TEXT, b"", keep_alive=False))
+                    break
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ")
+                except ValueError:
+                    writer.write(render_response(400, TEXT, b"", keep_alive=False))
+                    break
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                status, response_headers, body = await self.respond(
+                    method, target.partition("?")[0], headers
+                )
+                # Request bodies are never read, a client sending one does not get to reuse
+                # the connection, its body would be parsed as the next request
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and method in ("GET", "HEAD")
+                    and headers.get("connection", "").lower() != "close"
+                    and "content-length" not in headers
+                    and "transfer-encoding" not in headers
+                )
+                if method == "HEAD":
+                    writer.write(render_response(status, response_headers, b"", keep_alive, len(body)))
+                else:
+                    writer.write(render_response(status, response_headers, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve():
+    server = SlimServer()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    await server.start()
+    try:
+        await server.load()
+        await stop.wait()
+    finally:
+        await server.close()
+
+
+def main():
+    configure_logging()
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
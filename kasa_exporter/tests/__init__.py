@@ -0,0 +1,4 @@
+import os
+
+# Keep exporters created by the tests from writing the default on-disk sample ring
+os.environ.setdefault("KASA_SAMPLE_RING", "")
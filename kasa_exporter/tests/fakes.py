@@ -0,0 +1,85 @@
+"""Stand-ins for devices and the device registry shared by the test modules."""
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from kasa import DeviceConnectionParameters, DeviceEncryptionType, DeviceFamily
+
+KLAP_PLUG = DeviceConnectionParameters(
+    DeviceFamily.SmartKasaPlug, DeviceEncryptionType.Klap, login_version=2
+)
+
+
+def make_device(alias, connection_type=KLAP_PLUG):
+    device = MagicMock()
+    device.alias = alias
+    device.model = "KP125M"
+    device.config.connection_type = connection_type
+    return device
+
+
+class FakeDevice:
+    def __init__(self, alias, delay=0.0, fail=False):
+        self.alias = alias
+        self.model = "KP125M"
+        self.delay = delay
+        self.fail = fail
+        self.updates = 0
+        self.disconnects = 0
+
+    async def update(self):
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("unreachable")
+        self.updates += 1
+
+    async def disconnect(self):
+        self.disconnects += 1
+
+
+class FakePlug(FakeDevice):
+    """FakeDevice reporting every feature the KP125M extractor reads."""
+
+    def __init__(self, alias, watts=12.5, **kwargs):
+        super().__init__(alias, **kwargs)
+        self.device_id = f"id-{alias}"
+        values = {
+            "signal_level": 3,
+            "state": True,
+            "rssi": -50,
+            "ssid": "home",
+            "on_since": datetime.now(timezone.utc),
+            "auto_off_enabled": False,
+            "auto_off_minutes": 0,
+            "auto_off_at": None,
+            "cloud_connection": True,
+            "current_consumption": watts,
+            "consumption_today": 0.2,
+            "consumption_this_month": 4.0,
+            "auto_update_enabled": True,
+            "update_available": False,
+            "current_firmware_version": "1.0",
+            "available_firmware_version": "1.0",
+            "led": True,
+        }
+        self.features = {key: SimpleNamespace(value=value) for key, value in values.items()}
+        self.state_information = {"Current consumption": watts}
+
+
+class FakeDeviceRegistry:
+    def __init__(self, devices):
+        self.devices = devices
+        self.last_checkin = {}
+        self.prune_listeners = []
+        self.discoveries = 0
+        self.prunes = 0
+
+    async def discover_once(self, credentials, interface=None):
+        self.discoveries += 1
+
+    def discovery_due(self):
+        return self.discoveries == 0
+
+    def prune_stale(self):
+        self.prunes += 1
@@ -0,0 +1,120 @@
+import asyncio
+import unittest
+
+from kasa.exceptions import KasaException
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.routines.connection_pool import ConnectionPool
+
+
+class FakeDevice:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.updates = 0
+        self.disconnects = 0
+
+    async def update(self):
+        if self.failures:
+            self.failures -= 1
+            raise KasaException("session expired")
+        self.updates += 1
+
+    async def disconnect(self):
+        self.disconnects += 1
+
+
+class TestConnectionPool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.collector_registry = CollectorRegistry()
+        self.pool = ConnectionPool(self.collector_registry)
+
+    def handshakes(self, reason):
+        return self.collector_registry.get_sample_value(
+            "device_pool_handshakes_total", {"reason": reason}
+        )
+
+    async def test_session_is_reused_across_updates(self):
+        device = FakeDevice()
+        for _ in range(3):
+            await self.pool.update("10.0.0.1", device)
+        self.assertEqual(device.updates, 3)
+        self.assertEqual(device.disconnects, 0)
+        self.assertEqual(self.handshakes("new"), 1)
+        self.assertEqual(
+            self.collector_registry.get_sample_value("device_pool_connections"), 1
+        )
+
+    async def test_failed_update_rehandshakes_and_retries(self):
+        device = FakeDevice(failures=1)
+        await self.pool.update("10.0.0.1", device)
+        self.assertEqual(device.updates, 1)
+        self.assertEqual(device.disconnects, 1)
+        self.assertEqual(self.handshakes("failure"), 1)
+        self.assertTrue(self.pool.is_healthy(self.pool.connections["10.0.0.1"]))
+
+    async def test_persistent_failure_marks_connection_unhealthy(self):
+        device = FakeDevice(failures=2)
+        with self.assertRaises(KasaException):
+            await self.pool.update("10.0.0.1", device)
+        self.assertFalse(self.pool.is_healthy(self.pool.connections["10.0.0.1"]))
+
+        # The next cycle starts from a fresh session
+        await self.pool.update("10.0.0.1", device)
+        self.assertEqual(device.disconnects, 2)
+        self.assertEqual(self.handshakes("failure"), 2)
+
+    async def test_expired_session_is_recycled(self):
+        device = FakeDevice()
+        await self.pool.update("10.0.0.1", device)
+        self.pool.connections["10.0.0.1"].opened_at -= self.pool.max_age
+        await self.pool.update("10.0.0.1", device)
+        self.assertEqual(device.disconnects, 1)
+        self.assertEqual(self.handshakes("expired"), 1)
+
+    async def test_idle_connections_are_evicted(self):
+        idle, busy = FakeDevice(), FakeDevice()
+        await self.pool.update("10.0.0.1", idle)
+        await self.pool.update("10.0.0.2", busy)
+        self.pool.connections["10.0.0.1"].last_used -= self.pool.idle_timeout + 1
+
+        self.assertEqual(await self.pool.evict_idle(), ["10.0.0.1"])
+        self.assertEqual(idle.disconnects, 1)
+        self.assertEqual(list(self.pool.connections), ["10.0.0.2"])
+
+    async def test_replaced_device_closes_old_session(self):
+        old, new = FakeDevice(), FakeDevice()
+        await self.pool.update("10.0.0.1", old)
+        await self.pool.update("10.0.0.1", new)
+        # Closed before update() returns, not by a detached task
+        self.assertEqual(old.disconnects, 1)
+        self.assertIs(self.pool.connections["10.0.0.1"].device, new)
+
+    async def test_pruned_device_session_is_closed(self):
+        device, other = FakeDevice(), FakeDevice()
+        await self.pool.update("10.0.0.1", device)
+        await self.pool.update("10.0.0.2", other)
+        # Only the session of the object the registry let go
+        self.pool.forget_device("10.0.0.2", FakeDevice())
+        self.pool.forget_device("10.0.0.1", device)
+        self.assertEqual(list(self.pool.connections), ["10.0.0.2"])
+        await asyncio.gather(*self.pool.closing)
+        self.assertEqual(device.disconnects, 1)
+        self.assertEqual(other.disconnects, 0)
+        self.assertEqual(
+            self.collector_registry.get_sample_value("device_pool_evictions_total", {"reason": "pruned"}), 1
+        )
+
+    async def test_session_in_use_is_closed_after_the_update(self):
+        device = FakeDevice()
+        await self.pool.update("10.0.0.1", device)
+        conn = self.pool.connections["10.0.0.1"]
+        async with conn.lock:
+            self.pool.forget_device("10.0.0.1", device)
+            await asyncio.sleep(0)
+            self.assertEqual(device.disconnects, 0)
+        await self.pool.close_all()
+        self.assertEqual(device.disconnects, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
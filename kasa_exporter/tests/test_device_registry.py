@@ -0,0 +1,143 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from kasa import DeviceConfig, DeviceConnectionParameters, DeviceEncryptionType, DeviceFamily
+from kasa.iot import IotPlug
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.routines.device_registry import DeviceRegistry
+from kasa_exporter.routines.discovery_cache import DiscoveryCache
+from kasa_exporter.routines.exporter import DeviceExporter
+from kasa_exporter.tests.fakes import KLAP_PLUG, make_device
+
+
+class TestDiscoverDevices(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.collector_registry = CollectorRegistry()
+        self.registry = DeviceRegistry(self.collector_registry)
+        self.registry.discovery_cache.path = None
+
+    @patch("kasa_exporter.routines.device_registry.Discover.discover", new_callable=AsyncMock)
+    async def test_discovery_merges_into_registry(self, discover):
+        first = {"10.0.0.1": make_device("a"), "10.0.0.2": make_device("b")}
+        discover.return_value = first
+        await self.registry.discover_devices(None, {})
+
+        # 10.0.0.2 misses the next broadcast, 10.0.0.1 answers with a new object
+        discover.return_value = {"10.0.0.1": make_device("a"), "10.0.0.3": make_device("c")}
+        await self.registry.discover_devices(None, {})
+
+        self.assertEqual(set(self.registry.devices), {"10.0.0.1", "10.0.0.2", "10.0.0.3"})
+        self.assertIs(self.registry.devices["10.0.0.1"], first["10.0.0.1"])
+        sample = self.collector_registry.get_sample_value
+        self.assertEqual(sample("device_registry_discovered_devices_total"), 3)
+        self.assertEqual(sample("device_registry_total_devices"), 3)
+
+    @patch("kasa_exporter.routines.device_registry.Discover.discover", new_callable=AsyncMock)
+    async def test_discovery_replaces_device_with_changed_connection(self, discover):
+        listener = MagicMock()
+        self.registry.prune_listeners.append(listener)
+        original = make_device("a")
+        discover.return_value = {"10.0.0.1": original}
+        await self.registry.discover_devices(None, {})
+
+        xor = DeviceConnectionParameters(DeviceFamily.IotSmartPlugSwitch, DeviceEncryptionType.Xor)
+        replacement = make_device("a", connection_type=xor)
+        discover.return_value = {"10.0.0.1": replacement}
+        await self.registry.discover_devices(None, {})
+        self.assertIs(self.registry.devices["10.0.0.1"], replacement)
+        # The exporter drops the extractor assignment and series of the old object
+        listener.assert_called_once_with("10.0.0.1", original)
+        self.assertIn("10.0.0.1", self.registry.last_checkin)
+
+    @patch("kasa_exporter.routines.device_registry.asyncio.sleep", new_callable=AsyncMock)
+    async def test_update_registry_prunes_stale_devices(self, sleep):
+        sleep.side_effect = [None, asyncio.CancelledError]
+        listener = MagicMock()
+        self.registry.prune_listeners.append(listener)
+        self.registry.devices = {"10.0.0.1": make_device("a"), "10.0.0.2": make_device("b")}
+        stale = self.registry.devices["10.0.0.2"]
+        self.registry.last_checkin = {
+            "10.0.0.1": datetime.now(),
+            "10.0.0.2": datetime.now() - self.registry.prune_after - timedelta(seconds=1),
+        }
+        with self.assertRaises(asyncio.CancelledError):
+            await self.registry.update_registry()
+        self.assertEqual(list(self.registry.devices), ["10.0.0.1"])
+        listener.assert_called_once_with("10.0.0.2", stale)
+        self.assertEqual(
+            self.collector_registry.get_sample_value("device_registry_pruned_devices_total"), 1
+        )
+
+
+class TestWarmStart(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp.name, "devices.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_registry(self):
+        registry = DeviceRegistry(CollectorRegistry())
+        registry.discovery_cache = DiscoveryCache(self.cache_path)
+        return registry
+
+    async def test_cache_round_trip(self):
+        klap = DiscoveryCache.build_device(
+            {"host": "10.0.0.1", "device_class": "SmartDevice", "connection_type": KLAP_PLUG.to_dict()}
+        )
+        xor = IotPlug("10.0.0.2", config=DeviceConfig("10.0.0.2", port_override=10000))
+        DiscoveryCache(self.cache_path).save({"10.0.0.1": klap, "10.0.0.2": xor})
+
+        registry = self.make_registry()
+        self.assertEqual(registry.warm_start(credentials=None), 2)
+        restored = registry.devices
+        self.assertEqual(type(restored["10.0.0.1"]).__name__, "SmartDevice")
+        self.assertEqual(restored["10.0.0.1"].config.connection_type, KLAP_PLUG)
+        self.assertIsInstance(restored["10.0.0.2"], IotPlug)
+        self.assertEqual(restored["10.0.0.2"].config.port_override, 10000)
+        self.assertEqual(set(registry.last_checkin), {"10.0.0.1", "10.0.0.2"})
+
+    async def test_missing_or_corrupt_cache_is_ignored(self):
+        self.assertEqual(self.make_registry().warm_start(credentials=None), 0)
+        with open(self.cache_path, "w") as f:
+            f.write("{not json")
+        self.assertEqual(self.make_registry().warm_start(credentials=None), 0)
+
+    @patch("kasa_exporter.devices.KP125M.Extractor.update_metrics")
+    async def test_warm_start_reaches_first_sample_without_discovery(self, _update_metrics):
+        cached = {
+            f"10.0.1.{i}": DiscoveryCache.build_device(
+                {"host": f"10.0.1.{i}", "connection_type": KLAP_PLUG.to_dict()}
+            )
+            for i in range(50)
+        }
+        DiscoveryCache(self.cache_path).save(cached)
+
+        collector_registry = CollectorRegistry()
+        start = time.monotonic()
+        registry = DeviceRegistry(collector_registry)
+        registry.discovery_cache = DiscoveryCache(self.cache_path)
+        exporter = DeviceExporter(registry, collector_registry)
+        exporter.started_at = start
+        registry.warm_start(exporter.credentials)
+
+        with patch.object(exporter.connection_pool, "update", new_callable=AsyncMock):
+            await exporter.poll_devices()
+
+        latency = collector_registry.get_sample_value(
+            "device_exporter_startup_first_sample_seconds"
+        )
+        self.assertIsNotNone(latency)
+        # No broadcast wait: the first sample only depends on the device round-trip
+        self.assertLess(latency, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,15 @@
+import asyncio
+import os
+import tempfile
+import time
 import unittest
+from unittest.mock import patch
+
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.routines.exporter import DeviceExporter
+from kasa_exporter.utils.sample_ring import SampleRing
+from kasa_exporter.tests.fakes import FakeDevice, FakeDeviceRegistry
 
 
 class TestExporter(unittest.TestCase):
@@ -6,5 +17,128 @@ class TestExporter(unittest.TestCase):
         self.assertTrue(True)  # Replace with actual tests
 
 
+@patch("kasa_exporter.devices.KP125M.Extractor.update_metrics")
+class TestPollDevices(unittest.IsolatedAsyncioTestCase):
+    def make_exporter(self, devices, concurrency=16, timeout=1.0):
+        self.collector_registry = CollectorRegistry()
+        exporter = DeviceExporter(FakeDeviceRegistry(devices), self.collector_registry)
+        exporter.poll_concurrency = concurrency
+        exporter.poll_timeout = timeout
+        return exporter
+
+    async def test_polls_devices_concurrently(self, _update_metrics):
+        devices = {f"10.0.0.{i}": FakeDevice(f"plug{i}", delay=0.2) for i in range(10)}
+        exporter = self.make_exporter(devices)
+
+        start = time.monotonic()
+        await exporter.poll_devices()
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertTrue(all(d.updates == 1 for d in devices.values()))
+        self.assertEqual(len(exporter.device_registry.last_checkin), 10)
+
+    async def test_concurrency_limit_is_respected(self, _update_metrics):
+        in_flight = 0
+        peak = 0
+
+        class CountingDevice(FakeDevice):
+            async def update(self):
+                nonlocal in_flight, peak
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        devices = {f"10.0.0.{i}": CountingDevice(f"plug{i}") for i in range(12)}
+        exporter = self.make_exporter(devices, concurrency=3)
+        await exporter.poll_devices()
+        self.assertEqual(peak, 3)
+
+    async def test_slow_device_does_not_delay_others(self, update_metrics):
+        devices = {
+            "10.0.0.1": FakeDevice("dead", delay=30),
+            "10.0.0.2": FakeDevice("alive"),
+            "10.0.0.3": FakeDevice("broken", fail=True),
+        }
+        exporter = self.make_exporter(devices, timeout=0.2)
+
+        duration = await exporter.poll_devices()
+        self.assertLess(duration, 1.0)
+        self.assertEqual(update_metrics.call_count, 1)
+        self.assertEqual(list(exporter.device_registry.last_checkin), ["10.0.0.2"])
+        # Healthy sessions are kept open by the connection pool
+        self.assertEqual(devices["10.0.0.2"].disconnects, 0)
+
+        sample = self.collector_registry.get_sample_value
+        self.assertEqual(sample("device_exporter_last_cycle_polled_devices"), 1)
+        self.assertEqual(sample("device_exporter_last_cycle_failed_devices"), 2)
+        self.assertEqual(sample("device_exporter_last_cycle_duration_seconds"), duration)
+        self.assertEqual(sample("device_exporter_cycle_duration_seconds_count"), 1)
+
+    async def test_cycle_records_only_devices_it_polled(self, _update_metrics):
+        devices = {f"10.0.0.{i}": FakeDevice(f"plug{i}") for i in range(3)}
+        exporter = self.make_exporter(devices)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        exporter.sample_ring = SampleRing(os.path.join(tmp.name, "samples.ring"), capacity=100)
+
+        def recorded_addresses():
+            return sorted(
+                sample.labels["address"]
+                for family in exporter.sample_ring.families()
+                for sample in family.samples
+            )
+
+        with patch.object(exporter.snapshot, "publish", wraps=exporter.snapshot.publish) as publish:
+            await exporter.poll_batch(list(devices.items())[:2])
+            await exporter.poll_batch(list(devices.items())[2:])
+            self.assertEqual(publish.call_count, 0)
+            exporter.complete_cycle()
+            self.assertEqual(publish.call_count, 1)
+        self.assertEqual(self.collector_registry.get_sample_value("device_exporter_last_cycle_polled_devices"), 3)
+        self.assertEqual(recorded_addresses(), ["10.0.0.0", "10.0.0.1", "10.0.0.2"])
+
+        # The next cycle polled one device, the others are not recorded again
+        await exporter.poll_batch([("10.0.0.1", devices["10.0.0.1"])])
+        exporter.complete_cycle()
+        self.assertEqual(recorded_addresses(), ["10.0.0.0", "10.0.0.1", "10.0.0.1", "10.0.0.2"])
+        # Nothing polled, nothing recorded
+        exporter.complete_cycle()
+        self.assertEqual(len(recorded_addresses()), 4)
+
+
+
+@patch("kasa_exporter.devices.KP125M.Extractor.update_metrics")
+class TestLazyRefresh(unittest.IsolatedAsyncioTestCase):
+    def make_exporter(self, devices, ttl=0.2):
+        exporter = DeviceExporter(FakeDeviceRegistry(devices), CollectorRegistry())
+        exporter.lazy = True
+        exporter.staleness_ttl = ttl
+        return exporter
+
+    async def test_concurrent_scrapes_share_one_refresh(self, _update_metrics):
+        devices = {f"10.0.0.{i}": FakeDevice(f"plug{i}", delay=0.05) for i in range(3)}
+        exporter = self.make_exporter(devices)
+
+        await asyncio.gather(*(exporter.refresh_stale() for _ in range(5)))
+        self.assertTrue(all(d.updates == 1 for d in devices.values()))
+        self.assertEqual(exporter.snapshot.generation, 1)
+        self.assertEqual(exporter.device_registry.discoveries, 1)
+
+    async def test_only_stale_devices_are_polled(self, _update_metrics):
+        devices = {"10.0.0.1": FakeDevice("a"), "10.0.0.2": FakeDevice("b")}
+        exporter = self.make_exporter(devices)
+        await exporter.refresh_stale()
+
+        # Within the staleness TTL a scrape causes no device traffic at all
+        await exporter.refresh_stale()
+        self.assertEqual([d.updates for d in devices.values()], [1, 1])
+        self.assertEqual(exporter.snapshot.generation, 1)
+
+        exporter.refreshed_at["10.0.0.2"] -= 1
+        await exporter.refresh_stale()
+        self.assertEqual([d.updates for d in devices.values()], [1, 2])
+        self.assertEqual(exporter.device_registry.prunes, 2)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,125 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.routines.exporter import DeviceExporter
+from kasa_exporter.routines.health import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    DeviceHealth,
+    failure_reason,
+)
+from kasa_exporter.tests.fakes import FakeDevice, FakeDeviceRegistry
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_threshold_and_backs_off_exponentially(self):
+        breaker = CircuitBreaker(failure_threshold=2, base_backoff=10, max_backoff=30, jitter=0)
+        self.assertFalse(breaker.record_failure("timeout", now=0))
+        self.assertTrue(breaker.record_failure("timeout", now=0))
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow(now=9))
+        self.assertTrue(breaker.allow(now=10))
+        self.assertEqual(breaker.state, HALF_OPEN)
+
+        # A failed trial re-opens with twice the backoff, capped at max_backoff
+        for now, backoff in ((10, 20), (30, 30), (60, 30)):
+            self.assertTrue(breaker.record_failure("timeout", now=now))
+            self.assertEqual(breaker.retry_in(now=now), backoff)
+            breaker.allow(now=now + backoff)
+
+    def test_half_open_lets_a_single_trial_through(self):
+        breaker = CircuitBreaker(failure_threshold=1, base_backoff=10, jitter=0)
+        breaker.record_failure("timeout", now=0)
+        self.assertTrue(breaker.allow(now=10))
+        # Polls arriving while the trial is in flight are held back
+        self.assertFalse(breaker.allow(now=10))
+        self.assertFalse(breaker.allow(now=15))
+        # A trial that never reported back is replaced after a backoff
+        self.assertTrue(breaker.allow(now=20))
+        breaker.record_success()
+        self.assertTrue(breaker.allow(now=20))
+        self.assertTrue(breaker.allow(now=20))
+
+    def test_success_closes_and_resets_backoff(self):
+        breaker = CircuitBreaker(failure_threshold=1, base_backoff=10, jitter=0)
+        breaker.record_failure("unreachable", now=0)
+        breaker.allow(now=10)
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.record_failure("unreachable", now=20)
+        self.assertEqual(breaker.retry_in(now=20), 10)
+
+    def test_failure_reasons(self):
+        self.assertEqual(failure_reason(asyncio.TimeoutError()), "timeout")
+        self.assertEqual(failure_reason(ConnectionRefusedError()), "unreachable")
+        self.assertEqual(failure_reason(ValueError()), "error")
+
+
+class TestDeviceHealth(unittest.TestCase):
+    def setUp(self):
+        self.collector_registry = CollectorRegistry()
+        self.health = DeviceHealth(self.collector_registry)
+        self.health.failure_threshold = 1
+
+    def up(self, reason):
+        return self.collector_registry.get_sample_value(
+            "device_up", {"address": "10.0.0.1", "reason": reason}
+        )
+
+    def test_device_up_keeps_a_single_series_per_device(self):
+        self.health.record_failure("10.0.0.1", asyncio.TimeoutError())
+        self.assertEqual(self.up("timeout"), 0)
+        self.assertEqual(
+            self.collector_registry.get_sample_value("device_health_open_circuits"), 1
+        )
+        self.health.allow("10.0.0.1", now=float("inf"))
+        self.health.record_success("10.0.0.1")
+        self.assertIsNone(self.up("timeout"))
+        self.assertEqual(self.up(""), 1)
+        self.assertEqual(
+            self.collector_registry.get_sample_value("device_health_open_circuits"), 0
+        )
+
+    def test_forget_keeps_open_breakers(self):
+        self.health.record_failure("10.0.0.1", OSError())
+        self.health.forget("10.0.0.1")
+        self.assertIsNone(self.up("unreachable"))
+        self.assertFalse(self.health.allow("10.0.0.1"))
+
+        self.health.record_success("10.0.0.2")
+        self.health.forget("10.0.0.2")
+        self.assertNotIn("10.0.0.2", self.health.breakers)
+
+
+@patch("kasa_exporter.devices.KP125M.Extractor.update_metrics")
+class TestExporterBackoff(unittest.IsolatedAsyncioTestCase):
+    async def test_unreachable_device_stops_costing_poll_time(self, _update_metrics):
+        devices = {"10.0.0.1": FakeDevice("dead", delay=30), "10.0.0.2": FakeDevice("alive")}
+        collector_registry = CollectorRegistry()
+        exporter = DeviceExporter(FakeDeviceRegistry(devices), collector_registry)
+        exporter.poll_timeout = 0.1
+        exporter.health.failure_threshold = 2
+
+        durations = [await exporter.poll_devices() for _ in range(4)]
+        # Two timeouts open the circuit, later cycles skip the device entirely
+        self.assertTrue(all(d >= 0.1 for d in durations[:2]))
+        self.assertTrue(all(d < 0.05 for d in durations[2:]))
+        self.assertEqual(devices["10.0.0.2"].updates, 4)
+        self.assertNotIn("10.0.0.1", exporter.connection_pool.connections)
+
+        sample = collector_registry.get_sample_value
+        self.assertEqual(sample("device_up", {"address": "10.0.0.1", "reason": "timeout"}), 0)
+        self.assertEqual(sample("device_up", {"address": "10.0.0.2", "reason": ""}), 1)
+        self.assertEqual(sample("device_exporter_last_cycle_failed_devices"), 0)
+        self.assertEqual(
+            sample("device_health_circuit_transitions_total", {"state": "open"}), 1
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
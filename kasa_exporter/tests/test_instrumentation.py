@@ -0,0 +1,128 @@
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from kasa import DeviceConfig
+from kasa.protocol import BaseTransport
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.devices.replay import RecordingTransport
+from kasa_exporter.devices.simulator import SimulatedPlug
+from kasa_exporter.routines.device_registry import DeviceRegistry
+from kasa_exporter.routines.exporter import DeviceExporter
+from kasa_exporter.routines.instrumentation import EventLoopMonitor, PollInstrumentation
+
+
+class HandshakingTransport(BaseTransport):
+    """Handshakes before the first query of a session, like KLAP."""
+
+    default_port = 80
+    credentials_hash = None
+
+    def __init__(self, *, config):
+        super().__init__(config=config)
+        self.session = False
+
+    async def perform_handshake(self):
+        await asyncio.sleep(0.05)
+        self.session = True
+
+    async def send(self, request):
+        if not self.session:
+            await self.perform_handshake()
+        await asyncio.sleep(0.02)
+        return {}
+
+    async def close(self):
+        self.session = False
+
+    async def reset(self):
+        self.session = False
+
+
+class TestPollInstrumentation(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.collector_registry = CollectorRegistry()
+        self.instrumentation = PollInstrumentation(self.collector_registry)
+
+    def phase(self, phase, suffix="sum"):
+        return self.collector_registry.get_sample_value(
+            f"device_exporter_poll_phase_seconds_{suffix}", {"phase": phase}
+        )
+
+    async def poll(self, device):
+        self.instrumentation.attach("10.0.0.1", device)
+        start = time.perf_counter()
+        await device.protocol._transport.send("{}")
+        self.instrumentation.observe("10.0.0.1", time.perf_counter() - start)
+
+    async def test_handshake_split_from_query(self):
+        transport = HandshakingTransport(config=DeviceConfig("10.0.0.1"))
+        # Wrapped by a traffic capture, the phases are still timed on the real transport
+        capture = SimpleNamespace(exchange=lambda *args, **kwargs: None)
+        recording = RecordingTransport(transport, capture)
+        device = SimpleNamespace(protocol=SimpleNamespace(_transport=recording))
+        await self.poll(device)
+        await self.poll(device)
+
+        self.assertEqual(self.phase("handshake", "count"), 1)
+        self.assertGreaterEqual(self.phase("handshake"), 0.05)
+        self.assertLess(self.phase("handshake"), 0.07)
+        self.assertEqual(self.phase("query", "count"), 2)
+        self.assertGreaterEqual(self.phase("query"), 0.04)
+        self.assertLess(self.phase("query"), 0.07)
+        self.assertIsNone(self.phase("connect", "count"))
+
+    async def test_devices_without_transport_only_have_a_query_phase(self):
+        plug = SimulatedPlug("10.0.0.1", latency=0, jitter=0, handshake_latency=0)
+        self.instrumentation.attach("10.0.0.1", plug)
+        self.instrumentation.observe("10.0.0.1", 0.01)
+        self.assertEqual(self.phase("query", "count"), 1)
+        self.assertIsNone(self.phase("handshake", "count"))
+
+
+class TestExporterSelfMetrics(unittest.IsolatedAsyncioTestCase):
+    async def test_cycle_render_and_extractor_metrics(self):
+        collector_registry = CollectorRegistry()
+        registry = DeviceRegistry(collector_registry)
+        registry.discovery_cache.path = None
+        exporter = DeviceExporter(registry, collector_registry)
+        exporter.sample_ring.path = None
+        exporter.poll_interval = 0.01
+        registry.devices = {"10.0.0.1": SimulatedPlug("10.0.0.1", latency=0.02, jitter=0)}
+        await exporter.poll_devices()
+
+        sample = collector_registry.get_sample_value
+        self.assertEqual(sample("device_exporter_cycle_overruns_total"), 1)
+        self.assertEqual(
+            sample("device_exporter_extractor_update_seconds_count", {"extractor": "KP125M"}), 1
+        )
+        self.assertEqual(sample("device_exporter_render_duration_seconds_count"), 1)
+        plain, gzipped = exporter.snapshot.render_size
+        self.assertEqual(sample("device_exporter_render_bytes", {"encoding": "identity"}), plain)
+        self.assertLess(gzipped, plain)
+
+    async def test_event_loop_lag(self):
+        collector_registry = CollectorRegistry()
+        monitor = EventLoopMonitor(collector_registry, interval=0.01)
+        task = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0)
+        time.sleep(0.1)  # blocks the loop
+        await asyncio.sleep(0.02)
+        task.cancel()
+        lag = collector_registry.get_sample_value("device_exporter_event_loop_lag_seconds_sum")
+        self.assertGreaterEqual(lag, 0.08)
+
+
+class TestProfileEndpoint(unittest.TestCase):
+    def test_profile_is_disabled_by_default(self):
+        from kasa_exporter import main
+
+        response = TestClient(main.app).get("/debug/profile", params={"seconds": 0.1})
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
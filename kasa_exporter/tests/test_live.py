@@ -0,0 +1,159 @@
+import json
+import time
+import unittest
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.routines.live import LiveStream
+from kasa_exporter.routines.scheduler import PollScheduler
+
+
+def make_device(alias, watts, children=()):
+    features = {
+        "current_consumption": SimpleNamespace(value=watts),
+        "voltage": SimpleNamespace(value=120.0),
+        "state": SimpleNamespace(value=bool(watts)),
+    }
+    return SimpleNamespace(
+        alias=alias, device_id=f"id-{alias}", model="KP125M", features=features,
+        children=list(children),
+    )
+
+
+def decode(event):
+    kind, data = event.strip().split("\n")
+    return kind, json.loads(data[len("data: "):])
+
+
+class TestLiveStream(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.collector_registry = CollectorRegistry()
+        self.scheduler = PollScheduler(base_interval=10, jitter=0)
+        self.devices = {"10.0.0.1": make_device("kettle", 2000), "10.0.0.2": make_device("fridge", 80)}
+        self.live = LiveStream(
+            self.collector_registry, self.scheduler, SimpleNamespace(devices=self.devices)
+        )
+
+    def sample(self, name):
+        return self.collector_registry.get_sample_value(name)
+
+    async def test_subscribers_share_one_poll(self):
+        everything = self.live.subscribe()
+        kettle = self.live.subscribe(devices=["kettle"], fields=["current_consumption"])
+        for addr, device in self.devices.items():
+            self.live.publish(addr, device)
+
+        frames = await everything.next_frames(0)
+        self.assertEqual([frame.addr for frame in frames], ["10.0.0.1", "10.0.0.2"])
+        frames_for_kettle = await kettle.next_frames(0)
+        # Both subscribers got the very same reading
+        self.assertIs(frames_for_kettle[0], frames[0])
+        _, payload = decode(frames_for_kettle[0].encode(kettle.fields))
+        self.assertEqual(payload["alias"], "kettle")
+        self.assertEqual(payload["current_consumption"], 2000)
+        self.assertNotIn("voltage", payload)
+        _, payload = decode(frames[1].encode(everything.fields))
+        self.assertEqual((payload["voltage"], payload["state"]), (120.0, True))
+        self.assertEqual(self.sample("device_live_subscribers"), 2)
+        self.assertEqual(self.sample("device_live_frames_total"), 3)
+
+    async def test_slow_subscriber_gets_latest_frame(self):
+        subscription = self.live.subscribe(devices=["10.0.0.1"])
+        device = self.devices["10.0.0.1"]
+        for watts in (100, 200, 300):
+            device.features["current_consumption"].value = watts
+            self.live.publish("10.0.0.1", device)
+
+        frames = await subscription.next_frames(0)
+        self.assertEqual(len(frames), 1)
+        _, payload = decode(frames[0].encode(subscription.fields))
+        self.assertEqual(payload["current_consumption"], 300)
+        self.assertEqual(subscription.dropped, 2)
+        self.assertEqual(self.sample("device_live_frames_dropped_total"), 2)
+        self.assertEqual(await subscription.next_frames(0), [])
+
+    async def test_strip_outlets(self):
+        strip = make_device("rack", 30, [make_device("outlet 0", 10), make_device("outlet 1", 20)])
+        subscription = self.live.subscribe(fields=["current_consumption"])
+        self.live.publish("10.0.0.3", strip)
+        frame, = await subscription.next_frames(0)
+        _, payload = decode(frame.encode(subscription.fields))
+        self.assertEqual(
+            payload["outlets"],
+            [
+                {"outlet": 0, "alias": "outlet 0", "current_consumption": 10},
+                {"outlet": 1, "alias": "outlet 1", "current_consumption": 20},
+            ],
+        )
+
+    async def test_unknown_field(self):
+        with self.assertRaises(ValueError):
+            self.live.subscribe(fields=["temperature"])
+        self.assertEqual(self.live.subscriptions, [])
+
+    async def test_watched_devices_poll_faster(self):
+        start = time.monotonic()
+        self.scheduler.sync(self.devices, now=start)
+        self.scheduler.reschedule("10.0.0.1", now=start)
+        self.assertEqual(self.scheduler.deadlines["10.0.0.1"], start + 10)
+
+        first = self.live.subscribe(devices=["kettle"])
+        second = self.live.subscribe(devices=["10.0.0.1"])
+        # Pulled forward, then polled at the live interval
+        self.assertLess(self.scheduler.deadlines["10.0.0.1"], start + self.live.interval)
+        now = self.scheduler.nominal["10.0.0.1"]
+        self.assertEqual(self.scheduler.reschedule("10.0.0.1", now=now), now + self.live.interval)
+        self.assertNotIn("10.0.0.2", self.scheduler.watched)
+
+        self.live.unsubscribe(first)
+        self.assertIn("10.0.0.1", self.scheduler.watched)
+        self.live.unsubscribe(second)
+        self.assertEqual(self.scheduler.watched, {})
+        self.assertEqual(self.sample("device_live_subscribers"), 0)
+
+    async def test_devices_matching_later_are_watched(self):
+        subscription = self.live.subscribe(devices=["heater"])
+        self.assertEqual(self.scheduler.watched, {})
+
+        # Discovered after the subscription, watched from its first poll on
+        self.devices["10.0.0.3"] = heater = make_device("heater", 1500)
+        self.live.publish("10.0.0.3", heater)
+        self.live.publish("10.0.0.3", heater)
+        self.assertEqual(subscription.watched, {"10.0.0.3"})
+        self.assertEqual(self.live.watchers, {"10.0.0.3": 1})
+        self.assertEqual(self.scheduler.watched, {"10.0.0.3": self.live.interval})
+        self.assertEqual(len(await subscription.next_frames(0)), 1)
+
+        self.live.unsubscribe(subscription)
+        self.assertEqual(self.live.watchers, {})
+        self.assertEqual(self.scheduler.watched, {})
+
+    async def test_events_unsubscribe_on_close(self):
+        subscription = self.live.subscribe(devices=["kettle"])
+        events = self.live.events(subscription)
+        self.live.publish("10.0.0.1", self.devices["10.0.0.1"])
+        kind, payload = decode(await events.__anext__())
+        self.assertEqual(kind, "event: power")
+        self.assertEqual(payload["address"], "10.0.0.1")
+
+        self.live.keepalive = 0.01
+        self.assertEqual(await events.__anext__(), ": keepalive\n\n")
+        await events.aclose()
+        self.assertEqual(self.live.subscriptions, [])
+        self.assertEqual(self.scheduler.watched, {})
+
+
+class TestLiveEndpoint(unittest.TestCase):
+    def test_rejects_unknown_fields(self):
+        from kasa_exporter import main
+
+        response = TestClient(main.app).get("/live", params={"fields": "current_consumption,bogus"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("bogus", response.text)
+        self.assertEqual(main.live_stream.subscriptions, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.routines.connection_pool import ConnectionPool
+from kasa_exporter.routines.probe import DeviceProber, parse_networks
+from kasa_exporter.tests.fakes import FakeDeviceRegistry, FakePlug
+
+
+class TestDeviceProber(unittest.IsolatedAsyncioTestCase):
+    def make_prober(self, devices):
+        self.collector_registry = CollectorRegistry()
+        return DeviceProber(
+            FakeDeviceRegistry(devices),
+            ConnectionPool(self.collector_registry),
+            None,
+            self.collector_registry,
+        )
+
+    async def test_probe_renders_only_the_target(self):
+        prober = self.make_prober({"10.0.0.1": FakePlug("a"), "10.0.0.2": FakePlug("b")})
+        content = (await prober.probe("10.0.0.1")).decode()
+        self.assertIn("probe_success 1.0", content)
+        self.assertIn('current_consumption{alias="a",device_id="id-a",model="KP125M"} 12.5', content)
+        self.assertNotIn('alias="b"', content)
+
+    async def test_extractor_copy_is_bound_once(self):
+        prober = self.make_prober({"10.0.0.1": FakePlug("a"), "10.0.0.2": FakePlug("b", watts=3.0)})
+        prober.flights.ttl = 0
+        await prober.probe("10.0.0.1")
+        with patch("kasa_exporter.devices.prom_device_extractor.logger") as logger:
+            second = (await prober.probe("10.0.0.2")).decode()
+            again = (await prober.probe("10.0.0.1")).decode()
+        # No metric registered again, no series left behind by the previous target
+        logger.info.assert_not_called()
+        self.assertEqual(len(prober.bound), 1)
+        self.assertIn('current_consumption{alias="b",device_id="id-b",model="KP125M"} 3.0', second)
+        self.assertNotIn('alias="a"', second)
+        # Every metric again, whatever its refresh tier
+        self.assertIn('current_consumption{alias="a",device_id="id-a",model="KP125M"} 12.5', again)
+        self.assertIn('consumption_today{alias="a",device_id="id-a",model="KP125M"} 0.2', again)
+        self.assertNotIn("device_extractor_series", again)
+
+    async def test_concurrent_probes_share_one_poll(self):
+        plug = FakePlug("a", delay=0.05)
+        prober = self.make_prober({"10.0.0.1": plug})
+        results = await asyncio.gather(*(prober.probe("10.0.0.1") for _ in range(5)))
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(plug.updates, 1)
+        # Served from the result cache afterwards
+        await prober.probe("10.0.0.1")
+        self.assertEqual(plug.updates, 1)
+        sample = self.collector_registry.get_sample_value
+        self.assertEqual(sample("device_probe_requests_total"), 6)
+        self.assertEqual(sample("device_probe_polls_total", {"result": "success"}), 1)
+
+    async def test_slow_or_unknown_target_fails_the_probe_only(self):
+        prober = self.make_prober({"10.0.0.1": FakePlug("dead", delay=5)})
+        content = (await prober.probe("10.0.0.1", timeout=0.1)).decode()
+        self.assertIn("probe_success 0.0", content)
+
+        prober.allowed_networks = parse_networks("10.0.0.0/24")
+        with patch(
+            "kasa_exporter.routines.probe.Discover.discover_single",
+            new_callable=AsyncMock,
+            return_value=FakePlug("new"),
+        ) as discover_single:
+            content = (await prober.probe("10.0.0.9")).decode()
+        discover_single.assert_awaited_once()
+        self.assertIn("probe_success 1.0", content)
+        self.assertIn("10.0.0.9", prober.devices)
+
+    async def test_targets_outside_the_registry_and_allow_list_are_refused(self):
+        prober = self.make_prober({"10.0.0.1": FakePlug("a")})
+        prober.allowed_networks = parse_networks("192.168.1.0/24, 10.0.1.7")
+        with patch(
+            "kasa_exporter.routines.probe.Discover.discover_single", new_callable=AsyncMock
+        ) as discover_single:
+            for target in ("169.254.169.254", "10.0.1.8", "metadata.internal", "localhost"):
+                with self.assertRaises(PermissionError):
+                    await prober.probe(target)
+        discover_single.assert_not_awaited()
+        self.assertTrue(prober.allowed("10.0.0.1"))
+        self.assertTrue(prober.allowed("10.0.1.7"))
+        self.assertTrue(prober.allowed("192.168.1.20"))
+        self.assertEqual(
+            self.collector_registry.get_sample_value(
+                "device_probe_polls_total", {"result": "refused"}
+            ),
+            4,
+        )
+        with self.assertRaises(ValueError):
+            parse_networks("10.0.0.0/33")
+
+    async def test_unknown_targets_are_bounded_and_release_their_session(self):
+        prober = self.make_prober({})
+        prober.allowed_networks = parse_networks("10.0.0.0/24")
+        prober.max_targets = 2
+        plugs = {f"10.0.0.{i}": FakePlug(f"p{i}") for i in range(3)}
+        with patch(
+            "kasa_exporter.routines.probe.Discover.discover_single",
+            new_callable=AsyncMock,
+            side_effect=lambda target, credentials: plugs[target],
+        ):
+            for target in plugs:
+                await prober.probe(target)
+        # The least recently probed target went, with its pooled session
+        self.assertEqual(list(prober.devices), ["10.0.0.1", "10.0.0.2"])
+        self.assertNotIn("10.0.0.0", prober.connection_pool.connections)
+        self.assertEqual(plugs["10.0.0.0"].disconnects, 1)
+
+        evicted = await prober.evict_targets(now=time.monotonic() + prober.target_ttl)
+        self.assertEqual(evicted, ["10.0.0.1", "10.0.0.2"])
+        self.assertEqual(prober.connection_pool.connections, {})
+
+    def test_http_sd_targets(self):
+        prober = self.make_prober({"10.0.0.2": FakePlug("b"), "10.0.0.1": FakePlug("a")})
+        self.assertEqual(
+            prober.http_sd_targets(),
+            [
+                {"targets": ["10.0.0.1"], "labels": {"__meta_kasa_alias": "a", "__meta_kasa_model": "KP125M"}},
+                {"targets": ["10.0.0.2"], "labels": {"__meta_kasa_alias": "b", "__meta_kasa_model": "KP125M"}},
+            ],
+        )
+
+
+class TestProbeEndpoint(unittest.TestCase):
+    def test_probe_and_targets_endpoints(self):
+        from kasa_exporter import main
+
+        main.device_registry.devices = {"10.0.0.1": FakePlug("a")}
+        try:
+            client = TestClient(main.app)
+            response = client.get("/probe", params={"target": "10.0.0.1"})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("probe_success 1.0", response.text)
+            self.assertEqual(client.get("/targets").json()[0]["targets"], ["10.0.0.1"])
+            self.assertEqual(client.get("/probe").status_code, 422)
+            response = client.get("/probe", params={"target": "169.254.169.254"})
+            self.assertEqual(response.status_code, 403)
+            for header in ("soon", "nan"):
+                response = client.get(
+                    "/probe",
+                    params={"target": "10.0.0.1"},
+                    headers={"X-Prometheus-Scrape-Timeout-Seconds": header},
+                )
+                self.assertEqual(response.status_code, 200)
+        finally:
+            main.device_registry.devices = {}
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import asyncio
+import gzip
+import os
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from prometheus_client import CollectorRegistry, Gauge
+
+from kasa_exporter.routines.pushgateway import PushGateway
+from kasa_exporter.routines.snapshot import SnapshotCollector
+from kasa_exporter.utils.sample_ring import SampleRing
+
+
+class FakeGateway(ThreadingHTTPServer):
+    """Records pushed bodies, answers with the queued status codes (200 once empty)."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        self.bodies = []
+        self.clients = set()
+        self.statuses = []
+        self.delay = 0.0
+        super().__init__(("127.0.0.1", 0), GatewayHandler)
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_PUT(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server.clients.add(self.client_address)
+        time.sleep(server.delay)
+        status = server.statuses.pop(0) if server.statuses else 200
+        if status == 200:
+            server.bodies.append((self.path, self.headers["Content-Encoding"], body))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class TestPushGateway(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = FakeGateway()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.registry = CollectorRegistry()
+        self.gauge = Gauge("power", "power", registry=self.registry)
+        self.snapshot = SnapshotCollector(self.registry, compress=False)
+        self.gateway = PushGateway(self.registry, self.snapshot)
+        self.gateway.pg_host, self.gateway.pg_port = self.server.server_address
+        self.gateway.pg_disabled = False
+        self.gateway.base_backoff = 0.05
+        self.task = asyncio.create_task(self.gateway.push_to_gateway())
+
+    async def asyncTearDown(self):
+        self.task.cancel()
+        self.gateway.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    async def wait_for_pushes(self, count, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while len(self.server.bodies) < count and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        self.assertEqual(len(self.server.bodies), count)
+
+    async def test_pushes_each_published_cycle_over_one_connection(self):
+        for value in (1, 2, 3):
+            self.gauge.set(value)
+            self.snapshot.publish()
+            await self.wait_for_pushes(value)
+
+        path, encoding, body = self.server.bodies[-1]
+        self.assertEqual(path, "/metrics/job/kasa_exporter")
+        self.assertEqual(encoding, "gzip")
+        self.assertIn(b"power 3.0", gzip.decompress(body))
+        self.assertEqual(len(self.server.clients), 1)
+        self.assertEqual(
+            self.registry.get_sample_value("device_pushgateway_push_duration_seconds_count"), 3
+        )
+
+    async def test_no_push_without_a_completed_cycle(self):
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.server.bodies, [])
+
+    async def test_retries_failed_pushes_with_backoff(self):
+        self.server.statuses = [500, 503]
+        self.snapshot.publish()
+        await self.wait_for_pushes(1)
+        sample = self.registry.get_sample_value
+        self.assertEqual(sample("device_pushgateway_push_failures_total", {"reason": "http_500"}), 1)
+        self.assertEqual(sample("device_pushgateway_push_failures_total", {"reason": "http_503"}), 1)
+        self.assertIsNotNone(sample("device_pushgateway_last_success_timestamp_seconds"))
+
+    async def test_outage_is_written_as_backfill(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ring = SampleRing(os.path.join(tmp, "samples.ring"), capacity=100)
+            self.gateway.sample_ring = ring
+            self.gateway.backfill_dir = os.path.join(tmp, "backfill")
+            self.server.statuses = [500]
+            self.gauge.set(7)
+            ring.record(self.registry.collect(), timestamp=time.time())
+            self.snapshot.publish()
+            await self.wait_for_pushes(1)
+            for _ in range(100):
+                if self.gateway.outage_started is None:
+                    break
+                await asyncio.sleep(0.01)
+
+            (name,) = os.listdir(self.gateway.backfill_dir)
+            with open(os.path.join(self.gateway.backfill_dir, name)) as f:
+                content = f.read()
+            self.assertRegex(content, r"\npower 7\.0 \d+")
+            self.assertTrue(content.endswith("# EOF\n"))
+            ring.close()
+
+    async def test_slow_gateway_does_not_block_the_loop(self):
+        self.server.delay = 0.3
+        self.snapshot.publish()
+        start = time.monotonic()
+        ticks = 0
+        while time.monotonic() - start < 0.2:
+            await asyncio.sleep(0.01)
+            ticks += 1
+        self.assertGreater(ticks, 10)
+        await self.wait_for_pushes(1)
+
+
+if __name__ == "__main__":
+    unittest.main()
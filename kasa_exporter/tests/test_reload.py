@@ -0,0 +1,228 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from kasa import Feature
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.devices import KP125M
+from kasa_exporter.routines.device_registry import DeviceRegistry
+from kasa_exporter.routines.exporter import DeviceExporter
+from kasa_exporter.routines.reload import ConfigFile, ConfigReloader
+
+SPEC = """
+name = "HS110"
+models = ["HS110"]
+
+[metrics.current_consumption]
+type = "{consumption_type}"
+tier = "power"
+{extra}
+"""
+
+LED = """
+[metrics.hs110_led]
+type = "enum"
+feature = "led"
+states = ["on", "off"]
+"""
+
+FLAT_TARIFF = """
+[tariff]
+timezone = "America/Denver"
+
+[tariff.season]
+summer = ["01-01", "12-31"]
+
+[tariff.summer]
+off_peak = [["00:00", "00:00"]]
+
+[tariff.summer.rate]
+off_peak = 1.0
+"""
+
+
+class Plug(SimpleNamespace):
+    # Devices are weak dictionary keys of the exporter
+    __hash__ = object.__hash__
+
+    async def update(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+
+def make_plug():
+    device = Plug(device_id="8006", alias="kitchen", model="HS110(EU)", led=False, power=12.5)
+    device.features = {
+        "led": Feature(device, id="led", name="LED", attribute_getter="led",
+                       attribute_setter="set_led", type=Feature.Type.Switch),
+        "current_consumption": Feature(device, id="current_consumption",
+                                       name="Current consumption", attribute_getter="power",
+                                       type=Feature.Type.Sensor),
+    }
+    return device
+
+
+class TestConfigReload(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.specs = os.path.join(self.tmp.name, "specs")
+        os.mkdir(self.specs)
+        self.config_path = os.path.join(self.tmp.name, "kasa.toml")
+        self.environ = patch.dict(os.environ, {
+            "KASA_DISCOVERY_CACHE": "",
+            "KASA_SAMPLE_RING": "",
+            "KASA_EXTRACTOR_SPECS": self.specs,
+        })
+        self.environ.start()
+        os.environ.pop("KASA_USERNAME", None)
+        # The tariff and the tiers are module state shared by the built-in extractors
+        self.calculator = dict(KP125M.calculator.__dict__)
+        self.tiers = dict(KP125M.tiers)
+
+    def tearDown(self):
+        KP125M.calculator.__dict__.clear()
+        KP125M.calculator.__dict__.update(self.calculator)
+        KP125M.tiers.clear()
+        KP125M.tiers.update(self.tiers)
+        self.environ.stop()
+        self.tmp.cleanup()
+
+    def write_spec(self, consumption_type="gauge", extra=LED):
+        with open(os.path.join(self.specs, "hs110.toml"), "w") as f:
+            f.write(SPEC.format(consumption_type=consumption_type, extra=extra))
+
+    def write_config(self, settings="", tariff=""):
+        with open(self.config_path, "w") as f:
+            f.write(f"[settings]\n{settings}\n{tariff}")
+
+    def make_exporter(self):
+        config_file = ConfigFile(self.config_path)
+        config_file.apply(config_file.load().get("settings", {}))
+        self.collector_registry = CollectorRegistry()
+        device_registry = DeviceRegistry(self.collector_registry)
+        exporter = DeviceExporter(device_registry, self.collector_registry)
+        self.reloader = ConfigReloader(self.collector_registry, exporter, config_file)
+        return exporter
+
+    def sample(self, name, labels=None):
+        return self.collector_registry.get_sample_value(name, labels or {})
+
+    async def poll(self, exporter, device):
+        exporter.device_registry.devices = {"10.0.0.1": device}
+        with patch.object(exporter.connection_pool, "update", new_callable=AsyncMock):
+            await exporter.poll_devices()
+
+    async def test_spec_change_keeps_shared_series(self):
+        self.write_spec()
+        self.write_config()
+        exporter = self.make_exporter()
+        device = make_plug()
+        await self.poll(exporter, device)
+        labels = {"device_id": "8006", "alias": "kitchen", "model": "HS110(EU)"}
+        self.assertEqual(self.sample("current_consumption", labels), 12.5)
+        self.assertEqual(self.sample("hs110_led", {**labels, "hs110_led": "off"}), 1)
+        previous = exporter.extractors["HS110"]
+
+        self.write_spec(extra="")
+        self.assertTrue(self.reloader.reload("file"))
+        self.assertIsNot(exporter.extractors["HS110"], previous)
+        self.assertEqual(exporter.assigned[device], "HS110")
+        # Series of metrics still exported stay as they were until the next poll
+        self.assertEqual(self.sample("current_consumption", labels), 12.5)
+        self.assertNotIn("hs110_led", self.collector_registry._names_to_collectors)
+
+        device.power = 20.0
+        await self.poll(exporter, device)
+        self.assertEqual(self.sample("current_consumption", labels), 20.0)
+        self.assertEqual(self.sample("device_exporter_config_reloads_total", {"result": "success"}), 1)
+        self.assertEqual(self.sample("device_exporter_config_last_reload_successful"), 1)
+
+    async def test_failed_reload_keeps_previous_configuration(self):
+        self.write_spec()
+        self.write_config()
+        exporter = self.make_exporter()
+        previous = dict(exporter.extractors)
+
+        # current_consumption is a gauge of the built-in extractors
+        self.write_spec(consumption_type="counter")
+        self.write_config(settings="KASA_POLL_INTERVAL = 3")
+        self.assertFalse(self.reloader.reload("signal"))
+        self.assertEqual(exporter.extractors, previous)
+        self.assertNotIn("KASA_POLL_INTERVAL", os.environ)
+        self.assertEqual(exporter.scheduler.base_interval, 10)
+        self.assertIn("hs110_led", self.collector_registry._names_to_collectors)
+        self.assertEqual(self.sample("device_exporter_config_reloads_total", {"result": "failure"}), 1)
+        self.assertEqual(self.sample("device_exporter_config_last_reload_successful"), 0)
+        self.assertEqual(self.sample("device_exporter_config_reload_duration_seconds_count"), 1)
+
+        self.write_config(settings="KASA_POLL_INTERVAL = [")
+        self.assertFalse(self.reloader.reload("file"))
+        self.assertEqual(self.sample("device_exporter_config_reloads_total", {"result": "failure"}), 2)
+
+    async def test_invalid_setting_changes_nothing(self):
+        self.write_spec()
+        self.write_config()
+        exporter = self.make_exporter()
+        previous = dict(exporter.extractors)
+        tiers = dict(KP125M.tiers)
+        calc_rate = KP125M.calculator.calc_rate(1000)
+
+        self.write_spec(extra="")
+        self.write_config(
+            settings='KASA_POLL_INTERVAL = "abc"\nKASA_REFRESH_TIERS = "energy=5"',
+            tariff=FLAT_TARIFF,
+        )
+        self.assertFalse(self.reloader.reload("signal"))
+        self.assertNotIn("KASA_POLL_INTERVAL", os.environ)
+        self.assertNotIn("KASA_REFRESH_TIERS", os.environ)
+        self.assertEqual(KP125M.tiers, tiers)
+        self.assertEqual(exporter.extractors, previous)
+        self.assertIn("hs110_led", self.collector_registry._names_to_collectors)
+        self.assertEqual(KP125M.calculator.calc_rate(1000), calc_rate)
+        self.assertEqual(exporter.poll_interval, 10)
+        self.assertEqual(exporter.scheduler.base_interval, 10)
+        self.assertEqual(self.sample("device_exporter_config_reloads_total", {"result": "failure"}), 1)
+
+    async def test_settings_and_tariff(self):
+        self.write_config()
+        exporter = self.make_exporter()
+        credentials = exporter.credentials
+        calc_rate = KP125M.calculator.calc_rate
+
+        self.write_config(
+            settings='KASA_POLL_INTERVAL = 3\nKASA_USERNAME = "plug@example.com"',
+            tariff=FLAT_TARIFF,
+        )
+        self.assertTrue(self.reloader.reload("signal"))
+        self.assertEqual(exporter.poll_interval, 3)
+        self.assertEqual(exporter.scheduler.base_interval, 3)
+        # Updated in place, so discovery and the prober see the new account
+        self.assertIs(exporter.credentials, credentials)
+        self.assertEqual(credentials.username, "plug@example.com")
+        # The consumption_cost transform was bound before the reload
+        self.assertEqual(calc_rate(1000), 1.0)
+
+        # Settings removed from the file go back to the environment's
+        self.write_config()
+        self.assertTrue(self.reloader.reload("signal"))
+        self.assertNotIn("KASA_USERNAME", os.environ)
+        self.assertEqual(exporter.scheduler.base_interval, 10)
+        self.assertNotEqual(calc_rate(1000), 1.0)
+
+    async def test_file_change_is_noticed(self):
+        self.write_config()
+        self.make_exporter()
+        self.assertEqual(self.reloader.file_stamps(), self.reloader.stamps)
+        self.write_spec()
+        self.assertNotEqual(self.reloader.file_stamps(), self.reloader.stamps)
+        self.assertTrue(self.reloader.reload("file"))
+        self.assertEqual(self.reloader.file_stamps(), self.reloader.stamps)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import time
+import unittest
+from unittest.mock import patch
+
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.routines.exporter import DeviceExporter
+from kasa_exporter.routines.scheduler import PollScheduler, ticker
+from kasa_exporter.tests.fakes import FakeDevice, FakeDeviceRegistry
+
+
+class TestPollScheduler(unittest.TestCase):
+    def make_scheduler(self, jitter=0.0):
+        return PollScheduler(base_interval=10, min_interval=2, max_interval=60, jitter=jitter)
+
+    def test_deadlines_do_not_drift(self):
+        scheduler = self.make_scheduler()
+        scheduler.add("a", now=100.0)
+        # Each poll finishes late, the next deadline still sits on the 10s grid
+        for expected in (110.0, 120.0, 130.0):
+            self.assertEqual(scheduler.pop_due(now=expected - 10 + 3), [("a", expected - 10)])
+            self.assertEqual(scheduler.reschedule("a", now=expected - 10 + 3), expected)
+
+    def test_overrun_skips_missed_periods(self):
+        scheduler = self.make_scheduler()
+        scheduler.add("a", now=0.0)
+        scheduler.pop_due(now=0.0)
+        self.assertEqual(scheduler.reschedule("a", now=35.0), 40.0)
+
+    def test_jitter_stays_within_fraction_of_interval(self):
+        scheduler = self.make_scheduler(jitter=0.1)
+        for i in range(100):
+            scheduler.add(f"d{i}", now=0.0)
+        self.assertTrue(all(0.0 <= d <= 1.0 for d in scheduler.deadlines.values()))
+        self.assertGreater(len(set(scheduler.deadlines.values())), 1)
+
+    def test_pop_due_orders_by_deadline_and_honours_window(self):
+        scheduler = self.make_scheduler()
+        for addr, now in (("late", 5.0), ("early", 1.0), ("later", 9.0)):
+            scheduler.add(addr, now=now)
+        due = scheduler.pop_due(now=4.5, window=0.5)
+        self.assertEqual([addr for addr, _ in due], ["early", "late"])
+        self.assertEqual(scheduler.next_deadline(), 9.0)
+
+    def test_sync_adds_and_removes(self):
+        scheduler = self.make_scheduler()
+        scheduler.sync({"a": 1, "b": 2}, now=0.0)
+        scheduler.sync({"b": 2, "c": 3}, now=0.0)
+        self.assertNotIn("a", scheduler)
+        self.assertEqual(len(scheduler), 2)
+        # The stale heap entry of "a" is never returned
+        self.assertEqual(sorted(addr for addr, _ in scheduler.pop_due(now=0.0)), ["b", "c"])
+        self.assertIsNone(scheduler.reschedule("a"))
+
+    def test_adapt_speeds_up_on_change_and_backs_off_when_idle(self):
+        scheduler = self.make_scheduler()
+        scheduler.add("a", now=0.0)
+        self.assertEqual(scheduler.adapt("a", 100.0), 10)
+        self.assertEqual(scheduler.adapt("a", 200.0), 5)
+        self.assertEqual(scheduler.adapt("a", 400.0), 2.5)
+        self.assertEqual(scheduler.adapt("a", 50.0), 2)  # clamped to min_interval
+        self.assertEqual(scheduler.adapt("a", 51.0), 3)  # steady, recovering
+        self.assertEqual(scheduler.adapt("a", 51.0), 4.5)
+        self.assertEqual(scheduler.adapt("a", 51.0), 6.75)
+        self.assertEqual(scheduler.adapt("a", 51.0), 10)
+        self.assertEqual(scheduler.adapt("a", None), 10)
+        for expected in (20, 40, 60, 60):
+            self.assertEqual(scheduler.adapt("a", 0.0), expected)
+
+
+class TestTicker(unittest.IsolatedAsyncioTestCase):
+    async def test_ticks_on_fixed_grid(self):
+        start = time.monotonic()
+        ticks = []
+        async for _ in ticker(0.05):
+            ticks.append(time.monotonic() - start)
+            await asyncio.sleep(0.02)  # work done per tick does not stretch the period
+            if len(ticks) == 5:
+                break
+        self.assertLess(ticks[-1], 0.05 * 4 + 0.04)
+
+
+@patch("kasa_exporter.devices.KP125M.Extractor.update_metrics")
+class TestScrapeDevices(unittest.IsolatedAsyncioTestCase):
+    async def test_scrape_polls_each_device_once_per_interval(self, _update_metrics):
+        devices = {f"10.0.0.{i}": FakeDevice(f"plug{i}") for i in range(5)}
+        collector_registry = CollectorRegistry()
+        exporter = DeviceExporter(FakeDeviceRegistry(devices), collector_registry)
+        exporter.scheduler = PollScheduler(base_interval=0.2, min_interval=0.1, max_interval=1, jitter=0.1)
+
+        task = asyncio.create_task(exporter.scrape_devices())
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertTrue(all(2 <= d.updates <= 3 for d in devices.values()))
+        self.assertIsNotNone(
+            collector_registry.get_sample_value("device_exporter_scheduler_lag_seconds_count")
+        )
+
+    async def test_cycle_completes_once_per_interval_not_per_batch(self, _update_metrics):
+        devices = {f"10.0.0.{i}": FakeDevice(f"plug{i}") for i in range(5)}
+        exporter = DeviceExporter(FakeDeviceRegistry(devices), CollectorRegistry())
+        exporter.scheduler = PollScheduler(base_interval=0.1, min_interval=0.1, max_interval=1, jitter=0.5)
+        exporter.batch_window = 0.005
+        exporter.poll_interval = 0.25
+        batches = []
+        exporter.poll_batch = wraps_async(exporter.poll_batch, batches)
+        with patch.object(exporter.snapshot, "publish") as publish:
+            task = asyncio.create_task(exporter.scrape_devices())
+            await asyncio.sleep(0.6)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        # Right after the first batch, then at 0.25s and 0.5s
+        self.assertEqual(publish.call_count, 3)
+        self.assertGreater(len(batches), publish.call_count)
+
+
+def wraps_async(function, calls):
+    async def wrapper(*args):
+        calls.append(args)
+        return await function(*args)
+    return wrapper
+
+
+if __name__ == "__main__":
+    unittest.main()
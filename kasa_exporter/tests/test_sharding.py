@@ -0,0 +1,111 @@
+from datetime import timedelta
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from prometheus_client import CollectorRegistry
+
+from kasa_exporter.routines.device_registry import DeviceRegistry
+from kasa_exporter.routines.membership import ShardMembership
+from kasa_exporter.tests.fakes import make_device
+
+
+class TestShardMembership(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "members.json")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_heartbeats_expire_and_leave(self):
+        a = ShardMembership("a", self.path)
+        b = ShardMembership("b", self.path)
+        a.heartbeat(now=1000)
+        self.assertEqual(b.heartbeat(now=1010), ["a", "b"])
+        # a stops heartbeating for longer than the member TTL
+        self.assertEqual(b.heartbeat(now=1000 + a.member_ttl + 1), ["b"])
+        a.heartbeat(now=1040)
+        a.leave()
+        self.assertEqual(b.heartbeat(now=1041), ["b"])
+
+    def test_without_a_file_the_instance_is_alone(self):
+        self.assertEqual(ShardMembership("a", "").heartbeat(), ["a"])
+
+
+class TestShardedRegistry(unittest.IsolatedAsyncioTestCase):
+    def make_registry(self, instance_id):
+        collector_registry = CollectorRegistry()
+        registry = DeviceRegistry(collector_registry, ShardMembership(instance_id, ""))
+        registry.discovery_cache.path = None
+        registry.collector_registry = collector_registry
+        return registry
+
+    @patch("kasa_exporter.routines.device_registry.Discover.discover", new_callable=AsyncMock)
+    async def test_instances_split_and_take_over_the_fleet(self, discover):
+        fleet = {f"10.0.0.{i}": make_device(f"plug{i}") for i in range(60)}
+        discover.return_value = fleet
+        shards = {name: self.make_registry(name) for name in ("a", "b", "c")}
+        for registry in shards.values():
+            registry.rebalance(shards)
+            await registry.discover_devices(None, {})
+
+        owned = [set(registry.devices) for registry in shards.values()]
+        self.assertEqual(set().union(*owned), set(fleet))
+        self.assertEqual(sum(map(len, owned)), len(fleet))
+        self.assertTrue(all(owned))
+
+        # c disappears: a and b pick up exactly c's devices, nothing else moves
+        listener = MagicMock()
+        shards["a"].prune_listeners.append(listener)
+        before = {name: set(shards[name].devices) for name in ("a", "b")}
+        for name in ("a", "b"):
+            shards[name].rebalance(["a", "b"])
+        after = {name: set(shards[name].devices) for name in ("a", "b")}
+        self.assertEqual(after["a"] | after["b"], set(fleet))
+        for name in ("a", "b"):
+            self.assertTrue(before[name] <= after[name])
+            self.assertEqual(after[name] - before[name], after[name] & owned[2])
+        listener.assert_not_called()
+
+        # and hands them back when c returns
+        shards["a"].rebalance(["a", "b", "c"])
+        self.assertEqual(set(shards["a"].devices), owned[0])
+        self.assertEqual(listener.call_count, len(after["a"] - owned[0]))
+
+        sample = shards["a"].collector_registry.get_sample_value
+        some_c_device = next(iter(owned[2]))
+        self.assertEqual(
+            sample("device_registry_shard_owner", {"address": some_c_device, "shard": "c"}), 1
+        )
+        self.assertIsNone(
+            sample("device_registry_shard_owner", {"address": some_c_device, "shard": "a"})
+        )
+        self.assertEqual(sample("device_registry_known_devices"), 60)
+        self.assertEqual(sample("device_registry_total_devices"), len(owned[0]))
+
+    @patch("kasa_exporter.routines.device_registry.Discover.discover", new_callable=AsyncMock)
+    async def test_devices_of_other_shards_are_pruned_when_gone(self, discover):
+        fleet = {f"10.0.0.{i}": make_device(f"plug{i}") for i in range(20)}
+        discover.return_value = fleet
+        registry = self.make_registry("a")
+        registry.rebalance(["a", "b"])
+        await registry.discover_devices(None, {})
+        theirs = set(fleet) - set(registry.devices)
+        self.assertTrue(theirs)
+
+        # Every device stopped answering broadcasts, ours are still polled
+        for addr in fleet:
+            registry.last_seen[addr] -= timedelta(seconds=2 * registry.discovery_interval + 1)
+        self.assertEqual(set(registry.prune_stale()), theirs)
+        self.assertEqual(set(registry.known), set(registry.devices))
+        self.assertEqual(set(registry.owners), set(registry.devices))
+        sample = registry.collector_registry.get_sample_value
+        some_addr = next(iter(theirs))
+        self.assertIsNone(sample("device_registry_shard_owner", {"address": some_addr, "shard": "b"}))
+        self.assertEqual(sample("device_registry_known_devices"), len(registry.devices))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import asyncio
+import gzip
+import os
+import subprocess
+import sys
+import unittest
+
+from prometheus_client import CollectorRegistry, Gauge
+
+from benchmarks import bench_startup
+from kasa_exporter.routines.snapshot import SnapshotCollector
+from kasa_exporter.slim import SlimServer
+
+
+async def request(reader, writer, path, method="GET", headers=None):
+    lines = [f"{method} {path} HTTP/1.1", "Host: localhost"]
+    lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode()
+    status_line, *header_lines = head.strip().split("\r\n")
+    response_headers = dict(line.split(": ", 1) for line in header_lines)
+    length = int(response_headers["Content-Length"])
+    body = await reader.readexactly(length) if method != "HEAD" else b""
+    return int(status_line.split()[1]), response_headers, body
+
+
+class TestSlimServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = SlimServer(host="127.0.0.1", port=0)
+        await self.server.start()
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+
+    async def asyncTearDown(self):
+        self.writer.close()
+        await self.server.close()
+
+    async def test_health_before_the_device_stack_is_loaded(self):
+        status, _, body = await request(self.reader, self.writer, "/healthz")
+        self.assertEqual((status, body), (200, b"ok\n"))
+        status, _, _ = await request(self.reader, self.writer, "/readyz")
+        self.assertEqual(status, 503)
+        status, _, body = await request(self.reader, self.writer, "/metrics")
+        self.assertEqual((status, body), (200, b""))
+        self.server.ready = True
+        status, _, _ = await request(self.reader, self.writer, "/readyz")
+        self.assertEqual(status, 200)
+
+    async def test_metrics_snapshot(self):
+        registry = CollectorRegistry()
+        Gauge("kasa_up", "Up", registry=registry).set(1)
+        self.server.snapshot = SnapshotCollector(registry, compress=True)
+        self.server.snapshot.publish()
+
+        # Every request below goes over the same kept-alive connection
+        status, headers, body = await request(self.reader, self.writer, "/metrics")
+        self.assertEqual(status, 200)
+        self.assertIn(b"kasa_up 1.0", body)
+        self.assertTrue(headers["Content-Type"].startswith("text/plain"))
+        etag = headers["ETag"]
+
+        status, headers, zipped = await request(
+            self.reader, self.writer, "/metrics", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(zipped), body)
+
+        status, _, body = await request(
+            self.reader, self.writer, "/metrics", headers={"If-None-Match": etag}
+        )
+        self.assertEqual((status, body), (304, b""))
+
+        status, headers, _ = await request(self.reader, self.writer, "/metrics?x=1", method="HEAD")
+        self.assertEqual(status, 200)
+        self.assertGreater(int(headers["Content-Length"]), 0)
+
+    async def test_unknown_requests(self):
+        status, _, _ = await request(self.reader, self.writer, "/probe")
+        self.assertEqual(status, 404)
+        status, headers, _ = await request(self.reader, self.writer, "/metrics", method="POST")
+        self.assertEqual(status, 405)
+        self.assertEqual(headers["Connection"], "close")
+        self.assertEqual(await self.reader.read(), b"")
+
+    async def test_request_with_body_closes_the_connection(self):
+        for body_headers in ({"Content-Length": "20"}, {"Transfer-Encoding": "chunked"}):
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.server.port)
+            self.addCleanup(writer.close)
+            status, headers, _ = await request(reader, writer, "/healthz", headers=body_headers)
+            self.assertEqual(status, 200)
+            self.assertEqual(headers["Connection"], "close")
+            # The unread body is never taken for another request
+            writer.write(b"GET /metrics HTTP/1.1")
+            self.assertEqual(await reader.read(), b"")
+
+
+class TestStartupBudget(unittest.TestCase):
+    def test_imports_no_web_framework_or_device_stack(self):
+        code = (
+            "import sys, kasa_exporter.slim; "
+            "print(' '.join(m for m in ('fastapi', 'pydantic', 'uvicorn', 'kasa', 'aiohttp') "
+            "if m in sys.modules))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout
+        self.assertEqual(output.strip(), "")
+
+    @unittest.skipUnless(os.path.exists("/proc/self/status"), "reads RSS from /proc")
+    def test_slim_within_budget(self):
+        module = "kasa_exporter.slim"
+        result = bench_startup.measure(module, runs=1)
+        self.assertEqual(bench_startup.over_budget(module, result), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
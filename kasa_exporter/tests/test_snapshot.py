@@ -0,0 +1,73 @@
+import gzip
+import unittest
+
+from fastapi.testclient import TestClient
+from prometheus_client import CollectorRegistry, Gauge
+
+from kasa_exporter.routines.snapshot import SnapshotCollector
+
+
+class TestSnapshotCollector(unittest.TestCase):
+    def setUp(self):
+        self.registry = CollectorRegistry()
+        self.gauge = Gauge("power", "power", ["device_id"], registry=self.registry)
+        self.snapshot = SnapshotCollector(self.registry, compress=True)
+
+    def test_serves_values_as_of_last_publish(self):
+        self.gauge.labels(device_id="a").set(1)
+        content, _, _ = self.snapshot.publish()
+        self.assertIn(b'power{device_id="a"} 1.0', content)
+
+        # Mid-cycle writes stay invisible until the cycle publishes
+        self.gauge.labels(device_id="a").set(2)
+        self.gauge.labels(device_id="b").set(3)
+        self.assertEqual(self.snapshot.rendered[0], content)
+        self.assertNotIn(b'device_id="b"', content)
+
+        content, _, _ = self.snapshot.publish()
+        self.assertIn(b'power{device_id="a"} 2.0', content)
+        self.assertIn(b'power{device_id="b"} 3.0', content)
+        self.assertEqual(self.snapshot.generation, 2)
+
+    def test_gzip_and_etag(self):
+        self.gauge.labels(device_id="a").set(1)
+        content, gzipped, etag = self.snapshot.publish()
+        self.assertEqual(gzip.decompress(gzipped), content)
+
+        # Identical content keeps its ETag, a change produces a new one
+        self.assertEqual(self.snapshot.publish()[2], etag)
+        self.gauge.labels(device_id="a").set(5)
+        self.assertNotEqual(self.snapshot.publish()[2], etag)
+
+    def test_compression_can_be_disabled(self):
+        snapshot = SnapshotCollector(self.registry, compress=False)
+        self.assertIsNone(snapshot.publish()[1])
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def setUp(self):
+        from kasa_exporter import main
+
+        # No lifespan: nothing is polled, only the cached exposition is served
+        self.client = TestClient(main.app)
+        main.device_exporter.snapshot.publish()
+
+    def test_metrics_served_from_snapshot(self):
+        response = self.client.get("/metrics", headers={"Accept-Encoding": "identity"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"device_registry_total_devices", response.content)
+        self.assertNotIn("content-encoding", response.headers)
+
+    def test_gzip_and_conditional_requests(self):
+        response = self.client.get("/metrics", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertIn(b"device_registry_total_devices", response.content)
+
+        etag = response.headers["etag"]
+        response = self.client.get("/metrics", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import os
+import time
+import unittest
+from unittest.mock import patch
+
+from prometheus_client import CollectorRegistry
+from prometheus_client.metrics_core import GaugeMetricFamily
+
+from kasa_exporter.routines.device_registry import DeviceRegistry
+from kasa_exporter.routines.discovery_cache import DiscoveryCache
+from kasa_exporter.routines.exporter import DeviceExporter
+from kasa_exporter.routines.snapshot import merge_families
+from kasa_exporter.routines.workers import WorkerPool
+from kasa_exporter.tests.fakes import KLAP_PLUG, FakePlug
+
+
+def make_fake_plug(entry, credentials=None):
+    """Device factory used inside the worker processes."""
+    return FakePlug(entry["host"])
+
+
+class TestMergeFamilies(unittest.TestCase):
+    def test_same_name_families_are_combined(self):
+        a = GaugeMetricFamily("power", "power", labels=["device"])
+        a.add_metric(["a"], 1)
+        b = GaugeMetricFamily("power", "power", labels=["device"])
+        b.add_metric(["b"], 2)
+        (merged,) = merge_families([a, b])
+        self.assertEqual([s.labels["device"] for s in merged.samples], ["a", "b"])
+
+
+class TestWorkerReports(unittest.TestCase):
+    def test_reports_within_an_interval_share_one_publish(self):
+        collector_registry = CollectorRegistry()
+        registry = DeviceRegistry(collector_registry)
+        registry.discovery_cache.path = None
+        exporter = DeviceExporter(registry, collector_registry)
+        pool = WorkerPool(registry, exporter, workers=4)
+        pool.report_interval = 1.0
+        with patch.object(exporter.snapshot, "publish") as publish:
+            for worker in "0123":
+                pool.handle_report(worker, [], {}, 1)
+            self.assertFalse(publish.called)
+            self.assertTrue(pool.publish_due(now=100.0))
+            pool.handle_report("0", [], {}, 1)
+            self.assertFalse(pool.publish_due(now=100.5))
+            self.assertTrue(pool.publish_due(now=101.0))
+            self.assertFalse(pool.publish_due(now=105.0))
+        self.assertEqual(publish.call_count, 2)
+        self.assertEqual(
+            collector_registry.get_sample_value("device_worker_polls_total", {"worker": "0"}), 2
+        )
+
+
+class TestWorkerPool(unittest.IsolatedAsyncioTestCase):
+    async def test_workers_poll_their_slices_into_one_snapshot(self):
+        environ = {
+            "KASA_WORKER_DEVICE_FACTORY": f"{__name__}:make_fake_plug",
+            "KASA_POLL_INTERVAL": "0.2",
+        }
+        with patch.dict(os.environ, environ):
+            collector_registry = CollectorRegistry()
+            registry = DeviceRegistry(collector_registry)
+            registry.discovery_cache.path = None
+            registry.devices = {
+                f"10.0.0.{i}": DiscoveryCache.build_device(
+                    {"host": f"10.0.0.{i}", "connection_type": KLAP_PLUG.to_dict()}
+                )
+                for i in range(6)
+            }
+            exporter = DeviceExporter(registry, collector_registry)
+            pool = WorkerPool(registry, exporter, workers=2)
+            pool.report_interval = 0
+            pool.start()
+            task = asyncio.create_task(pool.run())
+            try:
+                deadline = time.monotonic() + 30
+                while time.monotonic() < deadline:
+                    content = exporter.snapshot.rendered[0].decode()
+                    if all(f'alias="10.0.0.{i}"' in content for i in range(6)):
+                        break
+                    await asyncio.sleep(0.1)
+            finally:
+                task.cancel()
+                pool.stop()
+
+        self.assertEqual(set(pool.families), {"0", "1"})
+        self.assertEqual(sum(len(devices) for devices in pool.assigned.values()), 6)
+        for i in range(6):
+            self.assertIn(f'current_consumption{{alias="10.0.0.{i}"', content)
+        # Exporter-internal metrics are told apart by a worker label, device metrics are not
+        self.assertIn('device_exporter_last_cycle_polled_devices{worker="0"}', content)
+        self.assertNotIn('current_consumption{alias="10.0.0.0",device_id="id-10.0.0.0",model="KP125M",worker', content)
+        self.assertEqual(content.count("# TYPE current_consumption gauge"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+from bisect import bisect_right
+import hashlib
+
+
+def ring_hash(key: str) -> int:
+    # Stable across processes and hosts, unlike hash()
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes.
+
+    Every node is placed on the ring `vnodes` times. A key belongs to the
+    first node clockwise from its hash, so adding or removing one of N nodes
+    only moves about 1/N of the keys, and the virtual nodes keep the share of
+    each node close to even.
+    """
+
+    def __init__(self, nodes=(), vnodes: int = 64):
+        self.vnodes = vnodes
+        self.nodes = tuple(sorted(set(nodes)))
+        points = sorted(
+            (ring_hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def owner(self, key: str):
+        if not self._hashes:
+            return None
+        index = bisect_right(self._hashes, ring_hash(key))
+        return self._owners[index % len(self._owners)]
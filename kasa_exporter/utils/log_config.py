@@ -0,0 +1,24 @@
+"""Logging setup for the exporter processes.
+
+Modules only call structlog.get_logger(), the process entry points (main,
+slim, worker processes) call configure_logging() once before logging
+anything. KASA_LOG_LEVEL picks the level (INFO by default).
+"""
+import logging
+import os
+
+import structlog
+
+
+def configure_logging(level: str = None) -> None:
+    """JSON lines with an ISO UTC timestamp, filtered by level."""
+    level = (level or os.getenv("KASA_LOG_LEVEL", "INFO")).upper()
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(
+            logging.getLevelNamesMapping().get(level, logging.INFO)
+        ),
+        processors=[
+            structlog.processors.TimeStamper(fmt="iso", utc=True),
+            structlog.processors.JSONRenderer(),
+        ],
+    )
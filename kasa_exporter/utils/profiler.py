@@ -0,0 +1,43 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(duration: float, rate: int = 100) -> str:
+    """Sample the stacks of every other thread for `duration` seconds.
+
+    Returns the profile in the folded format of flamegraph.pl (one
+    `thread;outer;...;inner count` line per distinct stack), which speedscope
+    and inferno read as well. Blocks the calling thread, run it off the event
+    loop: the loop thread is sampled like any other.
+    """
+    interval = 1.0 / rate
+    counts = collections.Counter()
+    me = threading.get_ident()
+    names = {}
+    deadline = time.monotonic() + duration
+    next_sample = time.monotonic()
+    while next_sample < deadline:
+        frames = sys._current_frames()
+        if frames.keys() - names.keys():
+            names.update((thread.ident, thread.name) for thread in threading.enumerate())
+        for ident, frame in frames.items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}"))
+            counts[";".join(reversed(stack))] += 1
+        del frames, frame
+        next_sample += interval
+        time.sleep(max(0.0, next_sample - time.monotonic()))
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
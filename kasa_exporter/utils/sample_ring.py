@@ -0,0 +1,329 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from prometheus_client.metrics_core import Metric
+from prometheus_client.openmetrics.exposition import generate_latest
+
+RING_MAGIC = b"KASARING"
+RING_VERSION = 1
+# magic, version, record size, capacity, records written since creation
+HEADER = struct.Struct("<8sIIQQ")
+HEADER_SIZE = 64
+# timestamp (unix seconds), series id, value
+RECORD = struct.Struct("<dId")
+
+# Labels that split one OpenMetrics MetricPoint into several samples
+POINT_LABELS = ("le", "quantile")
+
+
+class SampleRing:
+    """Fixed-size, memory-mapped buffer of timestamped samples.
+
+    Every record is 20 bytes (timestamp, series id, value) written in place
+    at `written % capacity`, so disk usage and memory are bounded by
+    KASA_SAMPLE_RING_RECORDS no matter how long downstream is unreachable;
+    the oldest samples are overwritten first. Series (sample name, labels and
+    the family they belong to) are stored once in a JSON-lines side table
+    next to the ring and referenced by id. Every time the ring wraps, series
+    no record refers to any more (renamed devices, past rate classes) are
+    dropped and the side table is rewritten, so it never holds more than
+    twice KASA_SAMPLE_RING_RECORDS series however much labels churn.
+
+    Any time window can be written out as an OpenMetrics file for
+    `promtool tsdb create-blocks-from openmetrics`. A readonly ring takes its
+    capacity from the file and never recreates it, so the ring of a running
+    exporter can be exported from another process.
+    """
+
+    def __init__(self, path=None, capacity=None, readonly=False):
+        if path is None:
+            path = os.getenv(
+                "KASA_SAMPLE_RING",
+                os.path.expanduser("~/.cache/kasa-exporter/samples.ring"),
+            )
+        # An empty path disables the ring
+        self.path = path or None
+        self.capacity = capacity or int(os.getenv("KASA_SAMPLE_RING_RECORDS", 1_000_000))
+        self.readonly = readonly
+        self.written = 0
+        self.series = {}  # (sample name, sorted labels) -> series id
+        self.series_info = {}  # series id -> side table entry
+        self._next_id = 0
+        self._file = None
+        self._map = None
+        self._series_file = None
+        # A backfill thread may open the ring before the first record() does
+        self._open_lock = threading.Lock()
+
+    @property
+    def series_path(self):
+        return self.path + ".series"
+
+    def open(self):
+        if self._map is not None or self.path is None:
+            return
+        with self._open_lock:
+            if self._map is None:
+                self._open()
+
+    def _open(self):
+        if self.readonly:
+            self._open_readonly()
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        size = HEADER_SIZE + self.capacity * RECORD.size
+        fresh = not self._valid_header(size)
+        self._file = open(self.path, "w+b" if fresh else "r+b")
+        if fresh:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        if fresh:
+            self.written = 0
+            self._write_header()
+            # Ids in an old side table refer to records that are gone
+            open(self.series_path, "w").close()
+        else:
+            self.written = HEADER.unpack_from(self._map)[4]
+        self._load_series()
+        self._series_file = open(self.series_path, "a")
+
+    def _open_readonly(self):
+        try:
+            self._file = open(self.path, "rb")
+            magic, version, record_size, capacity, _ = HEADER.unpack(self._file.read(HEADER.size))
+        except (OSError, struct.error):
+            magic = version = record_size = None
+        if (magic, version, record_size) != (RING_MAGIC, RING_VERSION, RECORD.size):
+            # Nothing (valid) recorded yet, behave like an empty ring
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+            self.path = None
+            return
+        self.capacity = capacity
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._load_series()
+
+    def _valid_header(self, size) -> bool:
+        try:
+            with open(self.path, "rb") as f:
+                magic, version, record_size, capacity, _ = HEADER.unpack(f.read(HEADER.size))
+            return (
+                (magic, version, record_size, capacity)
+                == (RING_MAGIC, RING_VERSION, RECORD.size, self.capacity)
+                and os.path.getsize(self.path) == size
+            )
+        except (OSError, struct.error):
+            return False
+
+    def _write_header(self):
+        HEADER.pack_into(
+            self._map, 0, RING_MAGIC, RING_VERSION, RECORD.size, self.capacity, self.written
+        )
+
+    def _load_series(self):
+        self.series, self.series_info = {}, {}
+        try:
+            with open(self.series_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn write, the series is re-registered under a new id
+                    self.series[(entry["name"], tuple(sorted(entry["labels"].items())))] = entry["id"]
+                    self.series_info[entry["id"]] = entry
+        except FileNotFoundError:
+            pass
+        self._next_id = max(self.series_info, default=-1) + 1
+
+    def _series_id(self, family, sample) -> int:
+        key = (sample.name, tuple(sorted(sample.labels.items())))
+        series_id = self.series.get(key)
+        if series_id is None:
+            series_id = self.series[key] = self._next_id
+            self._next_id += 1
+            entry = {
+                "id": series_id,
+                "name": sample.name,
+                "labels": sample.labels,
+                "family": family.name,
+                "type": family.type,
+                "help": family.documentation,
+            }
+            self.series_info[series_id] = entry
+            self._series_file.write(json.dumps(entry) + "\n")
+        return series_id
+
+    def record(self, families, timestamp=None, include=None, keep=None) -> int:
+        """Append the samples of the given metric families, returns the record count.
+
+        `include` optionally restricts recording to a set of family names and
+        `keep` to the samples it returns True for. Samples that carry no
+        information for a backfill (_created) are skipped.
+        """
+        if self.path is None or self.readonly:
+            return 0
+        self.open()
+        timestamp = time.time() if timestamp is None else timestamp
+        wraps = self.written // self.capacity
+        count = 0
+        for family in families:
+            if include is not None and family.name not in include:
+                continue
+            for sample in family.samples:
+                if sample.name.endswith("_created") or (keep is not None and not keep(sample)):
+                    continue
+                offset = HEADER_SIZE + (self.written % self.capacity) * RECORD.size
+                RECORD.pack_into(
+                    self._map, offset, timestamp, self._series_id(family, sample), sample.value
+                )
+                self.written += 1
+                count += 1
+        self._series_file.flush()
+        self._write_header()
+        if self.written // self.capacity > wraps:
+            self.compact_series()
+        return count
+
+    def _live_series(self) -> set:
+        stored = min(self.written, self.capacity)
+        view = memoryview(self._map)
+        records = view[HEADER_SIZE : HEADER_SIZE + stored * RECORD.size]
+        try:
+            return {series_id for _, series_id, _ in RECORD.iter_unpack(records)}
+        finally:
+            records.release()
+            view.release()
+
+    def compact_series(self) -> int:
+        """Forget the series no buffered record refers to, returns how many."""
+        live = self._live_series()
+        dropped = [series_id for series_id in self.series_info if series_id not in live]
+        if not dropped:
+            return 0
+        for series_id in dropped:
+            entry = self.series_info.pop(series_id)
+            self.series.pop((entry["name"], tuple(sorted(entry["labels"].items()))), None)
+        # Readers load the side table whole, replace it in one step
+        compacted = self.series_path + ".tmp"
+        with open(compacted, "w") as f:
+            for entry in self.series_info.values():
+                f.write(json.dumps(entry) + "\n")
+        self._series_file.close()
+        os.replace(compacted, self.series_path)
+        self._series_file = open(self.series_path, "a")
+        return len(dropped)
+
+    def samples(self, start=None, end=None):
+        """Yield (timestamp, series id, value) oldest first, optionally within [start, end]."""
+        if self.path is None:
+            return
+        self.open()
+        if self._map is None:
+            return
+        if self.readonly:
+            # Re-read the write position, another process may be appending
+            written = HEADER.unpack_from(self._map)[4]
+            self._load_series()
+        else:
+            # Exports run in a worker thread, record() alone moves the writer's position
+            written = self.written
+        first = max(0, written - self.capacity)
+        begin = first % self.capacity
+        stored = written - first
+        # Oldest records sit after the write position once the ring wrapped
+        segments = [(begin, min(stored, self.capacity - begin))]
+        if begin + stored > self.capacity:
+            segments.append((0, begin + stored - self.capacity))
+        view = memoryview(self._map)
+        try:
+            for index, length in segments:
+                offset = HEADER_SIZE + index * RECORD.size
+                for record in RECORD.iter_unpack(view[offset : offset + length * RECORD.size]):
+                    if (start is None or record[0] >= start) and (end is None or record[0] <= end):
+                        yield record
+        finally:
+            view.release()
+
+    def families(self, start=None, end=None):
+        """Rebuild metric families with timestamped samples for a time window."""
+        points = {}
+        entries = {}
+        for timestamp, series_id, value in self.samples(start, end):
+            entry = self.series_info.get(series_id)
+            if entry is None:
+                continue  # side table entry lost to a torn write
+            entries.setdefault(entry["family"], entry)
+            labels = entry["labels"]
+            # Samples of one MetricPoint (histogram buckets, stateset states) stay together
+            family_labels = tuple(
+                sorted(
+                    (k, v)
+                    for k, v in labels.items()
+                    if k not in POINT_LABELS and k != entry["family"]
+                )
+            )
+            points.setdefault(entry["family"], {}).setdefault(family_labels, []).append(
+                (timestamp, entry["name"], labels, value)
+            )
+
+        families = []
+        for name, metrics in points.items():
+            entry = entries[name]
+            family = Metric(name, entry["help"], entry["type"])
+            for samples in metrics.values():
+                # Stable sort keeps the recorded order of samples within one point
+                samples.sort(key=lambda sample: sample[0])
+                for timestamp, sample_name, labels, value in samples:
+                    family.add_sample(sample_name, labels, value, timestamp=timestamp)
+            families.append(family)
+        return families
+
+    def export_openmetrics(self, start=None, end=None) -> bytes:
+        """OpenMetrics text (terminated by # EOF) of the samples within [start, end]."""
+        families = self.families(start, end)
+
+        class Window:
+            @staticmethod
+            def collect():
+                return families
+
+        return generate_latest(Window)
+
+    def close(self):
+        if self._map is not None:
+            if not self.readonly:
+                self._map.flush()
+                self._series_file.close()
+            self._map.close()
+            self._file.close()
+            self._map = self._file = self._series_file = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export samples buffered by the exporter as OpenMetrics for promtool backfill"
+    )
+    parser.add_argument("path", nargs="?", help="ring file (default KASA_SAMPLE_RING)")
+    parser.add_argument("--start", type=float, help="unix timestamp, default oldest sample")
+    parser.add_argument("--end", type=float, help="unix timestamp, default newest sample")
+    parser.add_argument("-o", "--output", help="output file (default stdout)")
+    args = parser.parse_args(argv)
+
+    ring = SampleRing(args.path, readonly=True)
+    content = ring.export_openmetrics(args.start, args.end)
+    ring.close()
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(content)
+    else:
+        sys.stdout.buffer.write(content)
+
+
+if __name__ == "__main__":
+    main()
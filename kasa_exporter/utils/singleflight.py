@@ -0,0 +1,43 @@
+import asyncio
+import time
+from functools import partial
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into a single call.
+
+    The first caller for a key starts `fn()`, callers arriving while it runs
+    await the same result. A successful result is kept for `ttl` seconds and
+    returned without calling `fn` again. A caller being cancelled (e.g. its
+    HTTP request was dropped) does not cancel the shared call.
+    """
+
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self._flights = {}
+        self._results = {}  # key -> (expires at, result)
+
+    async def do(self, key, fn):
+        cached = self._results.get(key)
+        if cached is not None:
+            if cached[0] > time.monotonic():
+                return cached[1]
+            del self._results[key]
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = asyncio.ensure_future(fn())
+            flight.add_done_callback(partial(self._landed, key))
+        return await asyncio.shield(flight)
+
+    def in_flight(self, key) -> bool:
+        return key in self._flights
+
+    def forget(self, key):
+        self._results.pop(key, None)
+
+    def _landed(self, key, flight):
+        self._flights.pop(key, None)
+        if flight.cancelled() or flight.exception() is not None:
+            return
+        if self.ttl:
+            self._results[key] = (time.monotonic() + self.ttl, flight.result())
@@ -0,0 +1,40 @@
+import unittest
+from collections import Counter
+
+from kasa_exporter.utils.hash_ring import HashRing
+
+
+class TestHashRing(unittest.TestCase):
+    keys = [f"10.0.{i // 250}.{i % 250}" for i in range(2000)]
+
+    def owners(self, ring):
+        return {key: ring.owner(key) for key in self.keys}
+
+    def test_owner_is_deterministic(self):
+        self.assertEqual(
+            self.owners(HashRing(["a", "b", "c"])), self.owners(HashRing(["c", "a", "b", "a"]))
+        )
+        self.assertIsNone(HashRing().owner("10.0.0.1"))
+
+    def test_keys_are_spread_evenly(self):
+        shares = Counter(self.owners(HashRing(["a", "b", "c", "d"], vnodes=128)).values())
+        for share in shares.values():
+            self.assertLess(abs(share - 500), 150)
+
+    def test_removing_a_node_only_moves_its_keys(self):
+        before = self.owners(HashRing(["a", "b", "c", "d"]))
+        after = self.owners(HashRing(["a", "b", "c"]))
+        moved = [key for key in self.keys if before[key] != after[key]]
+        self.assertTrue(all(before[key] == "d" for key in moved))
+        self.assertEqual(len(moved), list(before.values()).count("d"))
+
+    def test_adding_a_node_moves_about_one_share(self):
+        before = self.owners(HashRing(["a", "b", "c"]))
+        after = self.owners(HashRing(["a", "b", "c", "d"]))
+        moved = [key for key in self.keys if before[key] != after[key]]
+        self.assertTrue(all(after[key] == "d" for key in moved))
+        self.assertLess(len(moved), len(self.keys) / 4 * 1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
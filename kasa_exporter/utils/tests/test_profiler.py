@@ -0,0 +1,41 @@
+import threading
+import time
+import unittest
+
+from kasa_exporter.utils.profiler import sample_stacks
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestSampleStacks(unittest.TestCase):
+    def test_folded_stacks_of_other_threads(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=spin, args=(stop,), name="spinner")
+        thread.start()
+        try:
+            profile = sample_stacks(0.2, rate=200)
+        finally:
+            stop.set()
+            thread.join()
+
+        lines = profile.splitlines()
+        spinner = [line for line in lines if line.startswith("spinner;")]
+        self.assertTrue(spinner)
+        stack, count = spinner[0].rsplit(" ", 1)
+        # Root first, the sampled function last
+        self.assertTrue(stack.endswith("spin (test_profiler.py:8)"))
+        self.assertGreater(int(count), 10)
+        # The sampling thread does not profile itself
+        self.assertFalse(any("sample_stacks" in line for line in lines))
+
+    def test_duration(self):
+        start = time.monotonic()
+        sample_stacks(0.1, rate=50)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
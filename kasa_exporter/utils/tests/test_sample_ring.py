@@ -0,0 +1,156 @@
+import os
+import tempfile
+import threading
+import unittest
+from types import SimpleNamespace
+
+from prometheus_client import CollectorRegistry, Counter, Enum, Gauge, Histogram
+from prometheus_client.openmetrics.parser import text_string_to_metric_families
+
+from kasa_exporter.utils.sample_ring import HEADER_SIZE, RECORD, SampleRing
+
+
+class TestSampleRing(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "samples.ring")
+        self.registry = CollectorRegistry()
+        self.power = Gauge("current_consumption", "power", ["device_id"], registry=self.registry)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def record_cycles(self, ring, count, start=1000.0):
+        for cycle in range(count):
+            self.power.labels(device_id="a").set(cycle)
+            ring.record(self.registry.collect(), timestamp=start + cycle * 10)
+
+    def test_window_round_trip(self):
+        ring = SampleRing(self.path, capacity=100)
+        self.record_cycles(ring, 5)
+        self.assertEqual(
+            [(ts, value) for ts, _, value in ring.samples(1010, 1030)],
+            [(1010.0, 1.0), (1020.0, 2.0), (1030.0, 3.0)],
+        )
+
+    def test_bounded_size_keeps_newest_samples(self):
+        ring = SampleRing(self.path, capacity=8)
+        self.record_cycles(ring, 20)
+        self.assertEqual(os.path.getsize(self.path), HEADER_SIZE + 8 * RECORD.size)
+        self.assertEqual([value for _, _, value in ring.samples()], list(map(float, range(12, 20))))
+
+    def test_series_no_longer_buffered_are_dropped_on_wrap(self):
+        ring = SampleRing(self.path, capacity=8)
+        for cycle in range(20):
+            # A device renamed every cycle leaves a new series behind each time
+            self.power.clear()
+            self.power.labels(device_id=f"plug{cycle}").set(cycle)
+            ring.record(self.registry.collect(), timestamp=1000.0 + cycle)
+        # The buffered series plus those added since the last wrap
+        self.assertEqual(len(ring.series), 12)
+        with open(ring.series_path) as f:
+            self.assertEqual(len(f.readlines()), len(ring.series))
+        content = ring.export_openmetrics().decode()
+        self.assertIn('device_id="plug19"', content)
+        self.assertNotIn('device_id="plug0"', content)
+
+        # Series of the buffered samples keep their ids across a reopen
+        ring.close()
+        reader = SampleRing(self.path, readonly=True)
+        self.assertEqual(len(list(reader.families())[0].samples), 8)
+
+    def test_export_while_recording_loses_nothing(self):
+        ring = SampleRing(self.path, capacity=200_000)
+        family = SimpleNamespace(
+            name="current_consumption",
+            type="gauge",
+            documentation="power",
+            samples=[
+                SimpleNamespace(name="current_consumption", labels={"device_id": str(i)}, value=i)
+                for i in range(5000)
+            ],
+        )
+        ring.record([family], timestamp=1000.0)
+        done = threading.Event()
+
+        def export():
+            # Like /backfill, which reads the ring of the running exporter in a thread
+            while not done.is_set():
+                for _ in ring.samples():
+                    pass
+
+        reader = threading.Thread(target=export)
+        reader.start()
+        try:
+            for cycle in range(1, 40):
+                ring.record([family], timestamp=1000.0 + cycle)
+        finally:
+            done.set()
+            reader.join()
+        self.assertEqual(ring.written, 200_000)
+        timestamps = [ts for ts, _, _ in ring.samples()]
+        self.assertEqual(len(timestamps), 200_000)
+        self.assertEqual(timestamps.count(1039.0), 5000)
+
+    def test_reopen_and_readonly_reader(self):
+        ring = SampleRing(self.path, capacity=16)
+        self.record_cycles(ring, 3)
+        ring.close()
+
+        ring = SampleRing(self.path, capacity=16)
+        self.record_cycles(ring, 2, start=2000.0)
+        # A reader in another process sees what the writer has appended so far
+        reader = SampleRing(self.path, capacity=1, readonly=True)
+        self.assertEqual(len(list(reader.samples())), 5)
+        self.assertEqual(reader.capacity, 16)
+        self.assertEqual(reader.record(self.registry.collect()), 0)
+
+        # A different capacity starts a fresh ring
+        ring.close()
+        ring = SampleRing(self.path, capacity=32)
+        self.assertEqual(list(ring.samples()), [])
+
+    def test_openmetrics_export_parses_and_groups_points(self):
+        Counter("update_attempts", "attempts", ["device_id"], registry=self.registry).labels(
+            device_id="a"
+        ).inc()
+        Enum("led", "led", ["device_id"], states=["on", "off"], registry=self.registry).labels(
+            device_id="a"
+        ).state("on")
+        self.latency = Histogram("latency", "latency", buckets=(1, 2), registry=self.registry)
+        self.latency.observe(1.5)
+        ring = SampleRing(self.path, capacity=1000)
+        self.record_cycles(ring, 3)
+
+        content = ring.export_openmetrics(1000, 1010).decode()
+        self.assertTrue(content.endswith("# EOF\n"))
+        self.assertNotIn("_created", content)
+        # Buckets, count and sum of one timestamp are emitted together
+        latency = [line.split(" ")[0] for line in content.splitlines() if line.startswith("latency")]
+        self.assertEqual(
+            latency,
+            ['latency_bucket{le="1.0"}', 'latency_bucket{le="2.0"}', 'latency_bucket{le="+Inf"}',
+             "latency_count", "latency_sum"] * 2,
+        )
+
+        # prometheus_client's parser only accepts one point per histogram series,
+        # validate the other families with it
+        ring = SampleRing(os.path.join(self.tmp.name, "other.ring"), capacity=1000)
+        self.registry.unregister(self.latency)
+        self.record_cycles(ring, 3)
+        content = ring.export_openmetrics(1000, 1010).decode()
+        families = {f.name: f for f in text_string_to_metric_families(content)}
+        self.assertEqual(set(families), {"current_consumption", "update_attempts", "led"})
+        self.assertEqual(families["update_attempts"].type, "counter")
+        self.assertEqual(families["led"].type, "stateset")
+        power = [(s.timestamp, s.value) for s in families["current_consumption"].samples]
+        self.assertEqual([(float(ts), value) for ts, value in power], [(1000.0, 0.0), (1010.0, 1.0)])
+
+    def test_disabled_ring(self):
+        ring = SampleRing("")
+        self.assertEqual(ring.record(self.registry.collect()), 0)
+        self.assertEqual(ring.export_openmetrics(), b"# EOF\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
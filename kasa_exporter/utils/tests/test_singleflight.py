@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+
+from kasa_exporter.utils.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_flight(self):
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return calls
+
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do("a", fetch) for _ in range(10)))
+        self.assertEqual(results, [1] * 10)
+        # Without a ttl the next call polls again
+        self.assertEqual(await flights.do("a", fetch), 2)
+
+    async def test_results_are_cached_for_ttl(self):
+        calls = []
+
+        async def fetch():
+            calls.append(None)
+            return len(calls)
+
+        flights = SingleFlight(ttl=0.1)
+        self.assertEqual(await flights.do("a", fetch), 1)
+        self.assertEqual(await flights.do("a", fetch), 1)
+        self.assertEqual(await flights.do("b", fetch), 2)
+        await asyncio.sleep(0.15)
+        self.assertEqual(await flights.do("a", fetch), 3)
+
+    async def test_failures_are_shared_but_not_cached(self):
+        calls = 0
+
+        async def fail():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise ConnectionError("unreachable")
+
+        flights = SingleFlight(ttl=10)
+        results = await asyncio.gather(
+            flights.do("a", fail), flights.do("a", fail), return_exceptions=True
+        )
+        self.assertTrue(all(isinstance(r, ConnectionError) for r in results))
+        self.assertEqual(calls, 1)
+        with self.assertRaises(ConnectionError):
+            await flights.do("a", fail)
+        self.assertEqual(calls, 2)
+
+    async def test_cancelled_caller_does_not_cancel_the_flight(self):
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "done"
+
+        flights = SingleFlight()
+        first = asyncio.create_task(flights.do("a", fetch))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(flights.do("a", fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        self.assertEqual(await second, "done")
+
+
+if __name__ == "__main__":
+    unittest.main()
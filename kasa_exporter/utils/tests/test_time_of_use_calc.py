@@ -1,6 +1,7 @@
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import patch
+import numpy as np
 import pytz
 
 from kasa_exporter.utils.time_of_use_calc import TimeOfUseCalc
@@ -104,5 +105,76 @@ class TestTimeOfUseCalc(unittest.TestCase):
         self.assertAlmostEqual(cost, 0.22, places=6)
 
 
+class TestCompiledTariffTables(unittest.TestCase):
+    def setUp(self):
+        self.calculator = TimeOfUseCalc(TIME_OF_USE_CONFIG)
+        self.denver = pytz.timezone("America/Denver")
+
+    def reference_rate(self, timestamp):
+        """Evaluate the config ranges as strings, the way the tables are defined."""
+        local = datetime.fromtimestamp(timestamp, pytz.UTC).astimezone(self.denver)
+        season = self.calculator._match_season(local.strftime("%m-%d"))
+        period = self.calculator._match_period(season, local.strftime("%H:%M"))
+        return season, period, TIME_OF_USE_CONFIG[season]["rate"][period]
+
+    def test_table_matches_range_evaluation(self):
+        start = datetime(2023, 12, 30, tzinfo=pytz.UTC).timestamp()
+        # ~13 months at a stride that walks through every minute of the day
+        for timestamp in np.arange(start, start + 400 * 86400, 997 * 60.0):
+            self.assertEqual(tuple(self.calculator.tariff_at(timestamp)), self.reference_rate(timestamp))
+
+    def test_dst_transitions(self):
+        # 2024-03-10 02:00 MST -> 03:00 MDT, 2024-11-03 02:00 MDT -> 01:00 MST
+        before_spring = datetime(2024, 3, 10, 8, 59, tzinfo=pytz.UTC).timestamp()
+        after_spring = before_spring + 60
+        self.assertEqual(self.calculator.minute_index(before_spring) % 1440, 1 * 60 + 59)
+        self.assertEqual(self.calculator.minute_index(after_spring) % 1440, 3 * 60)
+
+        before_fall = datetime(2024, 11, 3, 7, 59, tzinfo=pytz.UTC).timestamp()
+        after_fall = before_fall + 60
+        self.assertEqual(self.calculator.minute_index(before_fall) % 1440, 1 * 60 + 59)
+        self.assertEqual(self.calculator.minute_index(after_fall) % 1440, 1 * 60)
+
+    def test_leap_day_layout(self):
+        mar_1_2023 = self.denver.localize(datetime(2023, 3, 1, 12)).timestamp()
+        mar_1_2024 = self.denver.localize(datetime(2024, 3, 1, 12)).timestamp()
+        self.assertEqual(
+            self.calculator.minute_index(mar_1_2023), self.calculator.minute_index(mar_1_2024)
+        )
+
+    @patch("kasa_exporter.utils.time_of_use_calc.datetime")
+    def test_current_tariff(self, mock_datetime):
+        # 2024-07-10 16:00 MDT, summer on peak
+        mock_datetime.now.return_value = datetime(2024, 7, 10, 22, 0, tzinfo=pytz.UTC)
+        self.assertEqual(tuple(self.calculator.current_tariff()), ("summer", "on_peak", 0.28))
+
+    def test_vectorized_rates_match_scalar(self):
+        start = datetime(2024, 1, 1, tzinfo=pytz.UTC).timestamp()
+        timestamps = start + np.arange(0, 2 * 365 * 86400, 7919 * 60.0)
+        expected = [self.calculator.tariff_at(t).rate for t in timestamps]
+        np.testing.assert_array_equal(self.calculator.rates_at(timestamps), expected)
+        self.assertEqual(
+            list(self.calculator.periods_at(timestamps[:50])),
+            [self.calculator.tariff_at(t).period for t in timestamps[:50]],
+        )
+
+    def test_price_samples_and_energy_cost(self):
+        # 1 kW for two hours straddling summer mid peak (13-15) and on peak (15-19) in Denver
+        start = self.denver.localize(datetime(2024, 7, 10, 14)).timestamp()
+        timestamps = start + np.arange(0, 2 * 3600 + 1, 60.0)
+        watts = np.full(timestamps.shape, 1000.0)
+
+        prices = self.calculator.price_samples(timestamps, watts)
+        self.assertAlmostEqual(prices[0], 0.19)
+        self.assertAlmostEqual(prices[-1], 0.28)
+        # Range ends are inclusive, 15:00 itself still belongs to mid peak
+        self.assertAlmostEqual(
+            self.calculator.energy_cost(timestamps, watts).sum(), (61 * 0.19 + 59 * 0.28) / 60
+        )
+
+    def test_empty_arrays(self):
+        self.assertEqual(self.calculator.rates_at([]).size, 0)
+
+
 if __name__ == "__main__":
     unittest.main()
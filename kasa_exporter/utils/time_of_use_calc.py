@@ -1,7 +1,14 @@
-from datetime import datetime
+from array import array
+from bisect import bisect_right
+import calendar
+from datetime import datetime, timedelta
+from functools import cached_property
+import time
+from typing import NamedTuple
 import pytz
 
 TIME_OF_USE_CONFIG = {
+    "timezone": "America/Denver",
     "season": {
         "summer": ["06-01", "09-30"],  # Example time range for the year
         "winter": ["12-01", "02-28"],  # Example time range for the year
@@ -30,51 +37,253 @@ TIME_OF_USE_CONFIG = {
     },
 }
 
+DEFAULT_TIMEZONE = "America/Denver"
+DEFAULT_SEASON = "summer"
+DEFAULT_PERIOD = "off_peak"
+
+MINUTES_PER_DAY = 24 * 60
+# Tables are laid out on a leap year so Feb 29 has a slot and Mar 1 is always day 60
+DAYS_PER_TABLE = 366
+FEB_29 = 59
+_MONTH_OFFSETS = [0]
+for _days in (31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31):
+    _MONTH_OFFSETS.append(_MONTH_OFFSETS[-1] + _days)
+
+_EPOCH = datetime(1970, 1, 1)
+_LEAP_YEAR = datetime(2000, 1, 1)
+
+
+def day_index(month: int, day: int) -> int:
+    """Index of a calendar day in the leap-year layout of the tables."""
+    return _MONTH_OFFSETS[month - 1] + day - 1
+
+
+class Tariff(NamedTuple):
+    season: str
+    period: str
+    rate: float
+
 
 class TimeOfUseCalc:
+    """Time-of-use pricing backed by tables compiled from the config.
+
+    The season and period range matching (string comparison of "%m-%d" and
+    "%H:%M", first match wins) is evaluated once per day and minute of the
+    year in compile(). A price lookup is then a UTC offset lookup against the
+    precomputed DST transitions of the tariff timezone plus one index into a
+    dense minute-of-year table.
+    """
+
     def __init__(self, config: dict):
         self.config = config
+        self.timezone = pytz.timezone(config.get("timezone", DEFAULT_TIMEZONE))
+        self._transitions = {}
+        self._last_minute = None
+        self._last_tariff = None
+        self.compile()
 
-    def get_current_season(self) -> str:
-        """Determine the current season based on the date."""
-        today = datetime.now().strftime("%m-%d")
+    def adopt(self, other: "TimeOfUseCalc") -> None:
+        """Switch to the config and tables of another calculator, compiled beforehand.
+
+        Holders of this instance (e.g. the extractor's consumption_cost transform)
+        see the new tariff from their next lookup on.
+        """
+        self.__dict__.clear()
+        self.__dict__.update(other.__dict__)
+
+    def _periods_for(self, season: str) -> list:
+        return [period for period in self.config[season] if period != "rate"]
+
+    def compile(self) -> None:
+        self.seasons = list(self.config["season"])
+        if DEFAULT_SEASON not in self.seasons:
+            self.seasons.append(DEFAULT_SEASON)
+        self.periods = []
+        for season in self.seasons:
+            for period in [DEFAULT_PERIOD, *self._periods_for(season)]:
+                if period not in self.periods:
+                    self.periods.append(period)
+
+        # Season of every day of the year, same matching as the string ranges
+        self.season_table = array("B")
+        for day in range(DAYS_PER_TABLE):
+            date = _LEAP_YEAR + timedelta(days=day)
+            season = self._match_season(date.strftime("%m-%d"))
+            self.season_table.append(self.seasons.index(season))
+
+        # Period of every minute of the day, per season
+        self.day_periods = {}
+        for season in self.seasons:
+            minutes = array("B")
+            for minute in range(MINUTES_PER_DAY):
+                hhmm = "%02d:%02d" % divmod(minute, 60)
+                minutes.append(self.periods.index(self._match_period(season, hhmm)))
+            self.day_periods[season] = minutes
+
+        # Dense minute-of-year table, indexed by day_index() * 1440 + minute of day
+        self.period_table = array("B")
+        for day in range(DAYS_PER_TABLE):
+            self.period_table.extend(self.day_periods[self.seasons[self.season_table[day]]])
+        # The rate table (4 MB) is only built for the vectorized API
+        self.__dict__.pop("rate_table", None)
+        self._last_minute = None
+
+    @cached_property
+    def rate_table(self) -> array:
+        """Rate of every minute of the year, laid out like period_table."""
+        day_rates = {}
+        for season, minutes in self.day_periods.items():
+            rates = self.config[season]["rate"]
+            day_rates[season] = array("d", (rates[self.periods[p]] for p in minutes))
+        table = array("d")
+        for day in range(DAYS_PER_TABLE):
+            table.extend(day_rates[self.seasons[self.season_table[day]]])
+        return table
+
+    def _match_season(self, month_day: str) -> str:
         for season, date_range in self.config["season"].items():
             start, end = date_range
             # Handle the case where the season spans across the year-end
-            if start <= today <= end or (start > end and (today >= start or today <= end)):
+            if start <= month_day <= end or (start > end and (month_day >= start or month_day <= end)):
                 return season
         # Default season if not in any range
-        return "summer"  # or whatever default season you prefer
+        return DEFAULT_SEASON
+
+    def _match_period(self, season: str, hour_minute: str) -> str:
+        for period in self._periods_for(season):
+            for start, end in self.config[season][period]:
+                if start <= hour_minute <= end:
+                    return period
+        return DEFAULT_PERIOD
+
+    def _year_transitions(self, year: int):
+        """UTC offset changes of the tariff timezone during a year (UTC seconds)."""
+        transitions = self._transitions.get(year)
+        if transitions is None:
+            start = calendar.timegm((year, 1, 1, 0, 0, 0))
+            end = calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+            times, offsets = [start], [self._utc_offset(start)]
+            # DST changes happen on (at least) minute boundaries, scan hourly then bisect
+            for hour in range(start + 3600, end + 1, 3600):
+                offset = self._utc_offset(hour)
+                if offset != offsets[-1]:
+                    low, high = hour - 3600, hour
+                    while high - low > 1:
+                        mid = (low + high) // 2
+                        if self._utc_offset(mid) == offset:
+                            high = mid
+                        else:
+                            low = mid
+                    times.append(high)
+                    offsets.append(offset)
+            transitions = self._transitions[year] = (times, offsets)
+        return transitions
+
+    def _utc_offset(self, timestamp: int) -> int:
+        local = self.timezone.fromutc(_EPOCH + timedelta(seconds=timestamp))
+        return int(local.utcoffset().total_seconds())
+
+    def minute_index(self, timestamp: float) -> int:
+        """Local minute-of-year table index for a UTC epoch timestamp."""
+        times, offsets = self._year_transitions(time.gmtime(timestamp).tm_year)
+        local = time.gmtime(timestamp + offsets[bisect_right(times, timestamp) - 1])
+        day = local.tm_yday - 1
+        if day >= FEB_29 and not calendar.isleap(local.tm_year):
+            day += 1
+        return day * MINUTES_PER_DAY + local.tm_hour * 60 + local.tm_min
+
+    def tariff_at(self, timestamp: float) -> Tariff:
+        minute = int(timestamp // 60)
+        # Every device in a cycle prices the same minute, keep the last answer
+        if minute != self._last_minute:
+            index = self.minute_index(timestamp)
+            season = self.seasons[self.season_table[index // MINUTES_PER_DAY]]
+            period = self.periods[self.period_table[index]]
+            self._last_tariff = Tariff(season, period, self.config[season]["rate"][period])
+            self._last_minute = minute
+        return self._last_tariff
+
+    def current_tariff(self) -> Tariff:
+        return self.tariff_at(datetime.now(pytz.UTC).timestamp())
+
+    def get_current_season(self) -> str:
+        """Determine the current season based on the date."""
+        today = datetime.now()
+        return self.seasons[self.season_table[day_index(today.month, today.day)]]
 
     def get_rate_name(self, current_time: datetime, season: str) -> str:
         """Determine the rate name based on the current time and time ranges."""
-        current_time_str = current_time.strftime("%H:%M")
-        for period, ranges in self.config[season].items():
-            if period == "rate":
-                continue
-            for start, end in ranges:
-                if start <= current_time_str <= end:
-                    return period
-        return "off_peak"
-    
+        minute = current_time.hour * 60 + current_time.minute
+        return self.periods[self.day_periods[season][minute]]
+
     def get_rate_for_time(self, current_time: datetime, season: str) -> float:
         """Determine the rate based on the current time and time ranges."""
-        current_time_str = current_time.strftime("%H:%M")
-        for period, ranges in self.config[season].items():
-            if period == "rate":
-                continue
-            for start, end in ranges:
-                if start <= current_time_str <= end:
-                    return self.config[season]["rate"][period]
-        return self.config[season]["rate"][
-            "off_peak"
-        ]  # Default rate if not in any range
+        return self.config[season]["rate"][self.get_rate_name(current_time, season)]
 
     def calc_rate(self, current_consumption: float) -> float:
         """Calculate the instantaneous cost of the current consumption."""
-        self.current_season = self.get_current_season()
-        current_time = datetime.now(pytz.timezone("UTC")).astimezone(
-            pytz.timezone("America/Denver")
-        )  # Adjust timezone as needed
-        rate = self.get_rate_for_time(current_time, self.current_season)
-        return round((current_consumption / 1000) * rate, 6)
+        tariff = self.current_tariff()
+        self.current_season = tariff.season
+        return round((current_consumption / 1000) * tariff.rate, 6)
+
+    # Vectorized API, prices whole arrays of samples at once (numpy is imported lazily
+    # so the live exporter path does not pay for it)
+
+    def minute_indexes(self, timestamps):
+        import numpy as np
+
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        if timestamps.size == 0:
+            return np.zeros(0, dtype=np.int64)
+        seconds = np.floor(timestamps).astype(np.int64)
+        first = time.gmtime(int(seconds.min())).tm_year
+        last = time.gmtime(int(seconds.max())).tm_year
+        times, offsets = [], []
+        for year in range(first, last + 1):
+            year_times, year_offsets = self._year_transitions(year)
+            times.extend(year_times)
+            offsets.extend(year_offsets)
+        position = np.searchsorted(np.asarray(times), seconds, side="right") - 1
+        local = seconds + np.asarray(offsets, dtype=np.int64)[position]
+
+        days = local // 86400
+        dates = days.astype("datetime64[D]")
+        years = dates.astype("datetime64[Y]")
+        day = (dates - years.astype("datetime64[D]")).astype(np.int64)
+        year = years.astype(np.int64) + 1970
+        leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+        day = day + ((day >= FEB_29) & ~leap)
+        return day * MINUTES_PER_DAY + (local % 86400) // 60
+
+    def rates_at(self, timestamps):
+        """Tariff rate ($/kWh) in effect at each UTC epoch timestamp."""
+        import numpy as np
+
+        table = np.frombuffer(self.rate_table, dtype=np.float64)
+        return table[self.minute_indexes(timestamps)]
+
+    def periods_at(self, timestamps):
+        """Rate period name in effect at each UTC epoch timestamp."""
+        import numpy as np
+
+        table = np.frombuffer(self.period_table, dtype=np.uint8)
+        return np.asarray(self.periods)[table[self.minute_indexes(timestamps)]]
+
+    def price_samples(self, timestamps, watts):
+        """Instantaneous cost ($/h) of each (timestamp, watts) sample, like calc_rate."""
+        import numpy as np
+
+        return np.asarray(watts, dtype=np.float64) / 1000 * self.rates_at(timestamps)
+
+    def energy_cost(self, timestamps, watts):
+        """Cost ($) of each interval between consecutive samples.
+
+        Each sample's power is held until the next sample (left Riemann sum) and
+        priced at the rate in effect when it was taken. The result has one
+        entry less than the input, sum() it for the total.
+        """
+        import numpy as np
+
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        hours = np.diff(timestamps) / 3600
+        return self.price_samples(timestamps[:-1], np.asarray(watts)[:-1]) * hours